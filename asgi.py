@@ -0,0 +1,173 @@
+"""
+Omi App Webhook Server - ASGI Application
+
+Asyncio-native serving mode for the webhook server. Request bodies are
+received on the event loop, so slow clients streaming audio only cost an
+idle coroutine instead of a blocked worker. Once a request has been fully
+received it is dispatched to the same Flask `app` (and therefore the same
+`webhook()` route and handlers) on a small thread pool.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 32768
+or set SERVER_MODE=asgi and start `python server.py`.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads used to run the (synchronous) Flask handlers
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 32))
+
+# Bodies larger than this are spooled to a temporary file while receiving
+ASGI_SPOOL_BYTES = int(os.getenv('ASGI_SPOOL_BYTES', 1024 * 1024))
+
+
+class AsgiWebhookApp:
+    """ASGI adapter that receives requests asynchronously and dispatches them to a WSGI app"""
+
+    def __init__(self, wsgi_app, on_shutdown=None, max_threads=ASGI_THREADS, spool_bytes=ASGI_SPOOL_BYTES):
+        self.wsgi_app = wsgi_app
+        self.on_shutdown = on_shutdown
+        self.spool_bytes = spool_bytes
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='asgi-dispatch')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        """Handle server startup and shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.on_shutdown:
+                    self.on_shutdown()
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        """Receive the full body without blocking, then dispatch to the WSGI app"""
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        try:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                more_body = message.get('more_body', False)
+            content_length = body.tell()
+            body.seek(0)
+
+            environ = build_environ(scope, body, content_length)
+            loop = asyncio.get_running_loop()
+            status, headers, chunks = await loop.run_in_executor(
+                self.executor, self.run_wsgi, environ
+            )
+
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': headers
+            })
+
+            # Iterate the WSGI response on the pool so generator responses stream
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                if hasattr(chunks, 'close'):
+                    await loop.run_in_executor(self.executor, chunks.close)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            body.close()
+
+    def run_wsgi(self, environ):
+        """Call the WSGI app and return (status, headers, body iterator)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        result = self.wsgi_app(environ, start_response)
+        iterator = iter(result)
+
+        # start_response may be deferred until the first chunk is produced
+        first = next(iterator, None) if 'status' not in response else b''
+
+        def chunks():
+            try:
+                if first:
+                    yield first
+                yield from iterator
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        return response['status'], response['headers'], chunks()
+
+
+def build_environ(scope, body, content_length):
+    """Build a WSGI environ dict from an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(content_length),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+
+    return environ
+
+
+def __getattr__(name):
+    # `application` is built on first access so `python server.py` can use
+    # AsgiWebhookApp without importing server a second time as a module
+    if name == 'application':
+        from server import app, cleanup
+        global application
+        application = AsgiWebhookApp(app, on_shutdown=cleanup)
+        return application
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
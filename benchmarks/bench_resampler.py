@@ -0,0 +1,53 @@
+"""
+Omi App Webhook Server - Resampler Benchmark
+
+Measures polyphase resampler throughput in input samples per second on a
+single core, streaming chunk by chunk as the audio handler does.
+
+Run with:
+    python benchmarks/bench_resampler.py
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Add the project root to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.resampler import PolyphaseResampler
+
+CONVERSIONS = [(8000, 16000), (16000, 8000)]
+
+
+def bench_conversion(from_rate, to_rate, seconds, chunk_ms):
+    """Return input samples processed per second for one rate conversion"""
+    t = np.arange(int(from_rate * seconds)) / from_rate
+    audio = (np.sin(2 * np.pi * 440 * t) * 10000).astype('<i2')
+    chunk = from_rate * chunk_ms // 1000
+    resampler = PolyphaseResampler(from_rate, to_rate)
+
+    start = time.perf_counter()
+    for offset in range(0, len(audio), chunk):
+        resampler.process(audio[offset:offset + chunk])
+    elapsed = time.perf_counter() - start
+    return len(audio) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PCM resampler')
+    parser.add_argument('--seconds', type=float, default=60.0, help='Audio duration per conversion')
+    parser.add_argument('--chunk-ms', type=int, default=1000, help='Chunk size in milliseconds')
+    args = parser.parse_args()
+
+    print(f"Resampling {args.seconds:.0f}s of audio in {args.chunk_ms}ms chunks (single core)")
+    for from_rate, to_rate in CONVERSIONS:
+        rate = bench_conversion(from_rate, to_rate, args.seconds, args.chunk_ms)
+        print(f"{from_rate:>6} -> {to_rate:<6} {rate / 1e6:8.2f} M samples/s "
+              f"({rate / from_rate:8.0f}x realtime)")
+
+
+if __name__ == '__main__':
+    main()
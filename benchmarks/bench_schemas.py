@@ -0,0 +1,141 @@
+"""
+Omi App Webhook Server - Schema Validation Benchmark
+
+Compares the compiled schema validators with the per-call dict and loop
+validation the handlers used before, on large transcript payloads.
+
+Run with:
+    python benchmarks/bench_schemas.py
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from events.schemas import validate_memory, validate_segments
+
+
+def loop_validate_segments(data):
+    """Segment validation as previously done in handle_transcript_webhook"""
+    for segment in data:
+        required_fields = ['text', 'speaker', 'speakerId', 'is_user', 'start', 'end']
+        for field in required_fields:
+            if field not in segment:
+                return f'Missing required field in segment: {field}'
+        if not isinstance(segment['text'], str):
+            return 'text must be string'
+        if not isinstance(segment['speaker'], str):
+            return 'speaker must be string'
+        if not isinstance(segment['speakerId'], int):
+            return 'speakerId must be integer'
+        if not isinstance(segment['is_user'], bool):
+            return 'is_user must be boolean'
+        if not (isinstance(segment['start'], (int, float)) and isinstance(segment['end'], (int, float))):
+            return 'start and end must be numbers'
+        if segment['start'] > segment['end']:
+            return 'start time must be <= end time'
+    return None
+
+
+def loop_validate_memory(memory):
+    """Memory validation as previously done in handle_memory_created"""
+    required_fields = {
+        'id': str,
+        'created_at': str,
+        'transcript': str,
+        'transcript_segments': list,
+        'structured': dict
+    }
+    for field, field_type in required_fields.items():
+        if field not in memory:
+            return f'Missing required field: {field}'
+        if not isinstance(memory[field], field_type):
+            return f'Invalid type for {field}'
+    structured_fields = {
+        'title': str,
+        'overview': str,
+        'emoji': str,
+        'category': str,
+        'action_items': list,
+        'events': list
+    }
+    for field, field_type in structured_fields.items():
+        if field not in memory['structured']:
+            return f'Missing structured field: {field}'
+        if not isinstance(memory['structured'][field], field_type):
+            return f'Invalid type for structured.{field}'
+    return None
+
+
+def build_segments(count):
+    return [
+        {
+            'text': f'Segment {i}',
+            'speaker': f'SPEAKER_0{i % 2}',
+            'speakerId': i % 2,
+            'is_user': i % 2 == 0,
+            'start': i * 2.0,
+            'end': i * 2.0 + 1.5
+        }
+        for i in range(count)
+    ]
+
+
+def build_memory(segments):
+    return {
+        'id': 'bench-memory',
+        'created_at': '2024-03-19T12:00:00Z',
+        'transcript': 'Benchmark',
+        'transcript_segments': segments,
+        'structured': {
+            'title': 'Benchmark',
+            'overview': 'Benchmark memory',
+            'emoji': '📝',
+            'category': 'personal',
+            'action_items': [],
+            'events': []
+        }
+    }
+
+
+def timeit(fn, arg, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - start) / iterations
+
+
+def report(name, baseline, candidate):
+    print(f"{name:<32} loop {baseline * 1e6:10.1f} us   compiled {candidate * 1e6:10.1f} us   "
+          f"{baseline / candidate:5.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark payload schema validation')
+    parser.add_argument('--segments', type=int, default=10000, help='Segments per transcript payload')
+    parser.add_argument('--iterations', type=int, default=50, help='Iterations per measurement')
+    args = parser.parse_args()
+
+    segments = build_segments(args.segments)
+    invalid = build_segments(args.segments)
+    invalid[-1]['start'] = invalid[-1]['end'] + 1
+    memory = build_memory(segments)
+
+    assert loop_validate_segments(segments) == validate_segments(segments) is None
+    assert loop_validate_segments(invalid) == validate_segments(invalid)
+    assert loop_validate_memory(memory) == validate_memory(memory) is None
+
+    n = args.iterations
+    report(f'{args.segments} valid segments',
+           timeit(loop_validate_segments, segments, n), timeit(validate_segments, segments, n))
+    report(f'{args.segments} segments, last invalid',
+           timeit(loop_validate_segments, invalid, n), timeit(validate_segments, invalid, n))
+    report('memory_created payload',
+           timeit(loop_validate_memory, memory, n * 1000), timeit(validate_memory, memory, n * 1000))
+
+
+if __name__ == '__main__':
+    main()
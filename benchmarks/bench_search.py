@@ -0,0 +1,69 @@
+"""
+Omi App Webhook Server - Search Benchmark
+
+Builds a search index of synthetic transcript segments spread over many
+users and measures per-user query latency.
+
+Run with:
+    python benchmarks/bench_search.py --segments 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.search_index import SearchIndex
+
+VOCABULARY = [f'word{i}' for i in range(20000)] + ['budget', 'meeting', 'project'] * 50
+
+QUERIES = ['budget', 'budget meeting', 'word123', 'proj*', 'word12*']
+
+
+def build_index(path, segments, users, seed):
+    random.seed(seed)
+    index = SearchIndex(path=path, enabled=True, batch_size=2000, queue_size=100000)
+    per_session = 1000
+    for session in range(segments // per_session):
+        index.index_segments(f'user{session % users}', f'session{session}', [
+            {'text': ' '.join(random.choices(VOCABULARY, k=12)), 'start': float(i)}
+            for i in range(per_session)
+        ])
+    index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full-text search')
+    parser.add_argument('--segments', type=int, default=200000, help='Segments to index')
+    parser.add_argument('--users', type=int, default=500, help='Users the segments are spread over')
+    parser.add_argument('--iterations', type=int, default=50, help='Iterations per query')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'search.db')
+
+        start = time.perf_counter()
+        build_index(path, args.segments, args.users, args.seed)
+        elapsed = time.perf_counter() - start
+        print(f"Indexed {args.segments} segments in {elapsed:.1f}s "
+              f"({args.segments / elapsed:,.0f} segments/s)")
+
+        index = SearchIndex(path=path, enabled=True)
+        for query in QUERIES:
+            index.search('user7', query)
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                results = index.search('user7', query)
+            latency = (time.perf_counter() - start) / args.iterations
+            print(f"{query!r:<20} {len(results):3d} results   {latency * 1e3:8.2f} ms")
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+"""
+Omi App Webhook Server - Load Test
+
+Replays realistic webhook mixes at a configurable concurrency, either
+against the Flask app in-process (no network, isolated data directory) or
+against a running server over HTTP, and reports throughput, latency
+percentiles and memory use per scenario.
+
+Results can be saved as JSON and compared with an earlier run; the run
+fails when a scenario's p95 latency or throughput regresses by more than
+the tolerance.
+
+Run with:
+    python benchmarks/loadtest.py --requests 500 --concurrency 8
+    python benchmarks/loadtest.py --url http://localhost:32768 --server-pid 1234
+    python benchmarks/loadtest.py --save results.json
+    python benchmarks/loadtest.py --baseline results.json --tolerance 0.2
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+
+DEFAULT_SECRET = 'loadtest-secret'
+
+SCENARIOS = [
+    'pcm16k', 'pcm8k', 'memory_large', 'transcript_10', 'transcript_100', 'transcript_1000', 'mix'
+]
+
+# Weights of the scenarios making up the 'mix' scenario (roughly what one device sends)
+MIX = [('pcm16k', 8), ('transcript_10', 4), ('memory_large', 1)]
+
+
+def pcm_chunk(sample_rate, seconds=1.0):
+    """Little-endian 16-bit PCM: a tone with some noise"""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    samples = 6000 * np.sin(2 * np.pi * 220 * t) + np.random.default_rng(0).normal(0, 300, t.size)
+    return samples.astype('<i2').tobytes()
+
+
+def build_segments(count, offset=0.0):
+    return [
+        {
+            'text': f'Segment number {i} with a few more words of speech',
+            'speaker': f'SPEAKER_0{i % 3}',
+            'speakerId': i % 3,
+            'is_user': i % 3 == 0,
+            'start': offset + i * 2.0,
+            'end': offset + i * 2.0 + 1.5
+        }
+        for i in range(count)
+    ]
+
+
+def build_memory(memory_id, segments=500):
+    segment_list = build_segments(segments)
+    return {
+        'type': 'memory_created',
+        'memory': {
+            'id': memory_id,
+            'created_at': '2024-03-19T12:00:00Z',
+            'started_at': '2024-03-19T11:55:00Z',
+            'finished_at': '2024-03-19T12:00:00Z',
+            'transcript': ' '.join(segment['text'] for segment in segment_list),
+            'transcript_segments': segment_list,
+            'photos': [],
+            'structured': {
+                'title': 'Load test memory',
+                'overview': 'A long conversation recorded for load testing',
+                'emoji': '📝',
+                'category': 'personal',
+                'action_items': [{'description': f'Action {i}', 'completed': False} for i in range(10)],
+                'events': []
+            }
+        }
+    }
+
+
+class RequestFactory:
+    """Builds (scenario, query, body, content type) for each request of a scenario"""
+
+    def __init__(self):
+        self.pcm = {16000: pcm_chunk(16000), 8000: pcm_chunk(8000)}
+        self.counter = itertools.count()
+        self.mix = [name for name, weight in MIX for _ in range(weight)]
+
+    def build(self, scenario, worker):
+        n = next(self.counter)
+        uid = f'load-user-{worker}'
+        if scenario == 'mix':
+            scenario = self.mix[n % len(self.mix)]
+
+        if scenario in ('pcm16k', 'pcm8k'):
+            sample_rate = 16000 if scenario == 'pcm16k' else 8000
+            query = {'uid': uid, 'sample_rate': sample_rate}
+            return scenario, query, self.pcm[sample_rate], 'application/octet-stream'
+        if scenario == 'memory_large':
+            # Unique ids so the idempotency cache does not answer for the handlers
+            body = json.dumps(build_memory(f'load-memory-{os.getpid()}-{n}')).encode()
+            return scenario, {'uid': uid}, body, 'application/json'
+        if scenario.startswith('transcript_'):
+            count = int(scenario.split('_')[1])
+            query = {'uid': uid, 'session_id': f'load-session-{worker}'}
+            body = json.dumps(build_segments(count, offset=n * count * 2.0)).encode()
+            return scenario, query, body, 'application/json'
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+class InProcessClient:
+    """Calls the Flask app directly through its test client"""
+
+    def __init__(self, secret):
+        from server import app
+        self.app = app
+        self.secret = secret
+        self.local = threading.local()
+
+    def post(self, query, body, content_type):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.post(
+            '/webhook', query_string={**query, 'key': self.secret},
+            data=body, content_type=content_type
+        )
+        return response.status_code
+
+
+class HttpClient:
+    """Posts to a running server over pooled keep-alive connections"""
+
+    def __init__(self, url, secret, concurrency):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.url = url.rstrip('/') + '/webhook'
+        self.secret = secret
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, query, body, content_type):
+        response = self.session.post(
+            self.url, params={**query, 'key': self.secret},
+            data=body, headers={'Content-Type': content_type}
+        )
+        return response.status_code
+
+
+def rss_mb(pid=None):
+    """Resident set size in MB of pid (or this process)"""
+    path = f'/proc/{pid or "self"}/status'
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(client, factory, scenario, requests_count, concurrency, rss_pid):
+    """Send requests_count requests of a scenario and return its statistics"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    # Build payloads up front so the timed loop only measures the server
+    payloads = [
+        factory.build(scenario, i % concurrency) for i in range(requests_count)
+    ]
+
+    def worker(index):
+        own_latencies = []
+        own_errors = 0
+        for _, query, body, content_type in payloads[index::concurrency]:
+            start = time.perf_counter()
+            try:
+                status = client.post(query, body, content_type)
+            except Exception:
+                status = None
+            own_latencies.append(time.perf_counter() - start)
+            if status != 200:
+                own_errors += 1
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': requests_count,
+        'errors': sum(errors),
+        'throughput': requests_count / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'rss_mb': rss_mb(rss_pid)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return descriptions of scenarios that regressed against the baseline"""
+    regressions = []
+    for scenario, stats in results.items():
+        previous = baseline.get('results', {}).get(scenario)
+        if not previous:
+            continue
+        if stats['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{scenario}: p95 {previous['p95_ms']:.2f} ms -> {stats['p95_ms']:.2f} ms"
+            )
+        if stats['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(
+                f"{scenario}: throughput {previous['throughput']:.0f} -> {stats['throughput']:.0f} req/s"
+            )
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=Path(__file__).parent, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the webhook server')
+    parser.add_argument('--url', help='Server base URL (default: run the app in-process)')
+    parser.add_argument('--secret', default=os.getenv('WEBHOOK_SECRET') or DEFAULT_SECRET,
+                        help='Webhook key')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--server-pid', type=int, help='Report RSS of this server process (HTTP mode)')
+    parser.add_argument('--save', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with results saved by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed p95/throughput regression against the baseline (fraction)')
+    args = parser.parse_args()
+
+    if args.url:
+        client = HttpClient(args.url, args.secret, args.concurrency)
+        rss_pid = args.server_pid
+    else:
+        # Isolate the in-process app's on-disk state and output from the real deployment
+        data_dir = tempfile.mkdtemp(prefix='omi-loadtest-')
+        os.environ['WEBHOOK_SECRET'] = args.secret
+        os.environ.setdefault('DATA_DIR', data_dir)
+        os.environ.setdefault('LOG_FILE', '')
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        client = InProcessClient(args.secret)
+        rss_pid = None
+
+    factory = RequestFactory()
+    scenarios = args.scenario or SCENARIOS
+    target = args.url or 'in-process'
+    print(f"Load testing {target}: {args.requests} requests per scenario, concurrency {args.concurrency}")
+    print(f"{'scenario':<16} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'max ms':>9} {'errors':>7} {'RSS MB':>8}")
+
+    results = {}
+    for scenario in scenarios:
+        stats = run_scenario(client, factory, scenario, args.requests, args.concurrency, rss_pid)
+        results[scenario] = stats
+        rss = f"{stats['rss_mb']:8.1f}" if stats['rss_mb'] is not None else f"{'-':>8}"
+        print(f"{scenario:<16} {stats['throughput']:9.1f} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+              f"{stats['p99_ms']:9.2f} {stats['max_ms']:9.2f} {stats['errors']:7d} {rss}")
+
+    if not args.url:
+        from server import cleanup
+        cleanup()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    run = {
+        'timestamp': time.time(),
+        'revision': git_revision(),
+        'target': target,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'results': results
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved results to {args.save}")
+
+    failed = any(stats['errors'] for stats in results.values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            failed = True
+            print(f"\nRegressions against {args.baseline} (revision {baseline.get('revision')}):")
+            for regression in regressions:
+                print(f"  {regression}")
+        else:
+            print(f"\nNo regressions against {args.baseline}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
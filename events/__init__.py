@@ -4,15 +4,25 @@ Omi App Webhook Server - Event Handlers Package
 from flask import jsonify
 
 # Import all event handlers and their constants
-from .memory_events import MEMORY_EVENTS, handle_memory_webhook
+from .memory_events import MEMORY_EVENTS, REPLAYED_HEADER, handle_memory_webhook, idempotent_memory_events
 from .audio_events import AUDIO_EVENTS, handle_audio_webhook
 from .transcript_events import TRANSCRIPT_EVENTS, handle_transcript_webhook
+from .system_events import SYSTEM_EVENTS, handle_system_webhook
+from .registry import EVENT_PLUGINS, EventHandler, EventRegistry, event_registry
 
 __all__ = [
     'MEMORY_EVENTS',
+    'REPLAYED_HEADER',
     'AUDIO_EVENTS',
     'TRANSCRIPT_EVENTS',
+    'SYSTEM_EVENTS',
     'handle_memory_webhook',
+    'idempotent_memory_events',
     'handle_audio_webhook',
-    'handle_transcript_webhook'
+    'handle_transcript_webhook',
+    'handle_system_webhook',
+    'EVENT_PLUGINS',
+    'EventHandler',
+    'EventRegistry',
+    'event_registry'
 ]
@@ -4,10 +4,18 @@ Omi App Webhook Server - Audio Event Handlers
 Handles real-time audio streaming from Omi app's DevKit1 and DevKit2 devices.
 Based on Omi's audio streaming protocol.
 """
-import json
 import logging
 from flask import jsonify, request
 import os
+from services.audio_analysis import PcmAnalysisStage, audio_stats
+from services.audio_archive import audio_archive
+from services.audio_buffer import audio_sessions
+from services.audio_stream import AudioStreamError, read_audio_body
+from services.job_queue import job_queue
+from services.json_codec import dumps, json_response
+from services.opus_decoder import AUDIO_OPUS_DECODE, DecoderBusy, OpusDecodeStage, opus_decoder_pool
+from services.resampler import ResampleStage, output_sample_rate, resamplers
+from .registry import event_registry
 
 logger = logging.getLogger('events.audio_events')
 
@@ -17,6 +25,9 @@ AUDIO_EVENTS = []  # No event types needed - Omi sends raw audio
 # Get event logging preference
 LOG_EVENTS = os.getenv('LOG_EVENTS', 'false').lower() in ('true', '1', 'yes')
 
+# Precomputed success response body
+SUCCESS = dumps({'message': 'Success'})
+
 def handle_audio_webhook(event_type, data, uid):
     """Handle audio streaming from Omi App"""
     # Get sample rate and codec from query params
@@ -39,17 +50,57 @@ def handle_audio_webhook(event_type, data, uid):
     if codec not in ['pcm', 'opus']:
         return jsonify({'error': 'Invalid codec. Must be pcm or opus'}), 400
 
-    # Get raw audio bytes from request body
-    audio_bytes = request.get_data()
+    # Claim room for the follow-up job before anything is buffered, so a
+    # full queue is a 503 the Omi app can retry without storing audio twice
+    reservation = job_queue.reserve()
+    try:
+        # Stream the body in fixed-size chunks into the user's session buffer
+        # and the audio archive. Opus is optionally decoded to PCM first; PCM
+        # is normalized to the target rate and analyzed on the way so silent
+        # chunks can be dropped.
+        decode_opus = codec == 'opus' and AUDIO_OPUS_DECODE
+        stored_codec = 'pcm' if decode_opus else codec
+        stored_rate = output_sample_rate(sample_rate, stored_codec)
+        sink = audio_sessions.writer(uid, stored_rate, stored_codec)
+        sink = audio_archive.stage(sink, uid, stored_rate, stored_codec)
+        if stored_codec == 'pcm':
+            sink = PcmAnalysisStage(sink, uid, stored_rate, audio_stats)
+            if stored_rate != sample_rate:
+                sink = ResampleStage(sink, resamplers, uid, sample_rate)
+        if decode_opus:
+            try:
+                sink = OpusDecodeStage(sink, opus_decoder_pool, uid, sample_rate)
+            except DecoderBusy:
+                return jsonify({'error': 'Audio decoder busy'}), 503
+
+        try:
+            audio_length = read_audio_body(request.stream, request.content_length, sink, codec)
+        except AudioStreamError as e:
+            return jsonify({'error': e.message}), e.status_code
 
-    if not audio_bytes:
-        return jsonify({'error': 'Missing audio data'}), 400
+        # Audio is already buffered; follow-up work runs on a background worker
+        reservation.submit(process_audio_chunk, uid, sample_rate, codec, audio_length)
+    finally:
+        reservation.cancel()
 
-    # Only validate even length for PCM
-    if codec == 'pcm' and len(audio_bytes) % 2 != 0:
-        return jsonify({'error': 'Invalid PCM audio data length'}), 400
+    return json_response(SUCCESS), 200
 
+def process_audio_chunk(uid, sample_rate, codec, audio_length):
+    """Process metadata of an accepted audio chunk (runs on the job queue)"""
     if LOG_EVENTS:
-        logger.info(f"Received {len(audio_bytes)} bytes of {sample_rate}Hz {codec} audio from user {uid}")
+        logger.info('Audio chunk received', extra={
+            'uid': uid, 'bytes': audio_length, 'sample_rate': sample_rate, 'codec': codec
+        })
+
+def audio_fields(event_type, data):
+    """Event log fields of an audio chunk (only metadata, the audio itself is buffered)"""
+    return {
+        'sample_rate': request.args.get('sample_rate'),
+        'codec': request.args.get('codec', 'pcm'),
+        'length': request.content_length
+    }
 
-    return jsonify({'message': 'Success'}), 200
+# Raw audio is recognized by its content type, before the body is read
+event_registry.register(
+    handle_audio_webhook, content_type='application/octet-stream', route='audio', kind='audio', fields=audio_fields
+)
@@ -2,10 +2,16 @@
 Omi App Webhook Server - Memory Event Handlers
 Handles all memory-related events from message_event.dart
 """
-import json
 import logging
-from flask import jsonify
+from flask import g, jsonify
 import os
+from services.idempotency import idempotency_cache, idempotency_key
+from services.job_queue import job_queue
+from services.json_codec import dumps, json_response
+from services.search_index import search_index
+from services.storage import storage
+from .registry import event_registry
+from .schemas import validate_memory
 
 logger = logging.getLogger('events.memory_events')
 
@@ -22,6 +28,17 @@ MEMORY_EVENTS = [
 # Get event logging preference
 LOG_EVENTS = os.getenv('LOG_EVENTS', 'false').lower() in ('true', '1', 'yes')
 
+# Precomputed success response bodies
+MEMORY_PROCESSED = dumps({'message': 'Memory processed successfully'})
+FAILURE_LOGGED = dumps({'message': 'Failure logged'})
+PROCESSING_MEMORY_CREATED = dumps({'message': 'Processing memory created'})
+PROCESSING_STARTED = dumps({'message': 'Processing started'})
+STATUS_UPDATED = dumps({'message': 'Status updated'})
+MEMORY_SYNCED = dumps({'message': 'Memory synced'})
+
+# Header marking a response replayed from the idempotency cache
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
 def handle_memory_webhook(event_type, data, uid):
     """Handle memory events from Omi App
 
@@ -58,16 +75,7 @@ def handle_memory_webhook(event_type, data, uid):
         }
     }
     """
-    handlers = {
-        'memory_created': handle_memory_created,
-        'new_memory_create_failed': handle_memory_creation_failed,
-        'new_processing_memory_created': handle_processing_memory_created,
-        'memory_processing_started': handle_memory_processing_started,
-        'processing_memory_status_changed': handle_memory_processing_status,
-        'memory_backward_synced': handle_memory_synced
-    }
-
-    handler = handlers.get(event_type)
+    handler = MEMORY_HANDLERS.get(event_type)
     if not handler:
         return jsonify({'error': 'Unknown memory event type'}), 400
 
@@ -77,78 +85,129 @@ def handle_memory_webhook(event_type, data, uid):
 
     return handler(data.get('memory', data), uid)
 
+def idempotent_memory_events(handler, call_next):
+    """Event registry middleware answering redeliveries of memory events with the original response
+
+    Must be registered outside the middleware that makes events durable:
+    a response is only remembered once that returned, so a delivery that
+    was refused (503) is processed again when the Omi app retries it.
+    Inside a batch (`g.idempotent_responses` set) responses are collected
+    for the batch to remember after its single fsync wait.
+    """
+    if handler.func is not handle_memory_webhook:
+        return call_next
+
+    def call(event_type, data, uid, **params):
+        key = idempotency_key(uid, event_type, data)
+        cached = idempotency_cache.get(key)
+        if cached:
+            status_code, body = cached
+            response = json_response(body)
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response, status_code
+
+        response, status_code = call_next(event_type, data, uid, **params)
+        if status_code == 200:
+            pending = g.get('idempotent_responses')
+            if pending is None:
+                idempotency_cache.put(key, status_code, response.get_data())
+            else:
+                pending.append((key, status_code, response.get_data()))
+        return response, status_code
+    return call
+
 def handle_memory_created(memory, uid):
     """Handle new memory creation events"""
     if not memory:
         return jsonify({'error': 'Missing memory data'}), 400
 
-    # Validate required memory fields based on Omi format
-    required_fields = {
-        'id': str,
-        'created_at': str,
-        'transcript': str,
-        'transcript_segments': list,
-        'structured': dict
-    }
+    # Validate memory and structured fields against the Omi format (see schemas.py)
+    error = validate_memory(memory)
+    if error:
+        return jsonify({'error': error}), 400
 
-    for field, field_type in required_fields.items():
-        if field not in memory:
-            return jsonify({'error': f'Missing required field: {field}'}), 400
-        if not isinstance(memory[field], field_type):
-            return jsonify({'error': f'Invalid type for {field}'}), 400
-
-    # Validate structured data format
-    structured_fields = {
-        'title': str,
-        'overview': str,
-        'emoji': str,
-        'category': str,
-        'action_items': list,
-        'events': list
-    }
-
-    for field, field_type in structured_fields.items():
-        if field not in memory['structured']:
-            return jsonify({'error': f'Missing structured field: {field}'}), 400
-        if not isinstance(memory['structured'][field], field_type):
-            return jsonify({'error': f'Invalid type for structured.{field}'}), 400
-
-    if LOG_EVENTS:
-        logger.info(f"Memory created: {json.dumps(memory, indent=2)}")
+    # Acknowledge now, process on a background worker
+    job_queue.submit(process_memory_created, memory, uid)
 
-    return jsonify({'message': 'Memory processed successfully'}), 200
+    return json_response(MEMORY_PROCESSED), 200
 
 def handle_memory_creation_failed(data, uid):
     """Handle failed memory creation events"""
-    if LOG_EVENTS:
-        logger.error(f"Memory creation failed for user {uid}")
-        logger.error(f"Error data: {json.dumps(data, indent=2)}")
-    return jsonify({'message': 'Failure logged'}), 200
+    job_queue.submit(process_memory_creation_failed, data, uid)
+    return json_response(FAILURE_LOGGED), 200
 
 def handle_processing_memory_created(data, uid):
     """Handle new processing memory created events"""
-    if LOG_EVENTS:
-        logger.info(f"New processing memory created for user {uid}")
-        logger.info(f"Processing memory: {json.dumps(data, indent=2)}")
-    return jsonify({'message': 'Processing memory created'}), 200
+    job_queue.submit(process_processing_memory_created, data, uid)
+    return json_response(PROCESSING_MEMORY_CREATED), 200
 
 def handle_memory_processing_started(data, uid):
     """Handle memory processing started events"""
-    if LOG_EVENTS:
-        logger.info(f"Memory processing started for user {uid}")
-        logger.info(f"Processing data: {json.dumps(data, indent=2)}")
-    return jsonify({'message': 'Processing started'}), 200
+    job_queue.submit(process_memory_processing_started, data, uid)
+    return json_response(PROCESSING_STARTED), 200
 
 def handle_memory_processing_status(data, uid):
     """Handle memory processing status change events"""
-    if LOG_EVENTS:
-        logger.info(f"Memory processing status changed for user {uid}")
-        logger.info(f"Status data: {json.dumps(data, indent=2)}")
-    return jsonify({'message': 'Status updated'}), 200
+    job_queue.submit(process_memory_processing_status, data, uid)
+    return json_response(STATUS_UPDATED), 200
 
 def handle_memory_synced(data, uid):
     """Handle memory backward sync events"""
+    job_queue.submit(process_memory_synced, data, uid)
+    return json_response(MEMORY_SYNCED), 200
+
+# Background processing, run by the job queue after the webhook was acknowledged
+
+def process_memory_created(memory, uid):
+    """Process a validated new memory"""
+    storage.save_memory(uid, memory)
+    search_index.index_memory(uid, memory)
+
+    if LOG_EVENTS:
+        logger.info('Memory created', extra={'uid': uid, 'memory': memory})
+
+def process_memory_creation_failed(data, uid):
+    """Process a failed memory creation event"""
+    if LOG_EVENTS:
+        logger.error('Memory creation failed', extra={'uid': uid, 'data': data})
+
+def process_processing_memory_created(data, uid):
+    """Process a new processing memory"""
+    if LOG_EVENTS:
+        logger.info('New processing memory created', extra={'uid': uid, 'data': data})
+
+def process_memory_processing_started(data, uid):
+    """Process a memory processing started event"""
+    if LOG_EVENTS:
+        logger.info('Memory processing started', extra={'uid': uid, 'data': data})
+
+def process_memory_processing_status(data, uid):
+    """Process a memory processing status change"""
+    if LOG_EVENTS:
+        logger.info('Memory processing status changed', extra={'uid': uid, 'data': data})
+
+def process_memory_synced(data, uid):
+    """Process a memory backward sync event"""
+    # Backfilled memories arrive in the full memory format; persist those that validate
+    if isinstance(data, dict) and validate_memory(data) is None:
+        storage.save_memory(uid, data)
+        search_index.index_memory(uid, data)
+
     if LOG_EVENTS:
-        logger.info(f"Memory synced for user {uid}")
-        logger.info(f"Sync data: {json.dumps(data, indent=2)}")
-    return jsonify({'message': 'Memory synced'}), 200
+        logger.info('Memory synced', extra={'uid': uid, 'data': data})
+
+# Handler for each memory event type
+MEMORY_HANDLERS = {
+    'memory_created': handle_memory_created,
+    'new_memory_create_failed': handle_memory_creation_failed,
+    'new_processing_memory_created': handle_processing_memory_created,
+    'memory_processing_started': handle_memory_processing_started,
+    'processing_memory_status_changed': handle_memory_processing_status,
+    'memory_backward_synced': handle_memory_synced
+}
+
+def memory_fields(event_type, data):
+    """Event log fields of a memory event"""
+    return {'data': data, 'event_type': event_type}
+
+event_registry.register(handle_memory_webhook, event_types=MEMORY_EVENTS, kind='memory', fields=memory_fields)
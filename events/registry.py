@@ -0,0 +1,124 @@
+"""
+Omi App Webhook Server - Event Registry
+
+Maps webhooks to their handlers with a single dictionary lookup. Handlers
+are registered once at import time, keyed by request content type (raw
+audio), by the JSON body's `type` field (memory and system events) or as
+the handler for JSON arrays (transcript segments).
+
+Each handler's middleware chain is composed when it is registered, so
+dispatch costs the same however many event families are registered.
+Middleware is called as `middleware(handler, call_next)` and returns the
+callable that replaces `call_next`; it may return `call_next` itself to
+skip handlers it does not apply to. Handlers and middleware are called as
+`call(event_type, data, uid, **params)`, where params carries per-event
+values that otherwise come from the query string (e.g. the session_id of
+batched transcript events).
+
+New event families can be added without touching server.py: list their
+modules in EVENT_PLUGINS and define `register(registry)` in each.
+"""
+import importlib
+import logging
+import os
+
+logger = logging.getLogger('events.registry')
+
+# Comma-separated modules registering extra event handlers
+EVENT_PLUGINS = [name.strip() for name in os.getenv('EVENT_PLUGINS', '').split(',') if name.strip()]
+
+# Registry key kinds
+CONTENT_TYPE = 'content_type'
+EVENT_TYPE = 'type'
+ARRAY_KEY = ('array', None)
+
+class EventHandler:
+    """A registered handler with its composed middleware chain
+
+    `func(event_type, data, uid, **params)` returns a Flask response.
+    `kind` names the event in the durable event log (None for events that
+    are not logged) and `fields(event_type, data, **params)` returns the
+    extra fields logged with it.
+    """
+    __slots__ = ('route', 'func', 'kind', 'fields', 'middleware', 'call')
+
+    def __init__(self, route, func, kind=None, fields=None, middleware=()):
+        self.route = route
+        self.func = func
+        self.kind = kind
+        self.fields = fields or (lambda event_type, data, **params: {})
+        self.middleware = tuple(middleware)
+        self.call = func
+
+    def __repr__(self):
+        return f"EventHandler({self.route!r}, {self.func.__name__})"
+
+class EventRegistry:
+    """Handlers by content type, event type or JSON array"""
+
+    def __init__(self):
+        self.handlers = {}
+        self.middleware = []
+
+    def register(self, func, event_types=(), content_type=None, array=False,
+                 route=None, kind=None, fields=None, middleware=()):
+        """Register func for each event type, a content type and/or JSON arrays
+
+        The metrics route defaults to the event type (or kind) when not given.
+        """
+        keys = [(EVENT_TYPE, event_type) for event_type in event_types]
+        if content_type:
+            keys.append((CONTENT_TYPE, content_type))
+        if array:
+            keys.append(ARRAY_KEY)
+        if not keys:
+            raise ValueError(f"No event type, content type or array given for {func.__name__}")
+
+        for key in keys:
+            if key in self.handlers:
+                raise ValueError(f"Duplicate event handler for {key[0]} {key[1]!r}")
+
+        for key in keys:
+            handler_route = route or (key[1] if key[0] == EVENT_TYPE else kind) or func.__name__
+            handler = EventHandler(handler_route, func, kind, fields, middleware)
+            self._compose(handler)
+            self.handlers[key] = handler
+        return func
+
+    def use(self, middleware):
+        """Wrap every handler, registered before or after, in middleware"""
+        self.middleware.append(middleware)
+        for handler in self.handlers.values():
+            self._compose(handler)
+        return middleware
+
+    def _compose(self, handler):
+        # Registry-wide middleware runs outermost, in the order it was added
+        call = handler.func
+        for middleware in reversed(self.middleware + list(handler.middleware)):
+            call = middleware(handler, call)
+        handler.call = call
+
+    def for_content_type(self, content_type):
+        """Handler taking the raw body of this content type, if any"""
+        return self.handlers.get((CONTENT_TYPE, content_type))
+
+    def resolve(self, data):
+        """Handler and event type for a parsed JSON body (handler is None if unknown)"""
+        if isinstance(data, list):
+            return self.handlers.get(ARRAY_KEY), None
+        event_type = data.get('type') if isinstance(data, dict) else None
+        if not isinstance(event_type, str):
+            # Event types are strings; other JSON values (lists, objects) are not keys
+            return None, event_type
+        return self.handlers.get((EVENT_TYPE, event_type)), event_type
+
+    def load_plugins(self, modules=EVENT_PLUGINS):
+        """Import plugin modules and let each register its handlers"""
+        for name in modules:
+            module = importlib.import_module(name)
+            module.register(self)
+            logger.info('Loaded event plugin', extra={'plugin': name})
+
+# Shared registry the built-in event modules register with
+event_registry = EventRegistry()
@@ -0,0 +1,216 @@
+"""
+Omi App Webhook Server - Payload Schemas
+
+Declarative definitions of the Omi memory and transcript segment formats.
+Each schema is compiled once at import time into generated Python
+functions with every check inlined, so validating a payload costs no
+per-call setup and no per-field dict or loop overhead. Validators return
+the error message of the first failing check, or None when valid.
+"""
+from operator import itemgetter
+
+NUMBER = (int, float)
+
+
+class Required:
+    """Check that a field is present"""
+
+    def __init__(self, field, message):
+        self.field = field
+        self.message = message
+
+    def condition(self, name):
+        return f"{self.field!r} in obj"
+
+
+class TypeOf:
+    """Check that one or more fields are instances of the given type(s)"""
+
+    def __init__(self, fields, types, message):
+        self.fields = fields if isinstance(fields, (list, tuple)) else [fields]
+        self.types = types
+        self.message = message
+
+    def condition(self, name):
+        return ' and '.join(f"isinstance(obj[{field!r}], {name}_types)" for field in self.fields)
+
+
+class ItemsOf:
+    """Check that every element of a list field is an instance of the given type(s)"""
+
+    def __init__(self, field, types, message):
+        self.field = field
+        self.types = types
+        self.message = message
+
+    def condition(self, name):
+        return f"all([isinstance(item, {name}_types) for item in obj[{self.field!r}]])"
+
+
+class NotGreater:
+    """Check that obj[low] <= obj[high]"""
+
+    def __init__(self, low, high, message):
+        self.low = low
+        self.high = high
+        self.message = message
+
+    def condition(self, name):
+        return f"obj[{self.low!r}] <= obj[{self.high!r}]"
+
+
+class Schema:
+    """Ordered list of checks compiled into `validate` and `validate_many` functions"""
+
+    def __init__(self, name, checks, not_object_message):
+        self.name = name
+        self.checks = checks
+        self.not_object_message = not_object_message
+        self.validate = self._compile_validate()
+        self.validate_many = self._compile_validate_many()
+
+    def _compile_validate(self):
+        """Generate a function testing all checks in one expression
+
+        Presence is folded into a single set comparison and constants are
+        bound as default arguments (local lookups). Only an object failing
+        the fast expression walks the checks in order to pick the message.
+        """
+        constants = {'not_object_message': self.not_object_message, 'required': self.required_fields()}
+        fast = ["type(obj) is dict", "obj.keys() >= required"]
+        slow = ["if type(obj) is not dict: return not_object_message"]
+        for index, check in enumerate(self.checks):
+            name = f'm{index}'
+            constants[name] = check.message
+            if isinstance(check, (TypeOf, ItemsOf)):
+                constants[f'{name}_types'] = check.types
+            if not isinstance(check, Required):
+                fast.append(check.condition(name))
+            slow.append(f"if not ({check.condition(name)}): return {name}")
+
+        fast_condition = ' and '.join(f'({condition})' for condition in fast)
+        return self._build('validate', 'obj', constants,
+                           [f'if {fast_condition}: return None', *slow, 'return None'])
+
+    def _compile_validate_many(self):
+        """Generate a loop validating an array of objects
+
+        All fields of an item are fetched with one C-level itemgetter call
+        into locals, then tested in a single expression. The first item that
+        fails is handed to `validate` for its exact error message.
+        """
+        fields = list(dict.fromkeys(
+            field for check in self.checks for field in check_fields(check)
+        ))
+        local = {field: f'v{index}' for index, field in enumerate(fields)}
+        constants = {'getter': itemgetter(*fields), 'validate': self.validate}
+        conditions = []
+        for index, check in enumerate(self.checks):
+            if isinstance(check, TypeOf):
+                constants[f'm{index}_types'] = check.types
+                conditions.extend(f'isinstance({local[field]}, m{index}_types)' for field in check.fields)
+            elif isinstance(check, ItemsOf):
+                constants[f'm{index}_types'] = check.types
+                conditions.append(f'all([isinstance(item, m{index}_types) for item in {local[check.field]}])')
+            elif isinstance(check, NotGreater):
+                conditions.append(f'{local[check.low]} <= {local[check.high]}')
+
+        targets = ', '.join(local.values()) + (',' if len(fields) == 1 else '')
+        fetch = f'{targets} = getter(obj)' if len(fields) > 1 else f'{targets} = (getter(obj),)'
+        body = [
+            'for obj in items:',
+            '    if type(obj) is dict:',
+            '        try:',
+            f'            {fetch}',
+            '        except KeyError:',
+            '            return validate(obj)',
+            f'        if {" and ".join(conditions) or "True"}: continue',
+            '    return validate(obj)',
+            'return None'
+        ]
+        return self._build('validate_many', 'items', constants, body)
+
+    def required_fields(self):
+        return frozenset(check.field for check in self.checks if isinstance(check, Required))
+
+    def _build(self, function_name, argument, constants, body):
+        constants = dict(constants, isinstance=isinstance, type=type, dict=dict)
+        arguments = ', '.join(f'{key}={key}' for key in constants)
+        source = '\n'.join(
+            [f'def {function_name}({argument}, {arguments}):'] + [f'    {line}' for line in body]
+        )
+        namespace = dict(constants)
+        exec(compile(source, f'<schema {self.name}.{function_name}>', 'exec'), namespace)
+        return namespace[function_name]
+
+
+def check_fields(check):
+    """Return the fields a check reads"""
+    if isinstance(check, (Required, ItemsOf)):
+        return [check.field]
+    if isinstance(check, TypeOf):
+        return list(check.fields)
+    return [check.low, check.high]
+
+
+def required_fields(fields, missing, invalid):
+    """Checks for fields that must be present and typed, one field at a time"""
+    checks = []
+    for field, field_type in fields:
+        checks.append(Required(field, missing.format(field=field)))
+        checks.append(TypeOf(field, field_type, invalid.format(field=field)))
+    return checks
+
+
+MEMORY_SCHEMA = Schema('memory', [
+    *required_fields(
+        [
+            ('id', str),
+            ('created_at', str),
+            ('transcript', str),
+            ('transcript_segments', list),
+            ('structured', dict)
+        ],
+        missing='Missing required field: {field}',
+        invalid='Invalid type for {field}'
+    ),
+    ItemsOf('transcript_segments', dict, 'Invalid type for transcript_segments item')
+], not_object_message='Missing memory data')
+
+STRUCTURED_SCHEMA = Schema('structured', [
+    *required_fields(
+        [
+            ('title', str),
+            ('overview', str),
+            ('emoji', str),
+            ('category', str),
+            ('action_items', list),
+            ('events', list)
+        ],
+        missing='Missing structured field: {field}',
+        invalid='Invalid type for structured.{field}'
+    ),
+    ItemsOf('action_items', dict, 'Invalid type for structured.action_items item')
+], not_object_message='Invalid type for structured')
+
+SEGMENT_FIELDS = ['text', 'speaker', 'speakerId', 'is_user', 'start', 'end']
+
+TRANSCRIPT_SEGMENT_SCHEMA = Schema('transcript_segment', [
+    *[Required(field, f'Missing required field in segment: {field}') for field in SEGMENT_FIELDS],
+    TypeOf('text', str, 'text must be string'),
+    TypeOf('speaker', str, 'speaker must be string'),
+    TypeOf('speakerId', int, 'speakerId must be integer'),
+    TypeOf('is_user', bool, 'is_user must be boolean'),
+    TypeOf(['start', 'end'], NUMBER, 'start and end must be numbers'),
+    NotGreater('start', 'end', 'start time must be <= end time')
+], not_object_message='Invalid format - expected array of segments')
+
+
+def validate_memory(memory):
+    """Validate a memory and its structured data, returning the first error message"""
+    return MEMORY_SCHEMA.validate(memory) or STRUCTURED_SCHEMA.validate(memory['structured'])
+
+
+def validate_segments(segments):
+    """Validate an array of transcript segments, returning the first error message"""
+    return TRANSCRIPT_SEGMENT_SCHEMA.validate_many(segments)
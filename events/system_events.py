@@ -0,0 +1,25 @@
+"""
+Omi App Webhook Server - System Event Handlers
+"""
+import logging
+from flask import jsonify
+from services.json_codec import dumps, json_response
+from .registry import event_registry
+
+logger = logging.getLogger('events.system_events')
+
+# System event types
+SYSTEM_EVENTS = ['ping']
+
+# Precomputed response bodies
+PONG = dumps({'message': 'pong'})
+
+def handle_system_webhook(event_type, data, uid):
+    """Handle system events like ping"""
+    if event_type == 'ping':
+        logger.info('Received ping', extra={'uid': uid})
+        return json_response(PONG), 200
+    return jsonify({'error': 'Unknown system event'}), 400
+
+# System events are answered directly and not written to the event log
+event_registry.register(handle_system_webhook, event_types=SYSTEM_EVENTS)
@@ -1,10 +1,16 @@
 """
 Omi App Webhook Server - Transcript Event Handlers
 """
-import json
 import logging
 from flask import jsonify, request
 import os
+from services.job_queue import job_queue
+from services.json_codec import dumps, json_response
+from services.search_index import search_index
+from services.storage import storage
+from services.transcript_store import transcript_store
+from .registry import event_registry
+from .schemas import validate_segments
 
 logger = logging.getLogger('events.transcript_events')
 
@@ -12,7 +18,10 @@ TRANSCRIPT_EVENTS = []  # No event types needed since we handle it directly
 
 LOG_EVENTS = os.getenv('LOG_EVENTS', 'false').lower() in ('true', '1', 'yes')
 
-def handle_transcript_webhook(event_type, data, uid):
+# Precomputed success response body
+SUCCESS = dumps({'message': 'Success'})
+
+def handle_transcript_webhook(event_type, data, uid, session_id=None):
     """Handle transcript segments from Omi App
 
     Receives array of segments directly in request body:
@@ -27,9 +36,12 @@ def handle_transcript_webhook(event_type, data, uid):
         }
         // More segments...
     ]
+
+    session_id defaults to the query parameter of the same name (batched
+    events carry their own).
     """
     # Get session_id from query params as documented
-    session_id = request.args.get('session_id')
+    session_id = session_id or request.args.get('session_id')
     if not session_id:
         return jsonify({'error': 'Missing session_id parameter'}), 400
 
@@ -37,36 +49,34 @@ def handle_transcript_webhook(event_type, data, uid):
     if not isinstance(data, list):
         return jsonify({'error': 'Invalid format - expected array of segments'}), 400
 
-    # Validate each segment
-    for segment in data:
-        # Check required fields exist
-        required_fields = ['text', 'speaker', 'speakerId', 'is_user', 'start', 'end']
-        for field in required_fields:
-            if field not in segment:
-                return jsonify({'error': f'Missing required field in segment: {field}'}), 400
-
-        # Validate field types
-        if not isinstance(segment['text'], str):
-            return jsonify({'error': 'text must be string'}), 400
+    # Validate each segment against the Omi segment format (see schemas.py)
+    error = validate_segments(data)
+    if error:
+        return jsonify({'error': error}), 400
 
-        if not isinstance(segment['speaker'], str):
-            return jsonify({'error': 'speaker must be string'}), 400
+    # Acknowledge now, process on a background worker
+    job_queue.submit(process_transcript_segments, session_id, data, uid)
 
-        if not isinstance(segment['speakerId'], int):
-            return jsonify({'error': 'speakerId must be integer'}), 400
+    return json_response(SUCCESS), 200
 
-        if not isinstance(segment['is_user'], bool):
-            return jsonify({'error': 'is_user must be boolean'}), 400
-
-        if not (isinstance(segment['start'], (int, float)) and isinstance(segment['end'], (int, float))):
-            return jsonify({'error': 'start and end must be numbers'}), 400
-
-        # Validate time values
-        if segment['start'] > segment['end']:
-            return jsonify({'error': 'start time must be <= end time'}), 400
+def process_transcript_segments(session_id, segments, uid):
+    """Process validated transcript segments (runs on the job queue)"""
+    # Merge into the conversation, dropping segments the app resent, and
+    # persist only what the merge changed (including rows it replaced)
+    result = transcript_store.merge(uid, session_id, segments)
+    storage.save_transcript_segments(uid, session_id, result.segments, result.removed)
+    search_index.index_segments(uid, session_id, result.segments, result.removed)
 
     if LOG_EVENTS:
-        logger.info(f"Received {len(data)} segments for session {session_id}")
-        logger.info(f"Segments: {json.dumps(data, indent=2)}")
+        logger.info('Transcript segments received', extra={
+            'uid': uid, 'session_id': session_id, 'count': len(segments), 'segments': segments
+        })
+
+def transcript_fields(event_type, data, session_id=None):
+    """Event log fields of a batch of transcript segments"""
+    return {'data': data, 'session_id': session_id or request.args.get('session_id')}
 
-    return jsonify({'message': 'Success'}), 200
+# Omi sends transcript segments as a bare JSON array
+event_registry.register(
+    handle_transcript_webhook, array=True, route='transcript', kind='transcript', fields=transcript_fields
+)
@@ -0,0 +1,88 @@
+"""
+Omi App Webhook Server - Gunicorn Configuration
+
+Production entry point. Preloads `server.app` in the master, forks one
+worker per core (or more for sync workers) and drains workers gracefully
+through the server's `cleanup()` shutdown path.
+
+Run with:
+    gunicorn -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Worker classes selectable through WORKER_CLASS
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+    'asgi': 'uvicorn.workers.UvicornWorker'
+}
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+worker_class_name = os.getenv('WORKER_CLASS', 'gthread').lower()
+if worker_class_name not in WORKER_CLASSES:
+    raise ValueError(f"Invalid WORKER_CLASS. Must be one of: {', '.join(WORKER_CLASSES)}")
+
+worker_class = WORKER_CLASSES[worker_class_name]
+
+# The ASGI worker serves asgi.py, everything else serves the Flask app directly
+wsgi_app = 'asgi:application' if worker_class_name == 'asgi' else 'server:app'
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 32768)}"
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+
+# Sync workers block on I/O, so run more of them than there are cores
+default_workers = CPU_COUNT * 2 + 1 if worker_class_name == 'sync' else CPU_COUNT
+workers = int(os.getenv('WORKERS', default_workers))
+
+# Threads per worker (gthread) and connections per worker (gevent)
+threads = int(os.getenv('WORKER_THREADS', 8 if worker_class_name == 'gthread' else 1))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+
+timeout = int(os.getenv('WORKER_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('KEEPALIVE', 5))
+
+# Recycle workers periodically to bound memory growth (0 disables)
+max_requests = int(os.getenv('MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', 0))
+
+# Access logs are noisy at webhook volumes; errors go to stderr
+accesslog = None
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'INFO').lower()
+
+
+def on_starting(server):
+    """Log the worker layout and clear metrics snapshots left by a previous run"""
+    server.log.info(
+        f"Starting webhook server with {workers} {worker_class_name} workers on {bind}"
+    )
+    from services.metrics import registry
+    registry.clear_snapshots()
+
+
+def worker_int(worker):
+    """Run cleanup when a worker is interrupted (SIGINT/SIGQUIT)"""
+    from server import cleanup
+    cleanup()
+
+
+def worker_exit(server, worker):
+    """Run cleanup after a worker has finished draining in-flight requests"""
+    from server import cleanup
+    cleanup()
+
+
+def on_exit(server):
+    """Run cleanup in the master once all workers have exited"""
+    from server import cleanup
+    cleanup()
@@ -0,0 +1,67 @@
+"""
+Omi App Webhook Server - Event Log Replay
+
+Re-feeds webhooks recorded in the durable event log through the event
+handlers, e.g. to rebuild state after a crash or to backfill a new
+processing step. Audio events only carry metadata and are skipped.
+
+Run with:
+    python replay.py [--dir data/events] [--since UNIX_TS] [--kind memory]
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+# Add the current directory to Python path
+sys.path.append(str(Path(__file__).parent))
+
+from server import app, cleanup
+from events import handle_memory_webhook, handle_transcript_webhook
+from services.event_log import EVENT_LOG_DIR, iter_events
+
+logger = logging.getLogger('replay')
+
+def replay_event(event):
+    """Run one logged event through its handler and return the status code"""
+    query = {'uid': event['uid']}
+    if event.get('session_id'):
+        query['session_id'] = event['session_id']
+
+    with app.test_request_context('/webhook', method='POST', query_string=query):
+        if event['kind'] == 'memory':
+            response = handle_memory_webhook(event['event_type'], event['data'], event['uid'])
+        else:
+            response = handle_transcript_webhook(None, event['data'], event['uid'])
+    return response[1] if isinstance(response, tuple) else 200
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay webhooks from the event log')
+    parser.add_argument('--dir', default=EVENT_LOG_DIR, help='Event log directory')
+    parser.add_argument('--since', type=float, default=0, help='Only replay events logged after this UNIX timestamp')
+    parser.add_argument('--kind', choices=['memory', 'transcript'], help='Only replay this kind of event')
+    parser.add_argument('--uid', help='Only replay events of this user')
+    args = parser.parse_args()
+
+    replayed = skipped = failed = 0
+    for event in iter_events(args.dir):
+        if event['ts'] < args.since or (args.uid and event['uid'] != args.uid):
+            continue
+        if event['kind'] not in ('memory', 'transcript') or (args.kind and event['kind'] != args.kind):
+            skipped += 1
+            continue
+
+        status_code = replay_event(event)
+        if status_code == 200:
+            replayed += 1
+        else:
+            failed += 1
+            logger.warning(f"Replay of {event['kind']} event from {event['ts']} returned {status_code}")
+
+    # Wait for the background jobs the handlers queued
+    cleanup()
+    print(f"Replayed: {replayed}  Skipped: {skipped}  Failed: {failed}")
+    return 0 if not failed else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,51 @@
 """
 Omi App Webhook Server - Main Server Module
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from dotenv import load_dotenv
+from werkzeug.exceptions import HTTPException
 import os
-import hmac
 import hashlib
 import json
 import logging
+import math
+import time
 from datetime import datetime
 import sys
 from pathlib import Path
 import signal
 import atexit
-from logging import StreamHandler
-from logging.handlers import RotatingFileHandler
 
 # Add the current directory to Python path
 sys.path.append(str(Path(__file__).parent))
 
-# Import event handlers
-from events import (
-    MEMORY_EVENTS, handle_memory_webhook,
-    AUDIO_EVENTS, handle_audio_webhook,
-    TRANSCRIPT_EVENTS, handle_transcript_webhook
-)
-
-# Load environment variables
+# Load environment variables before the handlers and services read their settings
 load_dotenv()
 
-# Configure basic logging
-logging.basicConfig(
-    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper()),
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+# Import event handlers
+from events import REPLAYED_HEADER, event_registry, idempotent_memory_events
+from services.audio_analysis import audio_stats
+from services.audio_archive import audio_archive
+from services.audio_buffer import audio_sessions
+from services.audio_export import FORMATS, ExportError, export_length, export_parts, iter_range, wav_header
+from services.event_log import EVENT_LOG_SYNC, EventLogError, event_log
+from services.forwarder import forwarder
+from services.idempotency import idempotency_cache
+from services.json_codec import JsonCodecProvider, loads
+from services.log_pipeline import configure_logging, log_pipeline
+from services.job_queue import QueueFull, job_queue
+from services.metrics import (
+    METRICS_ENABLED, audio_bytes, background_jobs, opus_packets, opus_seconds, queue_depth, registry,
+    validation_failures, webhook_latency, webhook_requests
 )
+from services.opus_decoder import opus_decoder_pool
+from services.rate_limiter import event_class, rate_limiter
+from services.request_gate import KeyVerifier, RequestGate, load_secrets
+from services.search_index import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT, search_index
+from services.storage import storage
+
+# Log through the background listener (console and rotated webhook.log)
+configure_logging(log_pipeline)
 
 # Silence Flask's werkzeug logger
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
@@ -45,29 +56,27 @@ logger = logging.getLogger(__name__)
 # Simple LOG_EVENTS check
 LOG_EVENTS = os.getenv('LOG_EVENTS', 'false').lower() in ('true', '1', 'yes')
 
-app = Flask(__name__)
-
 # Get config from environment
 WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# All accepted secrets (WEBHOOK_SECRET plus WEBHOOK_SECRETS while rotating)
+WEBHOOK_SECRETS = load_secrets()
 PORT = int(os.getenv('PORT', 32768))
+HOST = os.getenv('HOST', '0.0.0.0')
+
+# Serving mode: 'wsgi' (Flask/Werkzeug) or 'asgi' (asyncio via uvicorn, see asgi.py)
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()
 
-# System event types
-SYSTEM_EVENTS = ['ping']
+# Seconds the Omi app is asked to wait before retrying when we are overloaded
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', 5))
 
-def verify_key(key):
-    """Verify webhook key from URL parameter"""
-    if not WEBHOOK_SECRET:
-        return True
+app = Flask(__name__)
+app.json = JsonCodecProvider(app)
 
-    return hmac.compare_digest(key or '', WEBHOOK_SECRET)
+# Reject bad keys, missing uids and unacceptable bodies before Flask reads anything
+app.wsgi_app = RequestGate(app.wsgi_app, secrets=WEBHOOK_SECRETS)
 
-def handle_system_webhook(event_type, data, uid):
-    """Handle system events like ping"""
-    if event_type == 'ping':
-        if LOG_EVENTS:
-            logger.info(f"Received ping from user {uid}")
-        return jsonify({'message': 'pong'}), 200
-    return jsonify({'error': 'Unknown system event'}), 400
+# Constant-time check of a webhook key against every accepted secret
+verify_key = KeyVerifier(WEBHOOK_SECRETS)
 
 def log_webhook_event(event_type, uid, data, response):
     """Simple event logger"""
@@ -80,55 +89,370 @@ def log_webhook_event(event_type, uid, data, response):
         else:
             logger.info(f"{event_type} | uid:{uid} | status:{status_code} | data:{data} | response:{response}")
 
+@app.errorhandler(QueueFull)
+def handle_queue_full(error):
+    """Ask the client to retry when the background job queue is saturated"""
+    logger.warning(f"Rejecting webhook: {error}")
+    return jsonify({'error': 'Server busy, retry later'}), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+@app.errorhandler(EventLogError)
+def handle_event_log_error(error):
+    """Refuse webhooks that could not be made durable so the Omi app retries them"""
+    logger.error(f"Rejecting webhook: {error}")
+    return jsonify({'error': 'Server busy, retry later'}), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+def record_event(response, kind, uid, **fields):
+    """Write an accepted webhook to the durable event log before acknowledging it
+
+    Accepted webhooks are also queued for forwarding to FORWARD_URLS.
+    """
+    status_code = response[1] if isinstance(response, tuple) else 200
+    # Redeliveries answered from the idempotency cache were logged the first time
+    replayed = isinstance(response, tuple) and REPLAYED_HEADER in response[0].headers
+    if status_code == 200 and not replayed:
+        if 'event_log_sequence' in g:
+            # Batched events share one fsync wait at the end of the batch
+            g.event_log_sequence = event_log.append(kind, uid, wait=False, **fields)
+            g.setdefault('event_log_first', g.event_log_sequence)
+        else:
+            event_log.append(kind, uid, **fields)
+        forwarder.forward(kind, uid, **fields)
+    return response
+
+# Registered first so it runs outermost: responses are only remembered for
+# redeliveries once record_accepted has made the event durable
+event_registry.use(idempotent_memory_events)
+
+@event_registry.use
+def record_accepted(handler, call_next):
+    """Event registry middleware recording accepted events of handlers with a kind"""
+    if handler.kind is None:
+        return call_next
+
+    def call(event_type, data, uid, **params):
+        response = call_next(event_type, data, uid, **params)
+        return record_event(response, handler.kind, uid, **handler.fields(event_type, data, **params))
+    return call
+
+# Let plugins listed in EVENT_PLUGINS register further event families
+event_registry.load_plugins()
+
+@app.before_request
+def start_timer():
+    """Time webhook handling for the latency histograms"""
+    if METRICS_ENABLED and request.endpoint in ('webhook', 'webhook_batch'):
+        registry.ensure_started()
+        g.start = time.perf_counter()
+        g.route = 'rejected'
+
+@app.after_request
+def record_metrics(response):
+    """Count the webhook by route and status, and record why rejected ones failed"""
+    if 'start' not in g:
+        return response
+    webhook_latency.observe(time.perf_counter() - g.start, g.route)
+    webhook_requests.inc(g.route, response.status_code)
+    if response.status_code == 200 and g.route == 'audio':
+        audio_bytes.inc(
+            request.args.get('codec', 'pcm'), request.args.get('sample_rate', ''),
+            amount=request.content_length or 0
+        )
+    elif response.status_code in (400, 413):
+        error = response.get_json(silent=True) if response.is_json else None
+        reason = error.get('error') if isinstance(error, dict) else response.get_data(as_text=True)
+        validation_failures.inc(reason)
+    return response
+
+@registry.collector
+def collect_background_metrics():
+    """Mirror queue depths and the totals kept by background components"""
+    queue_depth.set(job_queue.depth, 'jobs')
+    queue_depth.set(forwarder.depth, 'forwarder')
+    queue_depth.set(storage.depth, 'storage')
+    queue_depth.set(search_index.depth, 'search_index')
+    queue_depth.set(audio_archive.depth, 'audio_archive')
+    background_jobs.set(job_queue.completed, 'completed')
+    background_jobs.set(job_queue.failed, 'failed')
+    background_jobs.set(job_queue.rejected, 'rejected')
+    decode = opus_decoder_pool.metrics
+    with decode.lock:
+        opus_packets.set(decode.decoded, 'decoded')
+        opus_packets.set(decode.failed, 'failed')
+        opus_packets.set(decode.rejected, 'rejected')
+        opus_seconds.set(decode.decode_seconds, 'decode')
+        opus_seconds.set(decode.wait_seconds, 'wait')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics aggregated across worker processes"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Metrics disabled'}), 404
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming webhooks from Omi App"""
-    # Validate webhook key
-    webhook_key = request.args.get('key')
-    if not webhook_key or webhook_key != WEBHOOK_SECRET:
-        return 'Invalid webhook key', 401
+    # Key and uid were checked by the request gate (services/request_gate.py)
+    uid = request.args['uid']
 
-    # Get user ID
-    uid = request.args.get('uid')
-    if not uid:
-        return 'Missing uid parameter', 400
+    # Enforce per-uid rate limits before reading the body
+    retry_after = rate_limiter.acquire(event_class(request), uid)
+    if retry_after:
+        return jsonify({'error': 'Rate limit exceeded'}), 429, {'Retry-After': str(math.ceil(retry_after))}
 
-    # Get request data
-    if request.headers.get('Content-Type') == 'application/octet-stream':
-        # Handle audio data
-        return handle_audio_webhook(None, None, uid)
+    # Raw bodies (audio) are dispatched on their content type without being read
+    handler = event_registry.for_content_type(request.mimetype)
+    if handler:
+        event_type = data = None
+    else:
+        try:
+            data = request.get_json()
+        except Exception as e:
+            return jsonify({'error': 'Invalid JSON data'}), 400
 
-    try:
-        data = request.get_json()
-    except Exception as e:
-        return jsonify({'error': 'Invalid JSON data'}), 400
+        # Transcript webhooks send an array directly, all other webhooks a type field
+        handler, event_type = event_registry.resolve(data)
+        if not handler:
+            if isinstance(data, dict) and data.get('type'):
+                return jsonify({'error': 'Unknown event type'}), 400
+            return jsonify({'error': 'Missing event type'}), 400
 
-    # Special case: Transcript webhooks send array directly
-    if isinstance(data, list):
-        # For transcripts, session_id is required in query params
-        session_id = request.args.get('session_id')
+    g.route = handler.route
+    return handler.call(event_type, data, uid)
+
+def dispatch_batch_item(item, uid, session_id):
+    """Run one batched event through its handler and return its result"""
+    # Items are webhook bodies as sent to /webhook, or {"segments": [...]}
+    # envelopes carrying their own session_id; any item may carry its own uid
+    params = {}
+    if isinstance(item, dict):
+        if 'uid' in item and not (isinstance(item['uid'], str) and item['uid']):
+            return {'status': 400, 'error': 'Invalid uid'}
+        uid = item.get('uid') or uid
+        if 'segments' in item:
+            session_id = item.get('session_id') or session_id
+            item = item['segments']
+    if isinstance(item, list):
         if not session_id:
-            return jsonify({'error': 'Missing session_id parameter'}), 400
-        return handle_transcript_webhook(None, data, uid)
-
-    # For all other webhooks, expect type field
-    event_type = data.get('type')
-    if not event_type:
-        return jsonify({'error': 'Missing event type'}), 400
-
-    # Route to appropriate handler
-    if event_type == 'ping':
-        logger.info(f"Received ping from user {uid}")
-        return jsonify({'message': 'pong'}), 200
-    elif event_type in MEMORY_EVENTS:
-        return handle_memory_webhook(event_type, data, uid)
-    else:
-        return jsonify({'error': 'Unknown event type'}), 400
+            return {'status': 400, 'error': 'Missing session_id parameter'}
+        params['session_id'] = session_id
+
+    handler, event_type = event_registry.resolve(item)
+    if not handler:
+        if isinstance(item, dict) and item.get('type'):
+            return {'status': 400, 'error': 'Unknown event type'}
+        return {'status': 400, 'error': 'Missing event type'}
+
+    # Items are limited in their handler's bucket; system events share the
+    # memory bucket, as they do on /webhook
+    retry_after = rate_limiter.acquire(handler.kind or 'memory', uid)
+    if retry_after:
+        return {'status': 429, 'error': 'Rate limit exceeded', 'retry_after': math.ceil(retry_after)}
+
+    try:
+        response = handler.call(event_type, item, uid, **params)
+    except (QueueFull, EventLogError) as e:
+        logger.warning(f"Rejecting batched event: {e}")
+        return {'status': 503, 'error': 'Server busy, retry later'}
+    except HTTPException as e:
+        return {'status': e.code, 'error': e.description}
+    except Exception:
+        # One bad item must not fail the items already accepted in this batch
+        logger.exception('Batched event failed')
+        return {'status': 500, 'error': 'Internal server error'}
+
+    response, status_code = response if isinstance(response, tuple) else (response, 200)
+    result = {'status': status_code}
+    if REPLAYED_HEADER in response.headers:
+        result['replayed'] = True
+    body = response.get_json(silent=True)
+    if isinstance(body, dict):
+        result.update(body)
+    return result
+
+@app.route('/webhook/batch', methods=['POST'])
+def webhook_batch():
+    """Handle many webhooks sent as newline-delimited JSON
+
+    Lines are read and dispatched one at a time, so the batch is never held
+    in memory. The response lists one result per line, in order.
+    """
+    # Key and uid were checked by the request gate (services/request_gate.py)
+    uid = request.args['uid']
+    session_id = request.args.get('session_id')
+    g.route = 'batch'
+    g.event_log_sequence = 0
+    g.idempotent_responses = []
+
+    results = []
+    for line in request.stream:
+        if not line.strip():
+            continue
+        try:
+            item = loads(line)
+        except ValueError:
+            results.append({'status': 400, 'error': 'Invalid JSON data'})
+            continue
+        results.append(dispatch_batch_item(item, uid, session_id))
+
+    if not results:
+        return jsonify({'error': 'No events in batch'}), 400
+
+    # Acknowledge only once every accepted event is durable (503 for the whole batch otherwise)
+    if EVENT_LOG_SYNC:
+        event_log.wait(g.event_log_sequence, g.get('event_log_first'))
+    for key, status_code, body in g.idempotent_responses:
+        idempotency_cache.put(key, status_code, body)
+
+    accepted = sum(1 for result in results if result['status'] == 200)
+    headers = {}
+    if any(result['status'] == 503 for result in results):
+        headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return jsonify({
+        'accepted': accepted,
+        'failed': len(results) - accepted,
+        'results': results
+    }), 200, headers
+
+@app.route('/search', methods=['GET'])
+def search():
+    """Full-text search over a user's memories and transcripts"""
+    # Key and uid were checked by the request gate (services/request_gate.py)
+    uid = request.args['uid']
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing q parameter'}), 400
+
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({'error': 'limit must be positive and offset non-negative'}), 400
+    limit = min(limit, SEARCH_MAX_LIMIT)
+
+    results = search_index.search(uid, query, limit, offset)
+    return jsonify({
+        'query': query,
+        'limit': limit,
+        'offset': offset,
+        'results': results
+    }), 200
+
+@app.route('/audio', methods=['GET'])
+def audio_sessions_list():
+    """A user's archived audio sessions, newest first"""
+    # Key and uid were checked by the request gate (services/request_gate.py)
+    uid = request.args['uid']
+    try:
+        limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    if limit < 1 or offset < 0:
+        return jsonify({'error': 'limit must be positive and offset non-negative'}), 400
+    limit = min(limit, SEARCH_MAX_LIMIT)
+    return jsonify({'sessions': audio_archive.sessions(uid, limit, offset)}), 200
+
+@app.route('/audio/live', methods=['GET'])
+def audio_live():
+    """A user's live session buffer and audio statistics, or its last seconds of audio
+
+    Sessions and statistics are kept per process, so under gunicorn this
+    reports the worker that answers the request.
+    """
+    # Key and uid were checked by the request gate (services/request_gate.py)
+    uid = request.args['uid']
+    session = audio_sessions.get(uid)
+    seconds = request.args.get('seconds')
+    if seconds is None:
+        return jsonify({
+            'session': session.to_dict() if session is not None else None,
+            'stats': audio_stats.snapshot(uid)
+        }), 200
+
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    if not seconds > 0:
+        return jsonify({'error': 'seconds must be positive'}), 400
+    if session is None:
+        return jsonify({'error': 'No live audio session'}), 404
+
+    audio = bytes(session.read_last_seconds(seconds))
+    if session.codec == 'pcm':
+        return Response(wav_header(session.sample_rate, len(audio)) + audio, mimetype='audio/wav')
+    return Response(audio, mimetype='application/octet-stream')
+
+@app.route('/audio/<session_id>', methods=['GET'])
+def audio_export(session_id):
+    """Stream an archived session as WAV (PCM) or Ogg Opus, with Range support
+
+    The file is generated block by block from the memory-mapped archive,
+    so only the requested range is read and nothing is held in memory.
+    """
+    uid = request.args['uid']
+    blocks = audio_archive.blocks(uid, session_id)
+    if not blocks:
+        return jsonify({'error': 'Audio session not found'}), 404
+
+    export_format = request.args.get('format') or ('ogg' if blocks[0].codec == 'opus' else 'wav')
+    if export_format not in FORMATS:
+        return jsonify({'error': 'Invalid format. Must be wav or ogg'}), 400
+    try:
+        parts = export_parts(audio_archive, blocks, export_format)
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+    total = export_length(parts)
+    start, end, status_code = 0, total, 200
+    if request.range is not None:
+        bounds = request.range.range_for_length(total)
+        if bounds is None and len(request.range.ranges) == 1:
+            return jsonify({'error': 'Range not satisfiable'}), 416, {'Content-Range': f'bytes */{total}'}
+        if bounds is not None:
+            # Multiple ranges are answered with the whole file
+            start, end = bounds
+            status_code = 206
+
+    mimetype, _ = FORMATS[export_format]
+    response = Response(iter_range(parts, start, end), status=status_code, mimetype=mimetype,
+                        direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(end - start)
+    response.headers['Content-Disposition'] = f'attachment; filename="{session_id}.{export_format}"'
+    if status_code == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{total}'
+    return response
+
+_cleaned_up = False
 
 def cleanup():
-    """Cleanup function to be called on shutdown"""
+    """Cleanup function to be called on shutdown
+
+    Safe to call more than once: signal handlers, atexit, the ASGI lifespan
+    and gunicorn worker hooks may all reach it during a single shutdown.
+    """
+    global _cleaned_up
+    if _cleaned_up:
+        return
+    _cleaned_up = True
+
     logger.info("Shutting down Omi webhook server...")
     # Add any cleanup code here (close db connections, etc.)
+    job_queue.drain()
+    forwarder.drain()
+    storage.close()
+    search_index.close()
+    audio_archive.close()
+    idempotency_cache.close()
+    registry.write_snapshot()
+    log_pipeline.stop()
+    event_log.close()
+    opus_decoder_pool.shutdown()
 
 def signal_handler(signum, frame):
     """Handle termination signals"""
@@ -150,9 +474,19 @@ if __name__ == '__main__':
     # Register cleanup function
     atexit.register(cleanup)
 
-    logger.info(f"Starting webhook server on port {PORT}")
+    # Metrics snapshots from a previous run would be added to this run's totals
+    registry.clear_snapshots()
+
+    logger.info(f"Starting webhook server on port {PORT} ({SERVER_MODE} mode)")
     try:
-        app.run(host='0.0.0.0', port=PORT)
+        if SERVER_MODE == 'asgi':
+            import uvicorn
+            from asgi import AsgiWebhookApp
+            # Pass the app object: an import string would import this module
+            # again as `server` and register its handlers and middleware twice
+            uvicorn.run(AsgiWebhookApp(app, on_shutdown=cleanup), host=HOST, port=PORT, log_level='warning')
+        else:
+            app.run(host=HOST, port=PORT)
     except Exception as e:
         logger.error(f"Server error: {str(e)}")
         cleanup()
@@ -0,0 +1,87 @@
+"""
+Omi App Webhook Server - Services Package
+"""
+from .audio_stream import AudioSink, AudioStreamError, read_audio_body
+from .audio_analysis import (
+    ChunkAnalysis, AudioStats, AudioStatsStore, PcmAnalysisStage, analyze_pcm, audio_stats
+)
+from .resampler import (
+    PolyphaseResampler, ResamplerStore, ResampleStage, design_polyphase_filter,
+    output_sample_rate, resamplers
+)
+from .opus_decoder import (
+    OpusError, DecoderUnavailable, DecoderBusy, LibOpusDecoder, StubOpusDecoder, OpusDecodePool, OpusDecodeStage,
+    opus_decoder_pool
+)
+from .job_queue import QueueFull, JobQueue, JobReservation, job_queue
+from .transcript_store import TranscriptSession, TranscriptStore, transcript_store
+from .storage import MemoryStore, SQLiteDatabase, SQLiteStore, create_store, storage
+from .search_index import SearchIndex, search_index
+from .forwarder import Forwarder, forwarder
+from .rate_limiter import RateLimiter, event_class, rate_limiter
+from .request_gate import KeyVerifier, RequestGate, load_secrets
+from .idempotency import IdempotencyCache, idempotency_cache, idempotency_key
+from .audio_archive import ArchivedBlock, AudioArchive, AudioArchiveStage, audio_archive
+from .audio_buffer import (
+    AudioRingBuffer, AudioSession, AudioSessionWriter, AudioSessionStore, audio_sessions
+)
+
+__all__ = [
+    'AudioSink',
+    'AudioStreamError',
+    'read_audio_body',
+    'ChunkAnalysis',
+    'AudioStats',
+    'AudioStatsStore',
+    'PcmAnalysisStage',
+    'analyze_pcm',
+    'audio_stats',
+    'PolyphaseResampler',
+    'ResamplerStore',
+    'ResampleStage',
+    'design_polyphase_filter',
+    'output_sample_rate',
+    'resamplers',
+    'OpusError',
+    'DecoderUnavailable',
+    'DecoderBusy',
+    'LibOpusDecoder',
+    'StubOpusDecoder',
+    'OpusDecodePool',
+    'OpusDecodeStage',
+    'opus_decoder_pool',
+    'QueueFull',
+    'JobQueue',
+    'JobReservation',
+    'job_queue',
+    'TranscriptSession',
+    'TranscriptStore',
+    'transcript_store',
+    'MemoryStore',
+    'SQLiteDatabase',
+    'SQLiteStore',
+    'create_store',
+    'storage',
+    'SearchIndex',
+    'search_index',
+    'Forwarder',
+    'forwarder',
+    'RateLimiter',
+    'event_class',
+    'rate_limiter',
+    'KeyVerifier',
+    'RequestGate',
+    'load_secrets',
+    'IdempotencyCache',
+    'idempotency_cache',
+    'idempotency_key',
+    'ArchivedBlock',
+    'AudioArchive',
+    'AudioArchiveStage',
+    'audio_archive',
+    'AudioRingBuffer',
+    'AudioSession',
+    'AudioSessionWriter',
+    'AudioSessionStore',
+    'audio_sessions'
+]
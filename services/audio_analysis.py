@@ -0,0 +1,189 @@
+"""
+Omi App Webhook Server - PCM Audio Analysis
+
+Vectorized per-frame analysis of 16-bit PCM chunks: RMS energy, voice
+activity (silence) flags and clipping counts. The int16 samples are viewed
+directly over the request buffer with NumPy, without copying the chunk.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .audio_stream import AudioSink
+
+logger = logging.getLogger('services.audio_analysis')
+
+# Analysis frame length in milliseconds
+AUDIO_FRAME_MS = int(os.getenv('AUDIO_FRAME_MS', 20))
+
+# Frames with RMS below this (in int16 units) are treated as silence
+AUDIO_SILENCE_RMS = float(os.getenv('AUDIO_SILENCE_RMS', 500))
+
+# Samples at or beyond this magnitude count as clipped
+AUDIO_CLIP_LEVEL = int(os.getenv('AUDIO_CLIP_LEVEL', 32767))
+
+# Drop chunks without a single voiced frame before they reach storage
+AUDIO_DROP_SILENCE = os.getenv('AUDIO_DROP_SILENCE', 'false').lower() in ('true', '1', 'yes')
+
+# Upper bound on users with tracked statistics (least recently used is evicted)
+AUDIO_MAX_SESSIONS = int(os.getenv('AUDIO_MAX_SESSIONS', 1000))
+
+PCM_DTYPE = np.dtype('<i2')
+
+
+class ChunkAnalysis:
+    """Per-frame analysis of one PCM chunk"""
+
+    __slots__ = ('rms', 'voiced', 'clipped_samples', 'peak')
+
+    def __init__(self, rms, voiced, clipped_samples, peak):
+        self.rms = rms
+        self.voiced = voiced
+        self.clipped_samples = clipped_samples
+        self.peak = peak
+
+    @property
+    def frames(self):
+        return len(self.rms)
+
+    @property
+    def voiced_frames(self):
+        return int(np.count_nonzero(self.voiced))
+
+    @property
+    def is_silent(self):
+        return not self.voiced.any()
+
+
+def analyze_pcm(data, sample_rate, frame_ms=AUDIO_FRAME_MS,
+                silence_rms=AUDIO_SILENCE_RMS, clip_level=AUDIO_CLIP_LEVEL):
+    """Analyze a buffer of little-endian int16 PCM samples frame by frame"""
+    samples = np.frombuffer(data, dtype=PCM_DTYPE)
+    if not len(samples):
+        empty = np.zeros(0, dtype=np.float32)
+        return ChunkAnalysis(empty, np.zeros(0, dtype=bool), 0, 0)
+
+    frame_length = max(1, sample_rate * frame_ms // 1000)
+    full_frames = len(samples) // frame_length
+    whole = samples[:full_frames * frame_length].reshape(full_frames, frame_length)
+
+    # Sum of squares per frame; float32 avoids int16 overflow
+    squares = np.square(whole, dtype=np.float32).sum(axis=1)
+    counts = np.full(full_frames, frame_length, dtype=np.float32)
+
+    # A trailing partial frame is analyzed as a shorter frame
+    tail = samples[full_frames * frame_length:]
+    if len(tail):
+        squares = np.append(squares, np.square(tail, dtype=np.float32).sum())
+        counts = np.append(counts, np.float32(len(tail)))
+
+    rms = np.sqrt(squares / counts)
+    voiced = rms >= silence_rms
+    clipped = int(np.count_nonzero((samples >= clip_level) | (samples <= -clip_level)))
+    peak = int(max(int(samples.max()), -int(samples.min())))
+    return ChunkAnalysis(rms, voiced, clipped, peak)
+
+
+class AudioStats:
+    """Running analysis totals for one user's audio stream"""
+
+    def __init__(self, uid):
+        self.uid = uid
+        self.frames = 0
+        self.voiced_frames = 0
+        self.clipped_samples = 0
+        self.chunks = 0
+        self.dropped_chunks = 0
+        self.peak = 0
+        self.last_rms = 0.0
+        self.last_seen = time.monotonic()
+
+    def update(self, analysis, dropped):
+        self.frames += analysis.frames
+        self.voiced_frames += analysis.voiced_frames
+        self.clipped_samples += analysis.clipped_samples
+        self.chunks += 1
+        self.dropped_chunks += int(dropped)
+        self.peak = max(self.peak, analysis.peak)
+        if analysis.frames:
+            self.last_rms = float(analysis.rms[-1])
+        self.last_seen = time.monotonic()
+
+    def to_dict(self):
+        return {
+            'frames': self.frames,
+            'voiced_frames': self.voiced_frames,
+            'silent_frames': self.frames - self.voiced_frames,
+            'clipped_samples': self.clipped_samples,
+            'chunks': self.chunks,
+            'dropped_chunks': self.dropped_chunks,
+            'peak': self.peak,
+            'last_rms': self.last_rms
+        }
+
+
+class AudioStatsStore:
+    """Per-user analysis statistics with LRU eviction"""
+
+    def __init__(self, max_sessions=AUDIO_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid):
+        with self._lock:
+            return self._stats.get(uid)
+
+    def snapshot(self, uid):
+        """The user's statistics as a dict, or None before any PCM was analyzed"""
+        with self._lock:
+            stats = self._stats.get(uid)
+            return stats.to_dict() if stats is not None else None
+
+    def update(self, uid, analysis, dropped):
+        with self._lock:
+            stats = self._stats.get(uid)
+            if stats is None:
+                stats = self._stats[uid] = AudioStats(uid)
+                while len(self._stats) > self.max_sessions:
+                    self._stats.popitem(last=False)
+            self._stats.move_to_end(uid)
+            stats.update(analysis, dropped)
+            return stats
+
+
+class PcmAnalysisStage(AudioSink):
+    """Pipeline stage that analyzes PCM chunks and drops silent ones
+
+    Each chunk is analyzed before being passed on to `sink`. With
+    AUDIO_DROP_SILENCE enabled, chunks without any voiced frame are not
+    forwarded.
+    """
+
+    def __init__(self, sink, uid, sample_rate, stats_store, drop_silence=AUDIO_DROP_SILENCE):
+        self.sink = sink
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.stats_store = stats_store
+        self.drop_silence = drop_silence
+
+    def write(self, chunk):
+        analysis = analyze_pcm(chunk, self.sample_rate)
+        dropped = self.drop_silence and analysis.is_silent
+        self.stats_store.update(self.uid, analysis, dropped)
+        if not dropped:
+            self.sink.write(chunk)
+
+    def close(self):
+        self.sink.close()
+
+    def abort(self):
+        self.sink.abort()
+
+
+# Shared statistics exposed per user
+audio_stats = AudioStatsStore()
@@ -0,0 +1,470 @@
+"""
+Omi App Webhook Server - Audio Archive
+
+Appends every accepted audio upload (after resampling, so PCM is stored at
+its normalized rate) to fixed-size segment files, with a SQLite index of
+blocks keyed by (uid, session, position) that also records when each block
+was received and where it lives on disk.
+
+Request threads spool each upload to an unlinked temporary file in the
+archive directory as its chunks arrive, so neither they nor the writer
+queue hold audio in memory, and hand the file over once the upload was
+accepted. Splitting it into blocks, optional compression and the segment
+writes happen on the index writer thread, which memory-maps the spool.
+Each upload is indexed in its own transaction, and its bytes are cut off
+the segment again if that fails, so no audio is stored unindexed.
+Framed Opus blocks also record their packet count, duration and the size
+of the Ogg pages that carry them, so exports lay out an Ogg file from the
+index alone. Reads go through cached read-only memory maps of the segment files:
+uncompressed blocks are returned as views into the map, so an hour of
+audio can be streamed or sliced without loading it into RAM.
+
+A user's uploads in one format (sample rate and codec) belong to the same
+session until none arrives for AUDIO_ARCHIVE_SESSION_GAP seconds. Sessions
+are looked up in the index inside an IMMEDIATE transaction, so under
+gunicorn every worker continues the same session; each process only
+writes its own segment files (`<start ns>-<pid>.seg`).
+"""
+import bisect
+import logging
+import mmap
+import os
+import queue
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from .audio_buffer import AUDIO_SESSION_IDLE_TIMEOUT
+from .audio_export import OGG_MAX_PACKET_BYTES, ogg_page_length, opus_packet_samples
+from .audio_stream import OPUS_FRAME_HEADER, AudioSink, AudioStreamError, iter_opus_frames
+from .storage import SQLiteDatabase
+
+logger = logging.getLogger('services.audio_archive')
+
+# Directory holding segment files and the index (empty disables archiving)
+AUDIO_ARCHIVE_DIR = os.getenv('AUDIO_ARCHIVE_DIR', os.path.join(os.getenv('DATA_DIR', 'data'), 'audio'))
+
+# Segment file size after which a new segment is started
+AUDIO_ARCHIVE_SEGMENT_BYTES = int(os.getenv('AUDIO_ARCHIVE_SEGMENT_BYTES', 64 * 1024 * 1024))
+
+# Uncompressed bytes per indexed block (the unit of compression and of slicing)
+AUDIO_ARCHIVE_BLOCK_BYTES = int(os.getenv('AUDIO_ARCHIVE_BLOCK_BYTES', 64 * 1024))
+
+# Block compression: none or zlib (PCM is delta-coded before zlib)
+AUDIO_ARCHIVE_COMPRESSION = os.getenv('AUDIO_ARCHIVE_COMPRESSION', 'none').lower()
+
+# zlib level used for archived blocks
+AUDIO_ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('AUDIO_ARCHIVE_COMPRESSION_LEVEL', 1))
+
+# Seconds without audio after which a user's next upload starts a new session
+AUDIO_ARCHIVE_SESSION_GAP = float(os.getenv('AUDIO_ARCHIVE_SESSION_GAP', AUDIO_SESSION_IDLE_TIMEOUT))
+
+# Uploads (spool files) waiting for the writer before new ones are refused with 503
+AUDIO_ARCHIVE_QUEUE_SIZE = int(os.getenv('AUDIO_ARCHIVE_QUEUE_SIZE', 128))
+
+# Segment files kept memory-mapped for reads
+AUDIO_ARCHIVE_OPEN_SEGMENTS = int(os.getenv('AUDIO_ARCHIVE_OPEN_SEGMENTS', 16))
+
+SEGMENT_SUFFIX = '.seg'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_blocks (
+    uid TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    received_at REAL NOT NULL,
+    sample_rate INTEGER NOT NULL,
+    codec TEXT NOT NULL,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    raw_length INTEGER NOT NULL,
+    compression TEXT NOT NULL,
+    -- Framed Opus only (NULL otherwise): packets, their 48 kHz samples and
+    -- the bytes of their Ogg pages (NULL if one does not fit a page)
+    packets INTEGER,
+    samples INTEGER,
+    page_bytes INTEGER,
+    PRIMARY KEY (uid, session_id, position)
+);
+CREATE INDEX IF NOT EXISTS audio_blocks_received ON audio_blocks (uid, received_at);
+"""
+
+INSERT_BLOCK = "INSERT OR REPLACE INTO audio_blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+SESSIONS_QUERY = """
+SELECT session_id, MIN(received_at), MAX(received_at), sample_rate, codec, SUM(raw_length)
+FROM audio_blocks WHERE uid = ?
+GROUP BY session_id ORDER BY MIN(received_at) DESC LIMIT ? OFFSET ?
+"""
+
+# The user's latest block in a format, and the end of that block's session
+LATEST_BLOCK_QUERY = """
+SELECT session_id, received_at FROM audio_blocks
+WHERE uid = ? AND sample_rate = ? AND codec = ?
+ORDER BY received_at DESC LIMIT 1
+"""
+SESSION_END_QUERY = """
+SELECT position + raw_length FROM audio_blocks
+WHERE uid = ? AND session_id = ? ORDER BY position DESC LIMIT 1
+"""
+
+BLOCKS_QUERY = """
+SELECT position, received_at, sample_rate, codec, segment, offset, length, raw_length, compression,
+       packets, samples, page_bytes
+FROM audio_blocks WHERE uid = ? AND session_id = ? ORDER BY position
+"""
+
+# One stored block: `position` is its byte offset within the session's stream
+ArchivedBlock = namedtuple('ArchivedBlock', [
+    'position', 'received_at', 'sample_rate', 'codec', 'segment', 'offset', 'length', 'raw_length',
+    'compression', 'packets', 'samples', 'page_bytes'
+])
+
+# An upload handed to the writer thread, spooled to a temporary file
+ArchivedUpload = namedtuple('ArchivedUpload', ['uid', 'received_at', 'sample_rate', 'codec', 'spool'])
+
+
+def compress_block(data, codec, compression, level=AUDIO_ARCHIVE_COMPRESSION_LEVEL):
+    """Return (stored bytes, compression name) for one block"""
+    if compression != 'zlib':
+        return data, ''
+    if codec == 'pcm':
+        # First-order prediction: sample deltas of speech compress far better than samples
+        samples = np.frombuffer(data, dtype='<i2')
+        deltas = np.diff(samples, prepend=np.int16(0))
+        return zlib.compress(deltas.tobytes(), level), 'delta+zlib'
+    return zlib.compress(data, level), 'zlib'
+
+
+def decompress_block(data, compression):
+    """Inverse of compress_block"""
+    if not compression:
+        return data
+    raw = zlib.decompress(data)
+    if compression == 'delta+zlib':
+        deltas = np.frombuffer(raw, dtype='<i2')
+        raw = np.cumsum(deltas, dtype=np.int16).tobytes()
+    return raw
+
+
+class AudioArchiveStage(AudioSink):
+    """Pipeline stage that spools an upload and archives it once it was accepted
+
+    Chunks are passed on to `sink` unchanged. The spool file is created on
+    the first chunk, so uploads left empty (all silence) touch no disk.
+    Nothing is archived for uploads that fail validation.
+    """
+
+    def __init__(self, sink, archive, uid, sample_rate, codec):
+        self.sink = sink
+        self.archive = archive
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.codec = codec
+        self.spool = None
+
+    def write(self, chunk):
+        try:
+            if self.spool is None:
+                self.spool = self.archive.open_spool()
+            self.spool.write(chunk)
+        except OSError as e:
+            logger.error(f"Failed to spool audio for {self.uid}: {e!r}")
+            raise AudioStreamError('Audio archive unavailable', 503)
+        self.sink.write(chunk)
+
+    def close(self):
+        if self.spool is not None:
+            self.archive.append(self.uid, self.sample_rate, self.codec, self.spool)
+            # The writer thread owns the spool now
+            self.spool = None
+        self.sink.close()
+
+    def abort(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        self.sink.abort()
+
+
+class AudioArchive(SQLiteDatabase):
+    """Segment-file audio archive indexed in SQLite"""
+
+    schema = SCHEMA
+    statement_order = [INSERT_BLOCK]
+    writer_name = 'audio-archive-writer'
+
+    def __init__(self, directory=AUDIO_ARCHIVE_DIR, segment_bytes=AUDIO_ARCHIVE_SEGMENT_BYTES,
+                 block_bytes=AUDIO_ARCHIVE_BLOCK_BYTES, compression=AUDIO_ARCHIVE_COMPRESSION,
+                 session_gap=AUDIO_ARCHIVE_SESSION_GAP, open_segments=AUDIO_ARCHIVE_OPEN_SEGMENTS,
+                 queue_size=AUDIO_ARCHIVE_QUEUE_SIZE, **kwargs):
+        super().__init__(os.path.join(directory, 'index.db'), queue_size=queue_size, **kwargs)
+        if compression not in ('none', 'zlib'):
+            logger.warning(f"Unknown AUDIO_ARCHIVE_COMPRESSION {compression!r}, storing blocks uncompressed")
+            compression = 'none'
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        # Whole 16-bit samples per block so PCM blocks can be delta-coded on their own
+        self.block_bytes = block_bytes - block_bytes % 2
+        self.compression = compression
+        self.session_gap = session_gap
+        self.open_segments = open_segments
+        self._maps = OrderedDict()
+        self._maps_lock = threading.Lock()
+        self._segment = None
+        self._segment_name = None
+        self._segment_size = 0
+        self._segment_pid = None
+        self.archived_bytes = 0
+        self.stored_bytes = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def stage(self, sink, uid, sample_rate, codec):
+        """Wrap sink so accepted uploads are archived too (sink itself when disabled)"""
+        if not self.enabled:
+            return sink
+        return AudioArchiveStage(sink, self, uid, sample_rate, codec)
+
+    def open_spool(self):
+        """Temporary file for one upload, deleted when closed"""
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.TemporaryFile(dir=self.directory)
+
+    def append(self, uid, sample_rate, codec, spool):
+        """Queue an accepted upload for archiving; takes ownership of its spool file
+
+        Raises AudioStreamError (503) when the spool cannot be written or the
+        writer is too far behind; the spool then stays with the caller.
+        """
+        self._ensure_started()
+        try:
+            spool.flush()
+        except OSError as e:
+            logger.error(f"Failed to spool audio for {uid}: {e!r}")
+            raise AudioStreamError('Audio archive unavailable', 503)
+        try:
+            self._queue.put_nowait((None, ArchivedUpload(uid, time.time(), sample_rate, codec, spool)))
+        except queue.Full:
+            raise AudioStreamError('Audio archive busy', 503)
+
+    def _write_batch(self, conn, batch):
+        # Runs on the writer thread; uploads are archived one transaction each
+        # so a failure only loses the upload that caused it
+        for _, upload in batch:
+            with upload.spool:
+                self._archive_upload(conn, upload)
+        self.batches += 1
+        self.operations += len(batch)
+
+    def _archive_upload(self, conn, upload):
+        """Place an upload in its session, append its blocks and index them atomically"""
+        start_size = None
+        size = os.fstat(upload.spool.fileno()).st_size
+        try:
+            # Uploads never span segments, so a failed one can be cut off again
+            if self._segment is None or self._segment_pid != os.getpid() \
+                    or (self._segment_size and self._segment_size + size > self.segment_bytes):
+                self._open_segment()
+            start_size = self._segment_size
+            # IMMEDIATE takes the write lock before the session lookup, so
+            # writers in other processes cannot claim the same positions
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                session_id, position = self._place(conn, upload)
+                with mmap.mmap(upload.spool.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    rows = self._store_upload(upload, data, session_id, position)
+                # Bytes reach the file before readers can find them in the index
+                self._segment.flush()
+                conn.executemany(INSERT_BLOCK, rows)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Failed to archive {size} bytes of audio for {upload.uid}: {e!r}")
+            if start_size is not None:
+                self._truncate_segment(start_size)
+            return
+        self.archived_bytes += size
+        self.stored_bytes += sum(row[8] for row in rows)
+
+    def _place(self, conn, upload):
+        """(session_id, position) continuing the user's latest session in this format"""
+        latest = conn.execute(
+            LATEST_BLOCK_QUERY, (upload.uid, upload.sample_rate, upload.codec)
+        ).fetchone()
+        if latest is not None and upload.received_at - latest[1] < self.session_gap:
+            session_id = latest[0]
+            (position,) = conn.execute(SESSION_END_QUERY, (upload.uid, session_id)).fetchone()
+            return session_id, position
+        return f'{int(upload.received_at * 1000)}-{os.getpid()}', 0
+
+    def _store_upload(self, upload, data, session_id, position):
+        """Split an upload's spooled `data` into blocks, append them to the segment and return their index rows"""
+        rows = []
+        seconds_per_byte = 1.0 / (upload.sample_rate * 2) if upload.codec == 'pcm' else 0.0
+        with memoryview(data) as view:
+            for start, end, packets, samples, page_bytes in self._block_spans(upload, data):
+                # Views into the map are released at once, so it can be closed after the upload
+                with view[start:end] as block:
+                    stored, compression = compress_block(block, upload.codec, self.compression)
+                    offset = self._segment_size
+                    self._segment.write(stored)
+                    length = len(stored)
+                    self._segment_size += length
+                rows.append((
+                    upload.uid, session_id, position + start,
+                    upload.received_at + start * seconds_per_byte, upload.sample_rate, upload.codec,
+                    self._segment_name, offset, length, end - start, compression,
+                    packets, samples, page_bytes
+                ))
+        return rows
+
+    def _block_spans(self, upload, data):
+        """(start, end, packets, samples, page_bytes) of each block of an upload
+
+        Framed Opus is cut between packets, so every block holds whole
+        packets and exports can rebuild packet boundaries block by block;
+        the scan that finds the cuts also sums up each block's Ogg layout.
+        Opus that does not parse (it is only validated when decoded) falls
+        back to fixed-size blocks without a layout and cannot be exported
+        as Ogg. PCM blocks have no layout either.
+        """
+        size = len(data)
+        if upload.codec == 'opus':
+            try:
+                spans = []
+                start = 0
+                packets = samples = page_bytes = 0
+                for offset, length in iter_opus_frames(data):
+                    header = offset - OPUS_FRAME_HEADER.size
+                    if offset + length - start > self.block_bytes and header > start:
+                        spans.append((start, header, packets, samples, page_bytes))
+                        start = header
+                        packets = samples = page_bytes = 0
+                    packets += 1
+                    samples += opus_packet_samples(data[offset:offset + min(length, 2)])
+                    if page_bytes is not None:
+                        page_bytes = page_bytes + ogg_page_length(length) if length <= OGG_MAX_PACKET_BYTES else None
+                spans.append((start, size, packets, samples, page_bytes))
+                return spans
+            except AudioStreamError:
+                logger.warning(f"Archiving unframed Opus audio for {upload.uid} in fixed-size blocks")
+        return [
+            (start, min(start + self.block_bytes, size), None, None, None)
+            for start in range(0, size, self.block_bytes)
+        ]
+
+    def _truncate_segment(self, size):
+        # Drop the bytes of an upload that was not indexed; if even that
+        # fails, continue in a new segment so nothing is appended after them
+        try:
+            self._segment.truncate(size)
+            self._segment_size = size
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to truncate audio segment {self._segment_name}: {e!r}")
+            try:
+                self._segment.close()
+            except OSError:
+                pass
+            self._segment = None
+
+    def _open_segment(self):
+        if self._segment is not None and self._segment_pid == os.getpid():
+            self._segment.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self._segment_name = f'{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}'
+        self._segment = open(os.path.join(self.directory, self._segment_name), 'ab')
+        self._segment_size = 0
+        self._segment_pid = os.getpid()
+
+    def sessions(self, uid, limit=20, offset=0):
+        """The uid's archived sessions, newest first"""
+        if not self.enabled:
+            return []
+        with self.reader() as conn:
+            rows = conn.execute(SESSIONS_QUERY, (uid, limit, offset)).fetchall()
+        return [
+            {
+                'session_id': session_id,
+                'started_at': started_at,
+                'last_received_at': last_received_at,
+                'sample_rate': sample_rate,
+                'codec': codec,
+                'bytes': size
+            }
+            for session_id, started_at, last_received_at, sample_rate, codec, size in rows
+        ]
+
+    def blocks(self, uid, session_id):
+        """Index entries of a session's blocks, in stream order"""
+        if not self.enabled:
+            return []
+        with self.reader() as conn:
+            rows = conn.execute(BLOCKS_QUERY, (uid, session_id)).fetchall()
+        return [ArchivedBlock(*row) for row in rows]
+
+    def segment_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _map(self, name, end):
+        """Read-only memory map of a segment file covering at least `end` bytes"""
+        with self._maps_lock:
+            mapped = self._maps.get(name)
+            if mapped is None or len(mapped) < end:
+                # The segment being written grows; map it again once reads pass its old end
+                with open(self.segment_path(name), 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[name] = mapped
+                # Evicted maps are unmapped once no view into them is left
+                while len(self._maps) > self.open_segments:
+                    self._maps.popitem(last=False)
+            self._maps.move_to_end(name)
+            return mapped
+
+    def read_block(self, block):
+        """Raw audio of a block: a view into the segment map, or decompressed bytes"""
+        data = memoryview(self._map(block.segment, block.offset + block.length))
+        data = data[block.offset:block.offset + block.length]
+        return decompress_block(data, block.compression) if block.compression else data
+
+    def iter_audio(self, blocks, start=0, end=None):
+        """Yield the raw audio of bytes [start, end) of a session's stream, block by block"""
+        if not blocks:
+            return
+        stream_end = blocks[-1].position + blocks[-1].raw_length
+        end = stream_end if end is None else min(end, stream_end)
+        positions = [block.position for block in blocks]
+        index = max(0, bisect.bisect_right(positions, start) - 1)
+        for block in blocks[index:]:
+            if block.position >= end:
+                break
+            data = self.read_block(block)
+            first = max(0, start - block.position)
+            last = min(block.raw_length, end - block.position)
+            if first < last:
+                yield data[first:last]
+
+    def close(self):
+        """Write queued uploads, then close the segment and index"""
+        if self._pid != os.getpid():
+            return
+        super().close()
+        if self._segment is not None and self._segment_pid == os.getpid():
+            self._segment.close()
+            self._segment = None
+        with self._maps_lock:
+            self._maps.clear()
+
+
+# Shared archive used by the audio handler
+audio_archive = AudioArchive()
@@ -0,0 +1,255 @@
+"""
+Omi App Webhook Server - Audio Session Buffers
+
+Keeps the most recent audio of each user's stream in a preallocated,
+fixed-size ring buffer so downstream consumers can read the last N seconds
+without concatenating chunks. Memory per session is bounded by
+AUDIO_BUFFER_SECONDS and idle sessions are evicted.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .audio_stream import AudioSink
+
+logger = logging.getLogger('services.audio_buffer')
+
+# Seconds of audio kept per session (0 disables session buffering)
+AUDIO_BUFFER_SECONDS = float(os.getenv('AUDIO_BUFFER_SECONDS', 30))
+
+# Sessions with no audio for this many seconds are evicted
+AUDIO_SESSION_IDLE_TIMEOUT = float(os.getenv('AUDIO_SESSION_IDLE_TIMEOUT', 300))
+
+# Upper bound on concurrently buffered sessions (least recently used is evicted)
+AUDIO_MAX_SESSIONS = int(os.getenv('AUDIO_MAX_SESSIONS', 1000))
+
+# PCM from Omi devices is 16-bit mono
+BYTES_PER_SAMPLE = 2
+
+
+class AudioRingBuffer:
+    """Fixed-capacity byte ring buffer backed by a single preallocated bytearray"""
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError('Ring buffer capacity must be positive')
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._write_pos = 0
+        self.size = 0
+        self.total_bytes = 0
+
+    def append(self, data):
+        """Copy data into the buffer, overwriting the oldest bytes when full"""
+        data = memoryview(data).cast('B')
+        length = len(data)
+        if not length:
+            return
+        self.total_bytes += length
+
+        # Only the newest `capacity` bytes can survive
+        if length >= self.capacity:
+            self._view[:] = data[length - self.capacity:]
+            self._write_pos = 0
+            self.size = self.capacity
+            return
+
+        first = min(length, self.capacity - self._write_pos)
+        self._view[self._write_pos:self._write_pos + first] = data[:first]
+        if first < length:
+            self._view[:length - first] = data[first:]
+        self._write_pos = (self._write_pos + length) % self.capacity
+        self.size = min(self.capacity, self.size + length)
+
+    def read_last(self, length, out=None):
+        """Return a memoryview of the newest `length` bytes
+
+        The bytes are copied into `out` (a writable buffer of at least
+        `length` bytes) when given, otherwise into a new bytearray.
+        """
+        length = min(length, self.size)
+        if out is None:
+            out = bytearray(length)
+        target = memoryview(out).cast('B')[:length]
+
+        start = (self._write_pos - length) % self.capacity
+        first = min(length, self.capacity - start)
+        target[:first] = self._view[start:start + first]
+        if first < length:
+            target[first:] = self._view[:length - first]
+        return target
+
+    def mark(self):
+        """Return a position that `rollback` can later return to"""
+        return self._write_pos, self.size, self.total_bytes
+
+    def rollback(self, mark):
+        """Discard everything appended since `mark`
+
+        Old bytes that were overwritten by the discarded appends are gone, so
+        they are dropped from the buffer as well.
+        """
+        write_pos, size, total_bytes = mark
+        written = self.total_bytes - total_bytes
+        overwritten = max(0, size + written - self.capacity)
+        self._write_pos = write_pos
+        self.size = max(0, size - overwritten)
+        self.total_bytes = total_bytes
+
+    def clear(self):
+        """Drop all buffered bytes without releasing the allocation"""
+        self._write_pos = 0
+        self.size = 0
+
+
+class AudioSession:
+    """Buffered audio stream for one user"""
+
+    def __init__(self, uid, sample_rate, codec, seconds=AUDIO_BUFFER_SECONDS):
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.codec = codec
+        self.bytes_per_second = sample_rate * BYTES_PER_SAMPLE
+        self.buffer = AudioRingBuffer(int(seconds * self.bytes_per_second))
+        self.created_at = time.monotonic()
+        self.last_seen = self.created_at
+        self.lock = threading.Lock()
+
+    def append(self, data):
+        with self.lock:
+            self.buffer.append(data)
+            self.last_seen = time.monotonic()
+
+    def read_last_seconds(self, seconds, out=None):
+        """Return the newest `seconds` of audio (sample aligned for PCM)"""
+        length = int(seconds * self.bytes_per_second)
+        if self.codec == 'pcm':
+            length -= length % BYTES_PER_SAMPLE
+        with self.lock:
+            return self.buffer.read_last(length, out)
+
+    @property
+    def buffered_seconds(self):
+        return self.buffer.size / self.bytes_per_second
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'codec': self.codec,
+                'buffered_seconds': self.buffered_seconds,
+                'total_bytes': self.buffer.total_bytes,
+                'idle_seconds': time.monotonic() - self.last_seen
+            }
+
+
+class AudioSessionWriter(AudioSink):
+    """Sink that appends one request's chunks to a session, undoing them on abort
+
+    The session is looked up on the first chunk, so requests rejected before
+    any audio arrives never touch (or reset) the user's buffer.
+    """
+
+    def __init__(self, store, uid, sample_rate, codec):
+        self.store = store
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.codec = codec
+        self.session = None
+        self._mark = None
+        self._written = 0
+
+    def write(self, chunk):
+        if self.session is None:
+            self.session = self.store.get_or_create(self.uid, self.sample_rate, self.codec)
+            with self.session.lock:
+                self._mark = self.session.buffer.mark()
+        self.session.append(chunk)
+        self._written += len(chunk)
+
+    def abort(self):
+        if self.session is None:
+            return
+        with self.session.lock:
+            buffer = self.session.buffer
+            # Only roll back if no other request appended in the meantime
+            if buffer.total_bytes == self._mark[2] + self._written:
+                buffer.rollback(self._mark)
+
+
+class AudioSessionStore:
+    """Registry of per-user audio sessions with idle and LRU eviction"""
+
+    def __init__(self, seconds=AUDIO_BUFFER_SECONDS, idle_timeout=AUDIO_SESSION_IDLE_TIMEOUT,
+                 max_sessions=AUDIO_MAX_SESSIONS):
+        self.seconds = seconds
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    @property
+    def enabled(self):
+        return self.seconds > 0
+
+    def get(self, uid):
+        with self._lock:
+            return self._sessions.get(uid)
+
+    def get_or_create(self, uid, sample_rate, codec):
+        """Return the user's session, starting a new one if the stream format changed"""
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(uid)
+            if session is None or session.sample_rate != sample_rate or session.codec != codec:
+                session = AudioSession(uid, sample_rate, codec, self.seconds)
+                self._sessions[uid] = session
+                while len(self._sessions) > self.max_sessions:
+                    evicted_uid, _ = self._sessions.popitem(last=False)
+                    logger.debug(f"Evicted audio session for user {evicted_uid} (session limit)")
+            self._sessions.move_to_end(uid)
+            return session
+
+    def append(self, uid, data, sample_rate, codec):
+        """Append a chunk to the user's session buffer"""
+        if not self.enabled:
+            return None
+        session = self.get_or_create(uid, sample_rate, codec)
+        session.append(data)
+        return session
+
+    def writer(self, uid, sample_rate, codec):
+        """Return a sink streaming into the user's session (a no-op sink when disabled)"""
+        if not self.enabled:
+            return AudioSink()
+        return AudioSessionWriter(self, uid, sample_rate, codec)
+
+    def remove(self, uid):
+        with self._lock:
+            return self._sessions.pop(uid, None)
+
+    def _evict_idle(self):
+        """Drop sessions idle for longer than the timeout (called with the lock held)"""
+        now = time.monotonic()
+        if now - self._last_eviction < 1.0:
+            return
+        self._last_eviction = now
+
+        # Sessions are kept in least-recently-used order
+        while self._sessions:
+            uid, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.idle_timeout:
+                break
+            del self._sessions[uid]
+            logger.debug(f"Evicted idle audio session for user {uid}")
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# Shared store used by the audio handler
+audio_sessions = AudioSessionStore()
@@ -0,0 +1,252 @@
+"""
+Omi App Webhook Server - Audio Export
+
+Builds WAV (PCM sessions) and Ogg Opus (Opus sessions) downloads of
+archived audio. The exact size of every part of the file (headers, pages,
+audio) is known from the archive index alone, before any of it is
+produced: WAV sizes from the blocks' lengths, Ogg page sizes from the
+packet layout recorded for each Opus block. So the WAV header is written
+up front, Content-Length is exact and any byte range can be served by
+reading only the blocks it covers.
+
+An export is a list of parts, each `(offset, length, produce)` where
+`produce(first, last)` yields the bytes [first, last) of the part.
+"""
+import bisect
+import struct
+import zlib
+from functools import partial
+
+from .audio_stream import AudioStreamError, iter_opus_frames
+
+# Archived PCM is 16-bit mono
+WAV_CHANNELS = 1
+WAV_SAMPLE_WIDTH = 2
+WAV_HEADER_BYTES = 44
+WAV_MAX_DATA_BYTES = 0xFFFFFFFF - (WAV_HEADER_BYTES - 8)
+
+# Ogg page layout (RFC 3533) and Ogg Opus headers (RFC 7845)
+OGG_PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+OGG_BOS = 0x02
+OGG_EOS = 0x04
+OGG_SERIAL = 0x4F4D4931
+OGG_MAX_PACKET_BYTES = 255 * 255 - 1
+
+# Zero bytes yielded at a time for gaps in an archived PCM stream
+SILENCE_CHUNK_BYTES = 64 * 1024
+
+# Samples (at 48 kHz) per frame for each Opus TOC configuration
+OPUS_FRAME_SAMPLES = (
+    [480, 960, 1920, 2880] * 3 +  # SILK: 10, 20, 40, 60 ms
+    [480, 960] * 2 +              # Hybrid: 10, 20 ms
+    [120, 240, 480, 960] * 4      # CELT: 2.5, 5, 10, 20 ms
+)
+
+FORMATS = {
+    'wav': ('audio/wav', 'pcm'),
+    'ogg': ('audio/ogg', 'opus')
+}
+
+
+class ExportError(Exception):
+    """Raised when a session cannot be exported in the requested format"""
+
+
+def wav_header(sample_rate, data_length):
+    """Canonical 44-byte PCM WAV header for data_length bytes of 16-bit mono audio"""
+    byte_rate = sample_rate * WAV_CHANNELS * WAV_SAMPLE_WIDTH
+    return b''.join([
+        b'RIFF', struct.pack('<I', WAV_HEADER_BYTES - 8 + data_length), b'WAVE',
+        b'fmt ', struct.pack('<IHHIIHH', 16, 1, WAV_CHANNELS, sample_rate, byte_rate,
+                             WAV_CHANNELS * WAV_SAMPLE_WIDTH, WAV_SAMPLE_WIDTH * 8),
+        b'data', struct.pack('<I', data_length)
+    ])
+
+
+# Every byte value with its bits in reverse order
+REVERSED_BITS = bytes(int(f'{byte:08b}'[::-1], 2) for byte in range(256))
+
+
+def ogg_crc(data):
+    """CRC-32 as used by Ogg (polynomial 0x04C11DB7, no reflection, no final XOR)
+
+    zlib computes the bit-reflected CRC with the same polynomial, so the Ogg
+    CRC of data is the reflected CRC of its bit-reversed bytes, reversed
+    again. Starting zlib from 0xFFFFFFFF and undoing its final inversion
+    gives the zero initial value Ogg uses. Both steps run in C.
+    """
+    crc = zlib.crc32(bytes(data).translate(REVERSED_BITS), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f'{crc:032b}'[::-1], 2)
+
+
+def lacing(length):
+    """Ogg segment table of a page holding one packet of `length` bytes"""
+    return bytes([255] * (length // 255) + [length % 255])
+
+
+def ogg_page_length(packet_length):
+    return OGG_PAGE_HEADER.size + packet_length // 255 + 1 + packet_length
+
+
+def ogg_page(packet, granule, sequence, flags=0):
+    """One Ogg page carrying exactly one packet"""
+    segments = lacing(len(packet))
+    header = OGG_PAGE_HEADER.pack(b'OggS', 0, flags, granule, OGG_SERIAL, sequence, 0, len(segments))
+    page = bytearray(header + segments + packet)
+    struct.pack_into('<I', page, 22, ogg_crc(page))
+    return bytes(page)
+
+
+def opus_packet_samples(packet):
+    """Duration of an Opus packet in 48 kHz samples, from its TOC byte"""
+    if not packet:
+        return 0
+    toc = packet[0]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = packet[1] & 0x3F if len(packet) > 1 else 0
+    return OPUS_FRAME_SAMPLES[toc >> 3] * frames
+
+
+def opus_headers(sample_rate):
+    """OpusHead and OpusTags packets for a mono stream"""
+    head = b'OpusHead' + struct.pack('<BBHIhB', 1, 1, 0, sample_rate, 0, 0)
+    vendor = b'omi-webhook'
+    tags = b'OpusTags' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+    return head, tags
+
+
+def _slice_bytes(data):
+    def produce(first, last):
+        yield data[first:last]
+    return produce
+
+
+def _silence(first, last):
+    remaining = last - first
+    while remaining > 0:
+        chunk = min(remaining, SILENCE_CHUNK_BYTES)
+        yield bytes(chunk)
+        remaining -= chunk
+
+
+def wav_parts(archive, blocks):
+    """Parts of a WAV file holding a PCM session
+
+    Stream positions the archive holds no blocks for (an upload that could
+    not be archived) are filled with silence, so the audio part always has
+    the length the header declares.
+    """
+    data_length = blocks[-1].position + blocks[-1].raw_length
+    if data_length > WAV_MAX_DATA_BYTES:
+        raise ExportError('Session too long for WAV')
+    header = wav_header(blocks[0].sample_rate, data_length)
+
+    def produce_audio(run, start, first, last):
+        for chunk in archive.iter_audio(run, start + first, start + last):
+            yield bytes(chunk)
+
+    parts = [(0, len(header), _slice_bytes(header))]
+    position = 0
+    run = []
+    for block in blocks + [None]:
+        if run and (block is None or block.position != position):
+            start = run[0].position
+            parts.append((len(header) + start, position - start, partial(produce_audio, run, start)))
+            run = []
+        if block is None:
+            break
+        if block.position < position:
+            raise ExportError('Archived PCM blocks overlap')
+        if block.position > position:
+            parts.append((len(header) + position, block.position - position, _silence))
+        run.append(block)
+        position = block.position + block.raw_length
+    return parts
+
+
+def _block_packets(archive, block):
+    """Packets of an archived Opus block, as views into its data"""
+    data = archive.read_block(block)
+    try:
+        return [data[offset:offset + length] for offset, length in iter_opus_frames(data)]
+    except AudioStreamError:
+        raise ExportError('Archived Opus audio is not framed')
+
+
+def ogg_parts(archive, blocks):
+    """Parts of an Ogg Opus file holding an Opus session, one page per packet
+
+    Archived Opus keeps the upload framing and blocks end on packet
+    boundaries, and the index records each block's packet count, samples
+    and page bytes, so the layout is computed without reading any audio.
+    Each block is one part, and producing any of its bytes reads and parses
+    only that block.
+    """
+    head, tags = opus_headers(blocks[0].sample_rate)
+    pages = [ogg_page(head, 0, 0, OGG_BOS), ogg_page(tags, 0, 1)]
+    parts = []
+    offset = 0
+    for page in pages:
+        parts.append((offset, len(page), _slice_bytes(page)))
+        offset += len(page)
+
+    def produce_pages(block, sequence, granule, last_block, first, last):
+        packets = _block_packets(archive, block)
+        page_offset = 0
+        for index, packet in enumerate(packets):
+            granule += opus_packet_samples(packet)
+            length = ogg_page_length(len(packet))
+            if page_offset < last and page_offset + length > first:
+                flags = OGG_EOS if last_block and index == len(packets) - 1 else 0
+                page = ogg_page(bytes(packet), granule, sequence + index, flags)
+                yield page[max(0, first - page_offset):last - page_offset]
+            page_offset += length
+
+    sequence = len(pages)
+    granule = 0
+    for index, block in enumerate(blocks):
+        if block.packets is None:
+            raise ExportError('Archived Opus audio is not framed')
+        if block.page_bytes is None:
+            raise ExportError('Archived Opus packet too large for one Ogg page')
+        last_block = index == len(blocks) - 1
+        parts.append((offset, block.page_bytes, partial(produce_pages, block, sequence, granule, last_block)))
+        offset += block.page_bytes
+        sequence += block.packets
+        granule += block.samples
+    return parts
+
+
+def export_parts(archive, blocks, export_format):
+    """Parts of a session's export, or ExportError if the format does not fit its codec"""
+    _, codec = FORMATS[export_format]
+    if not blocks:
+        raise ExportError('No archived audio for this session')
+    if blocks[0].codec != codec:
+        raise ExportError(f"{export_format} export needs {codec} audio, session is {blocks[0].codec}")
+    if export_format == 'wav':
+        return wav_parts(archive, blocks)
+    return ogg_parts(archive, blocks)
+
+
+def export_length(parts):
+    offset, length, _ = parts[-1]
+    return offset + length
+
+
+def iter_range(parts, start, end):
+    """Yield bytes [start, end) of an export, touching only the parts that overlap it"""
+    offsets = [offset for offset, _, _ in parts]
+    index = max(0, bisect.bisect_right(offsets, start) - 1)
+    for offset, length, produce in parts[index:]:
+        if offset >= end:
+            break
+        first = max(0, start - offset)
+        last = min(length, end - offset)
+        if first < last:
+            yield from produce(first, last)
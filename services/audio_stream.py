@@ -0,0 +1,166 @@
+"""
+Omi App Webhook Server - Streaming Audio Ingestion
+
+Reads octet-stream request bodies in fixed-size chunks straight from the
+WSGI input instead of buffering the whole upload, validating as it goes and
+handing each chunk to a sink. Memory per request stays at one chunk
+regardless of upload size.
+
+With AUDIO_OPUS_FRAMING=length, Opus bodies carry one or more packets,
+each preceded by its length as a 2-byte big-endian integer, so packet
+boundaries survive the byte stream.
+"""
+import logging
+import os
+import struct
+
+logger = logging.getLogger('services.audio_stream')
+
+# Largest audio body accepted per request
+AUDIO_MAX_BODY_BYTES = int(os.getenv('AUDIO_MAX_BODY_BYTES', 10 * 1024 * 1024))
+
+# Bytes read from the request stream at a time
+AUDIO_READ_CHUNK_BYTES = int(os.getenv('AUDIO_READ_CHUNK_BYTES', 64 * 1024))
+
+# PCM chunks handed to sinks always contain whole 16-bit samples
+PCM_SAMPLE_WIDTH = 2
+
+# Length prefix of each packet in an Opus body
+OPUS_FRAME_HEADER = struct.Struct('>H')
+
+
+class AudioStreamError(Exception):
+    """Raised when an audio body fails validation while streaming"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class AudioSink:
+    """Base class for consumers of streamed audio chunks
+
+    Chunks passed to `write` are views into a reused read buffer, so sinks
+    must copy anything they keep. `close` is called once the whole body has
+    been accepted and may itself raise AudioStreamError; `abort` is called
+    instead if validation fails, whether or not chunks were written.
+    """
+
+    def write(self, chunk):
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+def iter_opus_frames(data):
+    """Yield (offset, length) of every packet in a complete framed Opus buffer
+
+    Raises AudioStreamError if a length prefix is zero or runs past the end.
+    """
+    header = OPUS_FRAME_HEADER.size
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < header:
+            raise AudioStreamError('Invalid Opus audio data')
+        (length,) = OPUS_FRAME_HEADER.unpack_from(data, offset)
+        if not length or offset + header + length > len(data):
+            raise AudioStreamError('Invalid Opus audio data')
+        yield offset + header, length
+        offset += header + length
+
+
+class OpusFrameReader:
+    """Splits streamed chunks of a framed Opus body into whole packets"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk):
+        """Add a chunk and return the packets it completed"""
+        buffer = self._buffer
+        buffer += chunk
+        packets = []
+        offset = 0
+        header = OPUS_FRAME_HEADER.size
+        while len(buffer) - offset >= header:
+            (length,) = OPUS_FRAME_HEADER.unpack_from(buffer, offset)
+            if not length:
+                raise AudioStreamError('Invalid Opus audio data')
+            end = offset + header + length
+            if end > len(buffer):
+                break
+            packets.append(bytes(buffer[offset + header:end]))
+            offset = end
+        del buffer[:offset]
+        return packets
+
+    @property
+    def complete(self):
+        """True when no partial packet is pending"""
+        return not self._buffer
+
+
+def read_audio_body(stream, content_length, sink, codec,
+                    chunk_size=AUDIO_READ_CHUNK_BYTES, max_bytes=AUDIO_MAX_BODY_BYTES):
+    """Stream an audio request body into `sink` and return the number of bytes read
+
+    Validation that only needs headers (empty body, oversized body, odd PCM
+    length) happens before any body bytes are read. Bodies without a
+    Content-Length (chunked uploads) are checked incrementally instead.
+    The sink is aborted on any failure, so stages holding resources (such as
+    a decoder slot) release them even when no body byte was read.
+    """
+    align = PCM_SAMPLE_WIDTH if codec == 'pcm' else 1
+    total = 0
+    pending = 0  # Bytes of an incomplete sample carried over from the last read
+    try:
+        if content_length is not None:
+            if content_length == 0:
+                raise AudioStreamError('Missing audio data')
+            if codec == 'pcm' and content_length % PCM_SAMPLE_WIDTH != 0:
+                raise AudioStreamError('Invalid PCM audio data length')
+            if content_length > max_bytes:
+                raise AudioStreamError('Audio data too large', 413)
+
+        buffer = bytearray(chunk_size + align)
+        view = memoryview(buffer)
+        readinto = getattr(stream, 'readinto', None)
+
+        while True:
+            if readinto is not None:
+                read = readinto(view[pending:pending + chunk_size])
+            else:
+                data = stream.read(chunk_size)
+                read = len(data)
+                view[pending:pending + read] = data
+            if not read:
+                break
+
+            total += read
+            if total > max_bytes:
+                raise AudioStreamError('Audio data too large', 413)
+
+            available = pending + read
+            aligned = available - available % align
+            if aligned:
+                sink.write(view[:aligned])
+            pending = available - aligned
+            if pending:
+                view[:pending] = view[aligned:available]
+
+        if not total:
+            raise AudioStreamError('Missing audio data')
+        if pending:
+            raise AudioStreamError('Invalid PCM audio data length')
+
+        sink.close()
+    except Exception:
+        sink.abort()
+        raise
+
+    return total
@@ -0,0 +1,274 @@
+"""
+Omi App Webhook Server - Durable Event Log
+
+Append-only, segment-rotated binary log of every accepted webhook. Appends
+are buffered and written by a single flusher thread that fsyncs once per
+batch (group commit): callers waiting for durability share one fsync
+instead of paying for their own.
+
+Record layout (little endian):
+    u32 payload length | u32 crc32 of payload | payload (JSON)
+
+Each process writes its own segments, named `<start time ns>-<pid>.log`,
+so gunicorn workers never interleave writes. `iter_events` merges all
+segments back into timestamp order. A failed write is cut off the segment
+and the next batch starts a new one, because readers stop at the first
+torn record.
+"""
+import bisect
+import heapq
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from .json_codec import dumps, loads
+
+logger = logging.getLogger('services.event_log')
+
+# Directory holding log segments (empty disables the event log)
+EVENT_LOG_DIR = os.getenv('EVENT_LOG_DIR', os.path.join(os.getenv('DATA_DIR', 'data'), 'events'))
+
+# Segment size after which a new segment is started
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv('EVENT_LOG_SEGMENT_BYTES', 64 * 1024 * 1024))
+
+# Longest time an appended event waits before its batch is flushed
+EVENT_LOG_FLUSH_MS = float(os.getenv('EVENT_LOG_FLUSH_MS', 5))
+
+# Number of pending events that triggers an immediate flush
+EVENT_LOG_BATCH_SIZE = int(os.getenv('EVENT_LOG_BATCH_SIZE', 256))
+
+# Wait for the fsync before acknowledging a webhook
+EVENT_LOG_SYNC = os.getenv('EVENT_LOG_SYNC', 'true').lower() in ('true', '1', 'yes')
+
+RECORD_HEADER = struct.Struct('<II')
+SEGMENT_SUFFIX = '.log'
+
+
+class EventLogError(Exception):
+    """Raised when an event could not be made durable"""
+
+
+class EventLog:
+    """Group-committing append-only log writer"""
+
+    def __init__(self, directory=EVENT_LOG_DIR, segment_bytes=EVENT_LOG_SEGMENT_BYTES,
+                 flush_ms=EVENT_LOG_FLUSH_MS, batch_size=EVENT_LOG_BATCH_SIZE):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_ms / 1000.0
+        self.batch_size = batch_size
+        self._condition = threading.Condition()
+        self._pending = []
+        self._appended = 0   # Sequence number of the last appended record
+        self._flushed = 0    # Sequence number of the last record written or failed
+        self._failures = []  # Sorted, disjoint [first, last, error] of failed records
+        self._file = None
+        self._segment_size = 0
+        self._thread = None
+        self._pid = None
+        self._closing = False
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def append(self, kind, uid, data=None, wait=EVENT_LOG_SYNC, **fields):
+        """Append an event and return its sequence number
+
+        With `wait`, blocks until the batch containing the event has been
+        fsynced and raises EventLogError if that failed.
+        """
+        if not self.enabled:
+            return 0
+
+        event = {'ts': time.time(), 'kind': kind, 'uid': uid}
+        event.update(fields)
+        if data is not None:
+            event['data'] = data
+        payload = dumps(event)
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._condition:
+            self._ensure_started()
+            if self._closing:
+                raise EventLogError('Event log is closed')
+            self._pending.append(record)
+            self._appended += 1
+            sequence = self._appended
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+            else:
+                self._condition.notify()
+
+            if wait:
+                self._wait_committed(sequence)
+        return sequence
+
+    def wait(self, sequence, first=None):
+        """Block until events up to sequence have been fsynced
+
+        Lets callers appending many events with wait=False pay for a single
+        fsync wait; raises EventLogError if the write of any event from
+        `first` (default: sequence itself) to sequence failed.
+        """
+        if not self.enabled or not sequence:
+            return
+        with self._condition:
+            self._wait_committed(sequence, first or sequence)
+
+    def _wait_committed(self, sequence, first=None):
+        # Called with the condition held
+        while self._flushed < sequence:
+            self._condition.wait()
+        error = self._failure(first or sequence, sequence)
+        if error is not None:
+            raise EventLogError(f'Event log write failed: {error}')
+
+    def _failure(self, first, last):
+        """Error of a failed write overlapping sequences first..last, if any"""
+        index = bisect.bisect_left(self._failures, [first])
+        # The range starting before first may still reach into it
+        for failed_first, failed_last, error in self._failures[max(0, index - 1):index + 1]:
+            if failed_first <= last and failed_last >= first:
+                return error
+        return None
+
+    def _record_failure(self, first, last, error):
+        # Batches are flushed in order, so a failure extends or follows the last range
+        if self._failures and self._failures[-1][1] == first - 1:
+            self._failures[-1][1:] = [last, error]
+        else:
+            self._failures.append([first, last, error])
+
+    def _ensure_started(self):
+        # The flusher thread is started lazily so each forked worker gets its own
+        if self._pid == os.getpid():
+            return
+        self._pending = []
+        self._file = None
+        self._failures = []
+        self._appended = self._flushed = 0
+        self._thread = threading.Thread(target=self._flush_loop, name='event-log-flusher', daemon=True)
+        self._pid = os.getpid()
+        self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closing:
+                    self._condition.wait()
+                if not self._pending and self._closing:
+                    return
+
+                # Give concurrent requests a moment to join this batch
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_size and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = self._pending
+                self._pending = []
+                sequence = self._appended
+
+            try:
+                self._write_batch(batch)
+                error = None
+            except OSError as e:
+                logger.error(f"Event log write failed: {e}")
+                error = e
+
+            with self._condition:
+                if error is not None:
+                    self._record_failure(sequence - len(batch) + 1, sequence, error)
+                self._flushed = sequence
+                self._condition.notify_all()
+
+    def _write_batch(self, batch):
+        if self._file is None or self._segment_size >= self.segment_bytes:
+            self._open_segment()
+        data = b''.join(batch)
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError:
+            self._abandon_segment()
+            raise
+        self._segment_size += len(data)
+
+    def _abandon_segment(self):
+        # Cut the failed batch off (best effort) so no record its caller was
+        # told failed can be replayed, and continue in a new segment
+        try:
+            self._file.truncate(self._segment_size)
+        except OSError:
+            pass
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        name = f'{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}'
+        self._file = open(os.path.join(self.directory, name), 'ab')
+        self._segment_size = 0
+
+    def close(self):
+        """Flush pending events and stop the flusher thread"""
+        if self._pid != os.getpid():
+            return
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_segment(path):
+    """Yield the events stored in one segment, stopping at a torn or corrupt tail"""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                logger.warning(f"Truncated record header at end of {path}")
+                return
+            length, checksum = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                logger.warning(f"Corrupt or truncated record at end of {path}")
+                return
+            yield loads(payload)
+
+
+def list_segments(directory=EVENT_LOG_DIR):
+    """Return the segment paths in a log directory, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def iter_events(directory=EVENT_LOG_DIR):
+    """Yield all logged events across segments and processes in timestamp order"""
+    segments = [read_segment(path) for path in list_segments(directory)]
+    return heapq.merge(*segments, key=lambda event: event['ts'])
+
+
+# Shared log written by the webhook server
+event_log = EventLog()
@@ -0,0 +1,327 @@
+"""
+Omi App Webhook Server - Event Forwarder
+
+Relays accepted webhooks to downstream URLs (FORWARD_URLS) off the request
+path. Events are handed to a dispatcher thread which sends them to every
+URL on a thread pool sharing one pooled `requests.Session`, so connections
+stay open between deliveries. Small transcript events are batched for up
+to FORWARD_BATCH_MS; memory and audio events are sent right away.
+
+Every delivery is a POST of `{"events": [...]}`. Failed deliveries are
+retried with exponential backoff and jitter; deliveries that still fail,
+or are rejected outright, are appended to a dead-letter file as JSON lines.
+Retries wait on a timer heap rather than in the pool's threads, and the
+deliveries in flight (queued, sending or waiting to retry) are bounded, so
+a slow downstream backs up into the event queue instead of into memory.
+"""
+import heapq
+import itertools
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .json_codec import dumps
+
+logger = logging.getLogger('services.forwarder')
+
+# Comma-separated downstream URLs (empty disables forwarding)
+FORWARD_URLS = [url.strip() for url in os.getenv('FORWARD_URLS', '').split(',') if url.strip()]
+
+# Concurrent deliveries (also the connection pool size per URL)
+FORWARD_WORKERS = int(os.getenv('FORWARD_WORKERS', 4))
+
+# Seconds to wait for a downstream response
+FORWARD_TIMEOUT = float(os.getenv('FORWARD_TIMEOUT', 10))
+
+# Retries after the first attempt, and the backoff between them
+FORWARD_MAX_RETRIES = int(os.getenv('FORWARD_MAX_RETRIES', 5))
+FORWARD_BACKOFF_BASE = float(os.getenv('FORWARD_BACKOFF_BASE', 0.5))
+FORWARD_BACKOFF_MAX = float(os.getenv('FORWARD_BACKOFF_MAX', 30))
+
+# Transcript events sent together at most, and the longest they wait for a batch
+FORWARD_BATCH_SIZE = int(os.getenv('FORWARD_BATCH_SIZE', 100))
+FORWARD_BATCH_MS = float(os.getenv('FORWARD_BATCH_MS', 200))
+
+# Events waiting for the dispatcher before new ones are dead-lettered
+FORWARD_QUEUE_SIZE = int(os.getenv('FORWARD_QUEUE_SIZE', 10000))
+
+# Deliveries queued, sending or waiting to retry before the dispatcher waits
+FORWARD_MAX_IN_FLIGHT = int(os.getenv('FORWARD_MAX_IN_FLIGHT', 256))
+
+# Seconds shutdown waits for pending deliveries
+FORWARD_DRAIN_TIMEOUT = float(os.getenv('FORWARD_DRAIN_TIMEOUT', 30))
+
+# JSON lines file receiving deliveries that could not be made
+FORWARD_DEAD_LETTER = os.getenv(
+    'FORWARD_DEAD_LETTER', os.path.join(os.getenv('DATA_DIR', 'data'), 'forward-dead-letter.jsonl')
+)
+
+# Event kinds batched before sending
+BATCHED_KINDS = ('transcript',)
+
+# Status codes worth retrying; other 4xx responses are dead-lettered immediately
+RETRY_STATUS_CODES = (408, 425, 429)
+
+_STOP = object()
+
+
+class Forwarder:
+    """Fan-out of accepted events to downstream URLs"""
+
+    def __init__(self, urls=FORWARD_URLS, workers=FORWARD_WORKERS, timeout=FORWARD_TIMEOUT,
+                 max_retries=FORWARD_MAX_RETRIES, backoff_base=FORWARD_BACKOFF_BASE,
+                 backoff_max=FORWARD_BACKOFF_MAX, batch_size=FORWARD_BATCH_SIZE,
+                 batch_ms=FORWARD_BATCH_MS, queue_size=FORWARD_QUEUE_SIZE,
+                 max_in_flight=FORWARD_MAX_IN_FLIGHT, dead_letter_path=FORWARD_DEAD_LETTER):
+        self.urls = list(urls)
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.batch_size = batch_size
+        self.batch_interval = batch_ms / 1000.0
+        self.queue_size = queue_size
+        self.max_in_flight = max(1, max_in_flight)
+        self.dead_letter_path = dead_letter_path
+        self._queue = None
+        self._session = None
+        self._executor = None
+        self._thread = None
+        self._retry_thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._dead_letter_lock = threading.Lock()
+        self._slots = None
+        self._pending = 0
+        self._pending_lock = threading.Condition()
+        self._retries = []  # Heap of (due, sequence, url, body, events, attempt)
+        self._retry_sequence = itertools.count()
+        self._retry_condition = threading.Condition()
+        self._stopping = False
+        self._stats_lock = threading.Lock()
+        self.delivered = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    @property
+    def enabled(self):
+        return bool(self.urls)
+
+    @property
+    def depth(self):
+        """Events waiting for the dispatcher"""
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def _ensure_started(self):
+        # Session, pool and dispatcher are created per process (after fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=len(self.urls), pool_maxsize=self.workers, max_retries=0
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Content-Type'] = 'application/json'
+            self._session = session
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='forwarder'
+            )
+            self._slots = threading.BoundedSemaphore(self.max_in_flight)
+            self._pending = 0
+            self._retries = []
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._dispatch_loop, name='forwarder-dispatch', daemon=True
+            )
+            self._retry_thread = threading.Thread(
+                target=self._retry_loop, name='forwarder-retry', daemon=True
+            )
+            self._thread.start()
+            self._retry_thread.start()
+            self._pid = os.getpid()
+
+    def forward(self, kind, uid, **fields):
+        """Queue an accepted event for delivery; never blocks the request"""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        event = {'kind': kind, 'uid': uid, 'ts': time.time(), **fields}
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            for url in self.urls:
+                self._dead_letter(url, [event], 'forward queue full', 0)
+
+    def _dispatch_loop(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                event = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                event = None
+
+            if event is _STOP:
+                if batch:
+                    self._send(batch)
+                return
+            if event is not None and event['kind'] not in BATCHED_KINDS:
+                self._send([event])
+            elif event is not None:
+                batch.append(event)
+                if deadline is None:
+                    deadline = time.monotonic() + self.batch_interval
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._send(batch)
+                batch = []
+                deadline = None
+
+    def _send(self, events):
+        body = dumps({'events': events})
+        for url in self.urls:
+            if not self._acquire_slot():
+                self._dead_letter(url, events, 'shutdown before delivery', 0)
+                continue
+            with self._pending_lock:
+                self._pending += 1
+            try:
+                self._executor.submit(self._attempt, url, body, events, 0)
+            except RuntimeError:
+                # The pool was shut down while this delivery waited for a slot
+                self._dead_letter(url, events, 'shutdown before delivery', 0)
+                self._finish()
+
+    def _acquire_slot(self):
+        """Wait while too many deliveries are in flight (events queue up meanwhile)"""
+        while not self._stopping:
+            if self._slots.acquire(timeout=0.1):
+                return True
+        return self._slots.acquire(blocking=False)
+
+    def _attempt(self, url, body, events, attempt):
+        """Make one delivery attempt, scheduling a retry or finishing the delivery"""
+        try:
+            error, retry = self._post(url, body)
+            if error is None:
+                self._count('delivered')
+            elif retry and attempt < self.max_retries and self._schedule_retry(url, body, events, attempt + 1):
+                self._count('retried')
+                return
+            else:
+                self._dead_letter(url, events, error, attempt + 1)
+        except Exception as e:
+            logger.exception(f"Forwarding to {url} failed")
+            self._dead_letter(url, events, repr(e), attempt + 1)
+        self._finish()
+
+    def _post(self, url, body):
+        """POST body to url and return (error, retryable), error None on success"""
+        try:
+            response = self._session.post(url, data=body, timeout=self.timeout)
+        except requests.RequestException as e:
+            return str(e), True
+        if response.status_code < 300:
+            return None, False
+        retry = response.status_code >= 500 or response.status_code in RETRY_STATUS_CODES
+        return f"HTTP {response.status_code}", retry
+
+    def _schedule_retry(self, url, body, events, attempt):
+        """Queue a retry on the timer heap; False once shutdown has given up on retries"""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        due = time.monotonic() + delay * random.uniform(0.5, 1.0)
+        with self._retry_condition:
+            if self._stopping:
+                return False
+            heapq.heappush(self._retries, (due, next(self._retry_sequence), url, body, events, attempt))
+            self._retry_condition.notify()
+        return True
+
+    def _retry_loop(self):
+        while True:
+            with self._retry_condition:
+                while not self._stopping and (
+                        not self._retries or self._retries[0][0] > time.monotonic()):
+                    timeout = self._retries[0][0] - time.monotonic() if self._retries else None
+                    self._retry_condition.wait(timeout)
+                if self._stopping:
+                    return
+                _, _, url, body, events, attempt = heapq.heappop(self._retries)
+            try:
+                self._executor.submit(self._attempt, url, body, events, attempt)
+            except RuntimeError:
+                self._dead_letter(url, events, 'shutdown before retry', attempt)
+                self._finish()
+
+    def _finish(self):
+        # A delivery was made or dead-lettered: free its in-flight slot
+        self._slots.release()
+        with self._pending_lock:
+            self._pending -= 1
+            self._pending_lock.notify_all()
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _dead_letter(self, url, events, error, attempts):
+        self._count('dead_lettered')
+        logger.warning(f"Dead-lettering {len(events)} events for {url}: {error}")
+        line = dumps({
+            'url': url, 'error': error, 'attempts': attempts, 'ts': time.time(), 'events': events
+        }) + b'\n'
+        try:
+            with self._dead_letter_lock:
+                directory = os.path.dirname(self.dead_letter_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.dead_letter_path, 'ab') as f:
+                    f.write(line)
+        except OSError as e:
+            logger.error(f"Failed to write dead letter: {e}")
+
+    def drain(self, timeout=FORWARD_DRAIN_TIMEOUT):
+        """Send batched events, wait for pending deliveries and stop"""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        with self._pending_lock:
+            while self._pending and time.monotonic() < deadline:
+                self._pending_lock.wait(max(0.0, deadline - time.monotonic()))
+
+        # Deliveries still waiting to retry are dead-lettered rather than lost
+        with self._retry_condition:
+            self._stopping = True
+            retries, self._retries = self._retries, []
+            self._retry_condition.notify_all()
+        self._retry_thread.join(timeout)
+        for _, _, url, _, events, attempt in retries:
+            self._dead_letter(url, events, 'shutdown before retry', attempt)
+            self._finish()
+
+        with self._pending_lock:
+            if self._pending:
+                logger.warning(f"Forwarder stopped with {self._pending} deliveries pending")
+        self._executor.shutdown(wait=False)
+        self._session.close()
+        self._pid = None
+
+
+# Shared forwarder fed by the webhook route
+forwarder = Forwarder()
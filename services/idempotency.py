@@ -0,0 +1,185 @@
+"""
+Omi App Webhook Server - Idempotency Cache
+
+Remembers the response sent for each accepted memory event so that
+redeliveries (Omi app retries, `memory_backward_synced` resending memories
+we already have) get the original response back without being validated
+or processed again.
+
+Entries live in a bounded in-memory LRU with a TTL. When a spill directory
+is configured, entries evicted from memory before they expire are written
+to a per-process dbm file, which is rotated in two generations so the
+spill stays bounded as well.
+"""
+import dbm
+import glob
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .json_codec import dumps
+
+logger = logging.getLogger('services.idempotency')
+
+# Enable duplicate delivery detection
+IDEMPOTENCY_ENABLED = os.getenv('IDEMPOTENCY_ENABLED', 'true').lower() in ('true', '1', 'yes')
+
+# Responses kept in memory
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 100000))
+
+# Seconds a response is remembered
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 24 * 60 * 60))
+
+# Directory for entries evicted from memory (empty disables spilling)
+IDEMPOTENCY_SPILL_DIR = os.getenv('IDEMPOTENCY_SPILL_DIR', '')
+
+# Spilled entries per generation file before rotating
+IDEMPOTENCY_SPILL_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_SPILL_MAX_ENTRIES', 1000000))
+
+# Events that carry a whole memory and are deduplicated on its id; other events on a payload hash
+MEMORY_ID_EVENTS = ('memory_created', 'memory_backward_synced')
+
+# Spilled value header: expiry timestamp and status code
+SPILL_HEADER = struct.Struct('<dH')
+
+
+def idempotency_key(uid, event_type, data):
+    """Key identifying a delivery: the memory id for whole-memory events, else a payload hash"""
+    if event_type in MEMORY_ID_EVENTS:
+        memory = data.get('memory', data)
+        memory_id = memory.get('id') if isinstance(memory, dict) else None
+        if isinstance(memory_id, str) and memory_id:
+            return f'{uid}\x00{event_type}\x00{memory_id}'
+    digest = hashlib.blake2b(dumps(data), digest_size=16).hexdigest()
+    return f'{uid}\x00{event_type}\x00#{digest}'
+
+
+class IdempotencyCache:
+    """Bounded LRU/TTL map of delivery key -> (status code, response body)"""
+
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES, ttl=IDEMPOTENCY_TTL,
+                 spill_dir=IDEMPOTENCY_SPILL_DIR, spill_max_entries=IDEMPOTENCY_SPILL_MAX_ENTRIES,
+                 enabled=IDEMPOTENCY_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_max_entries = spill_max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._spill = None
+        self._previous_spill = None
+        self._spill_count = 0
+        self._generation = 0
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the stored (status code, body) for key, or None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None and self.spill_dir:
+                entry = self._read_spill(key, now)
+                if entry is not None:
+                    self._store(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key, status_code, body):
+        """Remember the response sent for key"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._store(key, (time.time() + self.ttl, status_code, body))
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            if self.spill_dir and evicted[0] > time.time():
+                self._write_spill(evicted_key, evicted)
+
+    def _open_spill(self):
+        # Spill files are per process: dbm files cannot be shared between writers
+        if self._pid == os.getpid():
+            return
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._pid = os.getpid()
+        self._generation = 0
+        self._spill_count = 0
+        self._previous_spill = None
+        self._spill = dbm.open(self._spill_path(self._generation), 'n')
+
+    def _spill_path(self, generation):
+        return os.path.join(self.spill_dir, f'idempotency-{self._pid}-{generation}')
+
+    def _write_spill(self, key, entry):
+        try:
+            self._open_spill()
+            if self._spill_count >= self.spill_max_entries:
+                self._rotate_spill()
+            expires, status_code, body = entry
+            self._spill[key.encode('utf-8')] = SPILL_HEADER.pack(expires, status_code) + body
+            self._spill_count += 1
+        except OSError as e:
+            logger.warning(f"Failed to spill idempotency entry: {e}")
+
+    def _rotate_spill(self):
+        # Drop the oldest generation; the current one becomes the previous one
+        if self._previous_spill is not None:
+            self._previous_spill.close()
+            for path in glob.glob(self._spill_path(self._generation - 1) + '*'):
+                os.remove(path)
+        self._previous_spill = self._spill
+        self._generation += 1
+        self._spill = dbm.open(self._spill_path(self._generation), 'n')
+        self._spill_count = 0
+
+    def _read_spill(self, key, now):
+        if self._pid != os.getpid():
+            return None
+        raw_key = key.encode('utf-8')
+        for spill in (self._spill, self._previous_spill):
+            if spill is None:
+                continue
+            value = spill.get(raw_key)
+            if value is None:
+                continue
+            expires, status_code = SPILL_HEADER.unpack_from(value)
+            if expires <= now:
+                return None
+            return expires, status_code, value[SPILL_HEADER.size:]
+        return None
+
+    def close(self):
+        """Close and remove this process's spill files"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            for spill in (self._spill, self._previous_spill):
+                if spill is not None:
+                    spill.close()
+            for path in glob.glob(os.path.join(self.spill_dir, f'idempotency-{self._pid}-*')):
+                os.remove(path)
+            self._spill = self._previous_spill = None
+            self._pid = None
+
+
+# Shared cache used by the memory event handlers
+idempotency_cache = IdempotencyCache()
@@ -0,0 +1,167 @@
+"""
+Omi App Webhook Server - Background Job Queue
+
+In-process work queue so webhook handlers can validate a request, enqueue
+the processing and acknowledge the Omi app right away. Jobs run on a pool
+of worker threads; when the queue is full `submit` raises QueueFull, which
+the server turns into a 503 so the Omi app retries later.
+
+Handlers whose request has side effects before the job is submitted (audio
+is buffered while the body streams) `reserve` room first, so a full queue is
+reported before anything is stored and a retried request is not stored twice.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger('services.job_queue')
+
+# Worker threads processing jobs (0 runs jobs inline on the request thread)
+JOB_QUEUE_WORKERS = int(os.getenv('JOB_QUEUE_WORKERS', 4))
+
+# Jobs waiting to run before new submissions are rejected
+JOB_QUEUE_MAX_SIZE = int(os.getenv('JOB_QUEUE_MAX_SIZE', 1000))
+
+# Seconds shutdown waits for queued jobs to finish
+JOB_QUEUE_DRAIN_TIMEOUT = float(os.getenv('JOB_QUEUE_DRAIN_TIMEOUT', 30))
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted to a full (or stopped) queue"""
+
+
+class JobReservation:
+    """Room for one job in a JobQueue, claimed by `JobQueue.reserve`
+
+    Call `submit` to use it or `cancel` to give it back; `cancel` after
+    `submit` does nothing, so it can go in a `finally`.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.done = False
+
+    def submit(self, fn, *args, **kwargs):
+        self.done = True
+        self.jobs._put(fn, args, kwargs)
+
+    def cancel(self):
+        if not self.done:
+            self.done = True
+            self.jobs._release()
+
+
+class JobQueue:
+    """Bounded FIFO of jobs executed by a pool of worker threads"""
+
+    def __init__(self, workers=JOB_QUEUE_WORKERS, max_size=JOB_QUEUE_MAX_SIZE):
+        self.workers = workers
+        self.max_size = max_size
+        # The queue itself is unbounded so shutdown sentinels never block;
+        # queued and reserved jobs are bounded by the capacity semaphore
+        self._queue = queue.Queue()
+        self._capacity = threading.BoundedSemaphore(max_size)
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._accepting = True
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def depth(self):
+        """Number of jobs waiting to run"""
+        return self._queue.qsize()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) for a worker thread"""
+        self.reserve().submit(fn, *args, **kwargs)
+
+    def reserve(self):
+        """Claim room for one job, raising QueueFull when there is none"""
+        if self.workers:
+            if not self._accepting:
+                self.rejected += 1
+                raise QueueFull('Job queue is shutting down')
+            self._ensure_started()
+            if not self._capacity.acquire(blocking=False):
+                self.rejected += 1
+                raise QueueFull('Job queue is full')
+        return JobReservation(self)
+
+    def _put(self, fn, args, kwargs):
+        if self.workers:
+            self._queue.put((fn, args, kwargs))
+        else:
+            self._run(fn, args, kwargs)
+
+    def _release(self):
+        if self.workers:
+            self._capacity.release()
+
+    def _ensure_started(self):
+        # Threads are started lazily so each forked worker process gets its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._capacity = threading.BoundedSemaphore(self.max_size)
+            self._threads = [
+                threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self._capacity.release()
+                fn, args, kwargs = job
+                self._run(fn, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Job {getattr(fn, '__name__', fn)} failed")
+
+    def drain(self, timeout=JOB_QUEUE_DRAIN_TIMEOUT):
+        """Stop accepting jobs and wait for queued ones to finish"""
+        self._accepting = False
+        if self._pid != os.getpid():
+            return
+
+        logger.info(f"Draining job queue ({self.depth} pending)")
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            # Queued after the pending jobs, so workers finish those first
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        remaining = self.depth
+        if remaining:
+            logger.warning(f"Job queue drain timed out with {remaining} jobs pending")
+        self._threads = []
+        self._pid = None
+
+
+# Shared queue used by the event handlers
+job_queue = JobQueue()
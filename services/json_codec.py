@@ -0,0 +1,111 @@
+"""
+Omi App Webhook Server - JSON Codec
+
+Single place where the server serializes and parses JSON. Uses orjson or
+ujson when installed and falls back to the standard library. Plugged into
+Flask as its JSON provider, so `jsonify` and `request.get_json` use it too,
+and offers precomputed bodies for constant responses.
+"""
+import json
+import logging
+import os
+
+from flask import current_app
+from flask.json.provider import JSONProvider
+
+logger = logging.getLogger('services.json_codec')
+
+# Preferred backend: auto, orjson, ujson or json
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto').lower()
+
+
+def _load_orjson():
+    import orjson
+
+    options = orjson.OPT_NON_STR_KEYS
+    indent_options = options | orjson.OPT_INDENT_2
+
+    def dumps(obj, indent=False):
+        try:
+            return orjson.dumps(obj, option=indent_options if indent else options)
+        except TypeError:
+            # orjson rejects a few values the stdlib accepts (e.g. integers over 64 bits)
+            return _stdlib_dumps(obj, indent)
+
+    return 'orjson', dumps, orjson.loads
+
+
+def _load_ujson():
+    import ujson
+
+    def dumps(obj, indent=False):
+        return ujson.dumps(obj, ensure_ascii=False, indent=2 if indent else 0).encode('utf-8')
+
+    return 'ujson', dumps, ujson.loads
+
+
+def _stdlib_dumps(obj, indent=False):
+    if indent:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _load_stdlib():
+    return 'json', _stdlib_dumps, json.loads
+
+
+BACKENDS = {
+    'orjson': _load_orjson,
+    'ujson': _load_ujson,
+    'json': _load_stdlib
+}
+
+
+def _select_backend(preference):
+    if preference != 'auto':
+        if preference not in BACKENDS:
+            raise ValueError(f"Invalid JSON_BACKEND. Must be one of: auto, {', '.join(BACKENDS)}")
+        return BACKENDS[preference]()
+    for loader in BACKENDS.values():
+        try:
+            return loader()
+        except ImportError:
+            continue
+
+
+BACKEND, _dumps, _loads = _select_backend(JSON_BACKEND)
+logger.debug(f"Using {BACKEND} for JSON")
+
+
+def dumps(obj, indent=False):
+    """Serialize obj to UTF-8 JSON bytes"""
+    return _dumps(obj, indent)
+
+
+def dumps_str(obj, indent=False):
+    """Serialize obj to a JSON string (e.g. for log messages)"""
+    return _dumps(obj, indent).decode('utf-8')
+
+
+def loads(data):
+    """Parse JSON from bytes or str"""
+    return _loads(data)
+
+
+def json_response(body):
+    """Build a JSON response from a precomputed body (see `dumps`)"""
+    return current_app.response_class(body, mimetype='application/json')
+
+
+class JsonCodecProvider(JSONProvider):
+    """Flask JSON provider backed by this codec"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_str(obj, bool(kwargs.get('indent')))
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype='application/json')
@@ -0,0 +1,228 @@
+"""
+Omi App Webhook Server - Logging Pipeline
+
+Non-blocking logging: handlers on the request path only put records on a
+queue. A listener thread formats them as compact JSON lines (or the
+classic text format) and writes them to the console and to a size-rotated
+`webhook.log`, so slow terminals or disks never add to webhook latency.
+
+Structured fields are passed with `extra=`, e.g.
+    logger.info('Memory created', extra={'uid': uid, 'data': memory})
+and are only serialized on the listener thread, and only for records that
+pass the level check. High-volume audio logs can be sampled.
+"""
+import fcntl
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from .json_codec import dumps_str
+
+# Minimum level logged
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Output format: json (one object per line) or text
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+
+# Log file (empty disables file logging), rotated at LOG_FILE_MAX_BYTES
+LOG_FILE = os.getenv('LOG_FILE', 'webhook.log')
+LOG_FILE_MAX_BYTES = int(os.getenv('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024))
+LOG_FILE_BACKUPS = int(os.getenv('LOG_FILE_BACKUPS', 5))
+
+# Fraction of audio chunk logs kept (warnings and errors are always kept)
+LOG_AUDIO_SAMPLE_RATE = float(os.getenv('LOG_AUDIO_SAMPLE_RATE', 0.01))
+
+# Records waiting for the listener before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# Loggers whose INFO/DEBUG records are sampled
+SAMPLED_LOGGERS = ('events.audio_events',)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime', 'taskName'
+}
+
+
+def record_fields(record):
+    """Structured fields passed through `extra`"""
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return dumps_str(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, with structured fields appended as compact JSON"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        return f'{line} | {dumps_str(fields)}' if fields else line
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a random fraction of INFO and DEBUG records"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that several worker processes can share
+
+    Rollover happens under an flock and only if the file is still over the
+    limit, and a process whose file was rotated by another one reopens it.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, delay=True, **kwargs)
+        self.lock_path = self.baseFilename + '.lock'
+
+    def shouldRollover(self, record):
+        if self.stream is not None:
+            try:
+                if os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino:
+                    self.stream.close()
+                    self.stream = None
+            except FileNotFoundError:
+                self.stream.close()
+                self.stream = None
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) >= self.maxBytes:
+                    super().doRollover()
+                elif self.stream is not None:
+                    self.stream.close()
+                    self.stream = None
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        if self.stream is None:
+            self.stream = self._open()
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread
+
+    The stock handler formats the message on the calling thread; this one
+    enqueues the record untouched and starts the listener per process, so
+    forked workers each get their own.
+    """
+
+    def __init__(self, pipeline):
+        super().__init__(None)
+        self.pipeline = pipeline
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.pipeline.ensure_started().put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+
+class LogPipeline:
+    """Queue, listener thread and output handlers"""
+
+    def __init__(self, level=LOG_LEVEL, log_format=LOG_FORMAT, log_file=LOG_FILE,
+                 max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS, queue_size=LOG_QUEUE_SIZE):
+        self.level = getattr(logging, level)
+        self.formatter = JsonFormatter() if log_format == 'json' else TextFormatter()
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.handler = DeferredQueueHandler(self)
+        self.dropped = 0
+        self._queue = None
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _output_handlers(self):
+        console = logging.StreamHandler(sys.stderr)
+        handlers = [console]
+        if self.log_file:
+            directory = os.path.dirname(self.log_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handlers.append(SharedRotatingFileHandler(
+                self.log_file, maxBytes=self.max_bytes, backupCount=self.backups, encoding='utf-8'
+            ))
+        for handler in handlers:
+            handler.setFormatter(self.formatter)
+        return handlers
+
+    def ensure_started(self):
+        """Return this process's queue, starting its listener thread if needed"""
+        if self._pid == os.getpid():
+            return self._queue
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._listener = QueueListener(self._queue, *self._output_handlers())
+                self._listener.start()
+                self._pid = os.getpid()
+        return self._queue
+
+    def stop(self):
+        """Write out queued records and stop the listener"""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._pid = None
+            if self.dropped:
+                sys.stderr.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {self.dropped} log records dropped\n")
+
+
+def configure_logging(pipeline=None, audio_sample_rate=LOG_AUDIO_SAMPLE_RATE):
+    """Route all logging through the pipeline; returns the pipeline"""
+    pipeline = pipeline or LogPipeline()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(pipeline.handler)
+    root.setLevel(pipeline.level)
+
+    if audio_sample_rate < 1:
+        for name in SAMPLED_LOGGERS:
+            logging.getLogger(name).addFilter(SamplingFilter(audio_sample_rate))
+    return pipeline
+
+
+# Shared pipeline configured by the server
+log_pipeline = LogPipeline()
@@ -0,0 +1,287 @@
+"""
+Omi App Webhook Server - Metrics
+
+Counters, gauges and fixed-bucket histograms rendered in the Prometheus
+text format at /metrics.
+
+Metrics are recorded in plain per-process dicts. Each process periodically
+writes a snapshot of its metrics to METRICS_DIR (one file per pid) and
+/metrics sums its own live values with the snapshots of the other
+workers. Counters and histograms of exited workers keep counting towards
+the totals; their gauges are dropped.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from .json_codec import dumps, loads
+
+logger = logging.getLogger('services.metrics')
+
+# Enable the /metrics endpoint and request instrumentation
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('true', '1', 'yes')
+
+# Directory for per-worker snapshots (empty reports only the serving process)
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(os.getenv('DATA_DIR', 'data'), 'metrics'))
+
+# Seconds between snapshots
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Metric:
+    """Base class: a named family of series keyed by label values"""
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value, *labels):
+        """Mirror a total kept by another component"""
+        with self.lock:
+            self.values[labels] = value
+
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Observation counts in fixed cumulative buckets, plus their sum"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # Per-bucket counts (last one is +Inf) followed by the sum
+                series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(labels), list(series)] for labels, series in self.values.items()]
+
+
+class Registry:
+    """Metric definitions of this process, with snapshot and aggregation across workers"""
+
+    def __init__(self, directory=METRICS_DIR, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self.metrics = {}
+        self.collectors = []
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, fn):
+        """Register fn to refresh mirrored values before each snapshot"""
+        self.collectors.append(fn)
+        return fn
+
+    def snapshot(self):
+        """Current values of every metric in this process"""
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.error(f"Metrics collector {collect.__name__} failed: {e}")
+        return {
+            'pid': os.getpid(),
+            'metrics': {name: metric.snapshot() for name, metric in self.metrics.items()}
+        }
+
+    def ensure_started(self):
+        """Start the snapshot writer thread in this process"""
+        if self._pid == os.getpid() or not self.directory:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._flush_loop, name='metrics-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.write_snapshot()
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def write_snapshot(self):
+        """Atomically replace this process's snapshot file"""
+        if not self.directory:
+            return
+        path = self._snapshot_path(os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(dumps(self.snapshot()))
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot: {e}")
+
+    def clear_snapshots(self):
+        """Remove snapshots left by a previous run"""
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json*')):
+                os.remove(path)
+
+    def _worker_snapshots(self):
+        if not self.directory:
+            return []
+        own = self._snapshot_path(os.getpid())
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    snapshot = loads(f.read())
+            except (OSError, ValueError):
+                continue
+            snapshot['alive'] = _pid_alive(snapshot['pid'])
+            snapshots.append(snapshot)
+        return snapshots
+
+    def aggregate(self):
+        """Sum this process's live values with the other workers' snapshots"""
+        live = self.snapshot()
+        live['alive'] = True
+        totals = {name: {} for name in self.metrics}
+        for snapshot in [live] + self._worker_snapshots():
+            for name, series in snapshot['metrics'].items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.type == 'gauge' and not snapshot['alive']):
+                    continue
+                merged = totals[name]
+                for labels, value in series:
+                    labels = tuple(labels)
+                    if metric.type == 'histogram':
+                        current = merged.get(labels)
+                        merged[labels] = value if current is None else [a + b for a, b in zip(current, value)]
+                    else:
+                        merged[labels] = merged.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        """Prometheus text exposition of the aggregated metrics"""
+        lines = []
+        for name, series in self.aggregate().items():
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for labels, value in sorted(series.items()):
+                pairs = [f'{label}="{_escape(str(v))}"' for label, v in zip(metric.labels, labels)]
+                if metric.type != 'histogram':
+                    lines.append(f'{name}{_labels(pairs)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    bucket_pairs = pairs + [f'le="{bound}"']
+                    lines.append(f'{name}_bucket{_labels(bucket_pairs)} {cumulative}')
+                lines.append(f'{name}_sum{_labels(pairs)} {value[-1]}')
+                lines.append(f'{name}_count{_labels(pairs)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Shared registry and the server's metrics
+registry = Registry()
+
+webhook_requests = registry.counter(
+    'webhook_requests_total', 'Webhook requests by route and status code', ('route', 'status')
+)
+webhook_latency = registry.histogram(
+    'webhook_request_duration_seconds', 'Webhook handling time by route', ('route',)
+)
+audio_bytes = registry.counter(
+    'audio_bytes_received_total', 'Accepted audio bytes by codec and sample rate', ('codec', 'sample_rate')
+)
+validation_failures = registry.counter(
+    'webhook_validation_failures_total', 'Rejected webhooks by reason', ('reason',)
+)
+queue_depth = registry.gauge(
+    'queue_depth', 'Items waiting in background queues', ('queue',)
+)
+background_jobs = registry.counter(
+    'background_jobs_total', 'Background jobs by outcome', ('outcome',)
+)
+opus_packets = registry.counter(
+    'opus_packets_total', 'Opus packets by decode outcome', ('outcome',)
+)
+opus_seconds = registry.counter(
+    'opus_seconds_total', 'Opus decode and wait (queue + decode) time', ('phase',)
+)
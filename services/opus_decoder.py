@@ -0,0 +1,348 @@
+"""
+Omi App Webhook Server - Opus Decoding
+
+Optional stage that turns Opus packets into 16-bit PCM so they can join
+the PCM pipeline (resampling, analysis, buffering). Decoding runs in a pool
+of worker processes, keeping it off the request workers' GIL. Every user is
+pinned to one worker so their decoder state survives between requests.
+By default each request body is one Opus packet. Clients that send
+several packets per upload opt in with AUDIO_OPUS_FRAMING=length and
+prefix every packet with its length; packets are then split from the body
+while it streams and decoded in batches, so a large upload never reaches
+a worker as one blob.
+
+Decoders:
+    libopus: the system libopus loaded through ctypes
+    stub: emits one frame of silence per packet (for tests without libopus)
+"""
+import ctypes
+import ctypes.util
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from .audio_stream import AudioSink, AudioStreamError, OpusFrameReader
+
+logger = logging.getLogger('services.opus_decoder')
+
+# Decode Opus audio into PCM (otherwise Opus bytes are stored as received)
+AUDIO_OPUS_DECODE = os.getenv('AUDIO_OPUS_DECODE', 'false').lower() in ('true', '1', 'yes')
+
+# Decoder implementation: libopus or stub
+AUDIO_OPUS_DECODER = os.getenv('AUDIO_OPUS_DECODER', 'libopus').lower()
+
+# Opus body layout: packet (the body is one packet) or length (2-byte length-prefixed packets)
+AUDIO_OPUS_FRAMING = os.getenv('AUDIO_OPUS_FRAMING', 'packet').lower()
+
+# Number of decode worker processes
+AUDIO_OPUS_WORKERS = int(os.getenv('AUDIO_OPUS_WORKERS', 2))
+
+# Packets waiting for or in decoding before requests are rejected with 503
+AUDIO_OPUS_MAX_PENDING = int(os.getenv('AUDIO_OPUS_MAX_PENDING', 64))
+
+# Seconds a request waits for a batch of packets to be decoded
+AUDIO_OPUS_TIMEOUT = float(os.getenv('AUDIO_OPUS_TIMEOUT', 5))
+
+# Packets sent to a decode worker at a time (50 packets of 20 ms is 1 s)
+AUDIO_OPUS_BATCH_PACKETS = int(os.getenv('AUDIO_OPUS_BATCH_PACKETS', 50))
+
+# Decoders kept per worker process (least recently used is dropped)
+AUDIO_MAX_SESSIONS = int(os.getenv('AUDIO_MAX_SESSIONS', 1000))
+
+# Longest Opus packet duration is 120 ms
+MAX_PACKET_SECONDS = 0.12
+
+# Unframed bodies longer than any Opus packet can be are rejected
+MAX_PACKET_BYTES = 0xFFFF
+
+OPUS_FRAMINGS = ('packet', 'length')
+
+
+class OpusError(Exception):
+    """Raised when a packet cannot be decoded"""
+
+
+class DecoderUnavailable(OpusError):
+    """Raised when the configured decoder cannot be loaded"""
+
+
+class DecoderBusy(Exception):
+    """Raised when the decode pool has no capacity left"""
+
+
+class LibOpusDecoder:
+    """Mono Opus decoder backed by the system libopus via ctypes"""
+
+    _lib = None
+
+    @classmethod
+    def load_library(cls):
+        if cls._lib is None:
+            path = ctypes.util.find_library('opus')
+            if not path:
+                raise DecoderUnavailable('libopus not found')
+            lib = ctypes.CDLL(path)
+            lib.opus_decoder_create.restype = ctypes.c_void_p
+            lib.opus_decoder_create.argtypes = [ctypes.c_int32, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+            lib.opus_decode.restype = ctypes.c_int
+            lib.opus_decode.argtypes = [
+                ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int32,
+                ctypes.POINTER(ctypes.c_int16), ctypes.c_int, ctypes.c_int
+            ]
+            lib.opus_decoder_destroy.restype = None
+            lib.opus_decoder_destroy.argtypes = [ctypes.c_void_p]
+            cls._lib = lib
+        return cls._lib
+
+    def __init__(self, sample_rate):
+        self.lib = self.load_library()
+        self.sample_rate = sample_rate
+        self.max_frame = int(sample_rate * MAX_PACKET_SECONDS)
+        self._pcm = (ctypes.c_int16 * self.max_frame)()
+        error = ctypes.c_int()
+        self._decoder = self.lib.opus_decoder_create(sample_rate, 1, ctypes.byref(error))
+        if error.value != 0 or not self._decoder:
+            raise OpusError(f'opus_decoder_create failed with error {error.value}')
+
+    def decode(self, packet):
+        samples = self.lib.opus_decode(self._decoder, packet, len(packet), self._pcm, self.max_frame, 0)
+        if samples < 0:
+            raise OpusError(f'opus_decode failed with error {samples}')
+        return ctypes.string_at(self._pcm, samples * 2)
+
+    def __del__(self):
+        if getattr(self, '_decoder', None):
+            self.lib.opus_decoder_destroy(self._decoder)
+            self._decoder = None
+
+
+class StubOpusDecoder:
+    """Stand-in decoder producing one 20 ms frame of silence per packet"""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self._frame = bytes(sample_rate // 50 * 2)
+
+    def decode(self, packet):
+        if not packet:
+            raise OpusError('Empty Opus packet')
+        return self._frame
+
+
+DECODERS = {
+    'libopus': LibOpusDecoder,
+    'stub': StubOpusDecoder
+}
+
+# Per-process decoder state, only populated inside worker processes
+_worker_decoders = OrderedDict()
+
+
+def _decode_packets(decoder_name, uid, sample_rate, packets):
+    """Decode a batch of packets with the user's decoder (runs in a worker process)"""
+    start = time.perf_counter()
+    key = (uid, sample_rate)
+    decoder = _worker_decoders.get(key)
+    if decoder is None:
+        decoder = _worker_decoders[key] = DECODERS[decoder_name](sample_rate)
+        while len(_worker_decoders) > AUDIO_MAX_SESSIONS:
+            _worker_decoders.popitem(last=False)
+    _worker_decoders.move_to_end(key)
+    pcm = b''.join([decoder.decode(packet) for packet in packets])
+    return pcm, time.perf_counter() - start
+
+
+class DecodeMetrics:
+    """Decode counts and latency totals"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.decoded = 0
+        self.failed = 0
+        self.rejected = 0
+        self.decode_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, packets, decode_seconds, wait_seconds):
+        with self.lock:
+            self.decoded += packets
+            self.decode_seconds += decode_seconds
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def to_dict(self):
+        with self.lock:
+            decoded = self.decoded or 1
+            return {
+                'decoded': self.decoded,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'avg_decode_ms': self.decode_seconds / decoded * 1000,
+                'avg_wait_ms': self.wait_seconds / decoded * 1000,
+                'max_wait_ms': self.max_wait_seconds * 1000
+            }
+
+
+class OpusDecodePool:
+    """Pool of single-process executors with per-user affinity and bounded backlog"""
+
+    def __init__(self, decoder_name=AUDIO_OPUS_DECODER, workers=AUDIO_OPUS_WORKERS,
+                 max_pending=AUDIO_OPUS_MAX_PENDING, timeout=AUDIO_OPUS_TIMEOUT, framing=AUDIO_OPUS_FRAMING):
+        if decoder_name not in DECODERS:
+            raise ValueError(f"Invalid AUDIO_OPUS_DECODER. Must be one of: {', '.join(DECODERS)}")
+        if framing not in OPUS_FRAMINGS:
+            raise ValueError(f"Invalid AUDIO_OPUS_FRAMING. Must be one of: {', '.join(OPUS_FRAMINGS)}")
+        self.decoder_name = decoder_name
+        self.framing = framing
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.metrics = DecodeMetrics()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executors = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor_for(self, uid):
+        # Executors are created lazily per process so forked workers get their own
+        with self._lock:
+            if self._executors is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('spawn')
+                self._executors = [
+                    ProcessPoolExecutor(max_workers=1, mp_context=context)
+                    for _ in range(self.workers)
+                ]
+                self._pid = os.getpid()
+            return self._executors[zlib.crc32(uid.encode()) % self.workers]
+
+    def reserve(self):
+        """Claim a backlog slot, raising DecoderBusy when the pool is saturated"""
+        if not self._slots.acquire(blocking=False):
+            with self.metrics.lock:
+                self.metrics.rejected += 1
+            raise DecoderBusy()
+
+    def release(self, future=None):
+        """Free a slot, once `future` has finished if one is given
+
+        A request that timed out still has its batch queued on the worker;
+        its slot stays taken until the worker is done with it.
+        """
+        if future is None:
+            self._slots.release()
+        else:
+            future.add_done_callback(lambda _: self._slots.release())
+
+    def submit(self, uid, sample_rate, packets):
+        """Queue packets on the user's worker; the caller must hold a reserved slot"""
+        return self._executor_for(uid).submit(
+            _decode_packets, self.decoder_name, uid, sample_rate, packets
+        )
+
+    def result(self, future, packets):
+        """PCM of a submitted batch of `packets` packets, waiting at most `timeout`"""
+        start = time.perf_counter()
+        try:
+            pcm, decode_seconds = future.result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # A worker died; start fresh executors on the next request
+            with self._lock:
+                self._executors = None
+            with self.metrics.lock:
+                self.metrics.failed += 1
+            raise DecoderUnavailable('Decode worker terminated')
+        except (OpusError, FutureTimeoutError):
+            with self.metrics.lock:
+                self.metrics.failed += 1
+            raise
+        self.metrics.record(packets, decode_seconds, time.perf_counter() - start)
+        return pcm
+
+    def shutdown(self):
+        with self._lock:
+            if self._executors and self._pid == os.getpid():
+                for executor in self._executors:
+                    executor.shutdown(wait=True, cancel_futures=True)
+            self._executors = None
+
+
+class OpusDecodeStage(AudioSink):
+    """Pipeline stage decoding a request's Opus packets into PCM for `sink`
+
+    With the pool's `length` framing, packets are split from the body as it
+    streams and sent to the decode worker every `batch_packets` packets;
+    otherwise the body is collected and decoded as one packet. A backlog
+    slot is reserved up front, so saturation is reported before the body is
+    read, and is held until the request's last batch has left the worker.
+    """
+
+    def __init__(self, sink, pool, uid, sample_rate, batch_packets=AUDIO_OPUS_BATCH_PACKETS):
+        pool.reserve()
+        self.sink = sink
+        self.pool = pool
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.batch_packets = max(1, batch_packets)
+        self._frames = OpusFrameReader() if pool.framing == 'length' else None
+        self._body = bytearray()
+        self._packets = []
+        self._future = None
+        self._reserved = True
+
+    def write(self, chunk):
+        if self._frames is None:
+            self._body += chunk
+            if len(self._body) > MAX_PACKET_BYTES:
+                raise AudioStreamError('Invalid Opus audio data')
+            return
+        self._packets.extend(self._frames.feed(chunk))
+        if len(self._packets) >= self.batch_packets:
+            self._decode()
+
+    def close(self):
+        try:
+            if self._frames is None:
+                self._packets = [bytes(self._body)]
+            elif not self._frames.complete:
+                raise AudioStreamError('Invalid Opus audio data')
+            self._decode()
+        finally:
+            self._release()
+        self.sink.close()
+
+    def abort(self):
+        self._release()
+        self.sink.abort()
+
+    def _decode(self):
+        packets, self._packets = self._packets, []
+        if not packets:
+            return
+        self._future = self.pool.submit(self.uid, self.sample_rate, packets)
+        try:
+            pcm = self.pool.result(self._future, len(packets))
+        except DecoderUnavailable as e:
+            logger.error(f"Opus decoder unavailable: {e}")
+            raise AudioStreamError('Audio decoder unavailable', 503)
+        except OpusError:
+            raise AudioStreamError('Invalid Opus audio data')
+        except FutureTimeoutError:
+            raise AudioStreamError('Audio decoder busy', 503)
+        if pcm:
+            self.sink.write(memoryview(pcm))
+
+    def _release(self):
+        if self._reserved:
+            self._reserved = False
+            self.pool.release(self._future)
+
+
+# Shared decode pool (worker processes start on first use)
+opus_decoder_pool = OpusDecodePool()
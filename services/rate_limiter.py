@@ -0,0 +1,121 @@
+"""
+Omi App Webhook Server - Rate Limiting
+
+Token buckets per uid and event class (audio, memory, transcript), checked
+before a webhook body is read. A bucket holds up to RATE_LIMIT tokens and
+refills at RATE_LIMIT / RATE_LIMIT_WINDOW tokens per second.
+
+Buckets live in a fixed-size open-addressing hash table in an anonymous
+shared mmap guarded by a multiprocessing lock. Both are created at import
+time, so with gunicorn's `preload_app` every forked worker shares the same
+table and limits hold across workers. A lookup probes at most
+RATE_LIMIT_PROBES slots; slots whose bucket has been idle long enough to
+refill completely count as free, so idle buckets are evicted simply by
+being overwritten.
+"""
+import hashlib
+import logging
+import math
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+
+logger = logging.getLogger('services.rate_limiter')
+
+# Requests allowed per window per uid and event class (0 disables rate limiting)
+RATE_LIMIT = int(os.getenv('RATE_LIMIT', 0))
+
+# Window size in seconds
+RATE_LIMIT_WINDOW = float(os.getenv('RATE_LIMIT_WINDOW', 60))
+
+# Per-class overrides (audio chunks usually arrive far more often than memories)
+RATE_LIMITS = {
+    'audio': int(os.getenv('RATE_LIMIT_AUDIO', RATE_LIMIT)),
+    'memory': int(os.getenv('RATE_LIMIT_MEMORY', RATE_LIMIT)),
+    'transcript': int(os.getenv('RATE_LIMIT_TRANSCRIPT', RATE_LIMIT))
+}
+
+# Bucket slots in the shared table, and slots probed per lookup
+RATE_LIMIT_TABLE_SIZE = int(os.getenv('RATE_LIMIT_TABLE_SIZE', 65536))
+RATE_LIMIT_PROBES = int(os.getenv('RATE_LIMIT_PROBES', 8))
+
+# Slot layout: key hash (0 = empty), tokens, last update (monotonic seconds)
+SLOT = struct.Struct('<Qdd')
+
+
+def bucket_key(event_class, uid):
+    """64-bit hash identifying a bucket; 0 is reserved for empty slots"""
+    digest = hashlib.blake2b(f'{event_class}\x00{uid}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class RateLimiter:
+    """Token buckets in a hash table shared by forked worker processes"""
+
+    def __init__(self, limits=RATE_LIMITS, window=RATE_LIMIT_WINDOW,
+                 table_size=RATE_LIMIT_TABLE_SIZE, probes=RATE_LIMIT_PROBES):
+        self.limits = {event_class: limit for event_class, limit in limits.items() if limit > 0}
+        self.window = window
+        self.table_size = table_size
+        self.probes = min(probes, table_size)
+        self._table = mmap.mmap(-1, table_size * SLOT.size) if self.limits else None
+        self._lock = multiprocessing.Lock()
+
+    def acquire(self, event_class, uid):
+        """Take a token; return 0 if allowed, else the seconds until a token is available"""
+        capacity = self.limits.get(event_class)
+        if not capacity:
+            return 0
+        rate = capacity / self.window
+        key = bucket_key(event_class, uid)
+        start = key % self.table_size
+        table = self._table
+
+        with self._lock:
+            now = time.monotonic()
+            found = free = oldest = None
+            oldest_last = math.inf
+            for i in range(self.probes):
+                offset = ((start + i) % self.table_size) * SLOT.size
+                slot_key, tokens, last = SLOT.unpack_from(table, offset)
+                if slot_key == key:
+                    found = offset
+                    break
+                # Empty slots and buckets idle for a whole window (i.e. full again) are reusable
+                if free is None and (slot_key == 0 or now - last >= self.window):
+                    free = offset
+                if last < oldest_last:
+                    oldest, oldest_last = offset, last
+
+            if found is not None:
+                offset = found
+                tokens = min(capacity, tokens + (now - last) * rate)
+            else:
+                # New bucket; when every probed slot is busy, evict the least recently used one
+                offset = free if free is not None else oldest
+                tokens = capacity
+
+            if tokens >= 1:
+                SLOT.pack_into(table, offset, key, tokens - 1, now)
+                return 0
+            SLOT.pack_into(table, offset, key, tokens, now)
+            return (1 - tokens) / rate
+
+
+def event_class(request):
+    """Classify a webhook from its headers and query string, before the body is read
+
+    Uses the media type without parameters, as the webhook route does when
+    dispatching raw bodies, so `application/octet-stream; x=1` is audio too.
+    """
+    if request.mimetype == 'application/octet-stream':
+        return 'audio'
+    if 'session_id' in request.args:
+        return 'transcript'
+    return 'memory'
+
+
+# Shared limiter used by the webhook route (created before gunicorn forks workers)
+rate_limiter = RateLimiter()
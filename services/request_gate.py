@@ -0,0 +1,148 @@
+"""
+Omi App Webhook Server - Request Gate
+
+WSGI middleware that rejects bad requests to the webhook, search and
+audio routes using only the query string and headers, before Flask builds a
+request object and before any body bytes are read:
+
+- missing or wrong `key` (401), checked in constant time against every
+  configured secret so secrets can be rotated without downtime
+- missing `uid` (400)
+- webhook bodies with an unsupported content type (415) or a
+  Content-Length over the limit for their type (413)
+- audio uploads declaring an empty body (400)
+"""
+import hashlib
+import hmac
+import logging
+import os
+from urllib.parse import parse_qs
+
+from .audio_stream import AUDIO_MAX_BODY_BYTES
+from .json_codec import dumps
+from .metrics import METRICS_ENABLED, registry, validation_failures, webhook_requests
+
+logger = logging.getLogger('services.request_gate')
+
+# Largest JSON webhook body accepted
+WEBHOOK_MAX_JSON_BYTES = int(os.getenv('WEBHOOK_MAX_JSON_BYTES', 16 * 1024 * 1024))
+
+# Largest NDJSON body accepted by the batch endpoint
+WEBHOOK_MAX_BATCH_BYTES = int(os.getenv('WEBHOOK_MAX_BATCH_BYTES', 256 * 1024 * 1024))
+
+# Paths that require key and uid
+PROTECTED_PATHS = ('/webhook', '/search', '/audio')
+
+# Largest body per accepted webhook content type
+BODY_LIMITS = {
+    'application/octet-stream': AUDIO_MAX_BODY_BYTES,
+    'application/json': WEBHOOK_MAX_JSON_BYTES
+}
+
+# Paths accepting other content types than BODY_LIMITS
+PATH_BODY_LIMITS = {
+    '/webhook/batch': {'application/x-ndjson': WEBHOOK_MAX_BATCH_BYTES}
+}
+
+
+def load_secrets():
+    """Accepted webhook secrets: WEBHOOK_SECRET plus the comma-separated WEBHOOK_SECRETS"""
+    secrets = [os.getenv('WEBHOOK_SECRET', '')]
+    secrets.extend(os.getenv('WEBHOOK_SECRETS', '').split(','))
+    return [secret.strip() for secret in secrets if secret and secret.strip()]
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode('utf-8')).digest()
+
+
+class KeyVerifier:
+    """Constant-time check of a key against every accepted secret"""
+
+    def __init__(self, secrets):
+        # Compare fixed-length digests so neither a secret's length nor which one matched leaks
+        self.digests = [_digest(secret) for secret in secrets]
+
+    def __call__(self, key):
+        if not key or not self.digests:
+            return False
+        digest = _digest(key)
+        matched = False
+        for secret_digest in self.digests:
+            matched |= hmac.compare_digest(digest, secret_digest)
+        return matched
+
+
+class RequestGate:
+    """WSGI middleware rejecting unauthenticated or malformed webhook requests up front"""
+
+    def __init__(self, wsgi_app, secrets=None, body_limits=BODY_LIMITS, path_body_limits=PATH_BODY_LIMITS):
+        self.wsgi_app = wsgi_app
+        self.verify = KeyVerifier(load_secrets() if secrets is None else secrets)
+        self.body_limits = body_limits
+        self.path_body_limits = path_body_limits
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(PROTECTED_PATHS):
+            return self.wsgi_app(environ, start_response)
+
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        if not self.verify(query.get('key', [''])[0]):
+            return self.reject(environ, start_response, 401, 'Invalid webhook key')
+        if not query.get('uid', [''])[0]:
+            return self.reject(environ, start_response, 400, 'Missing uid parameter')
+
+        if environ.get('REQUEST_METHOD') == 'POST':
+            media_type = environ.get('CONTENT_TYPE', '').split(';', 1)[0].strip().lower()
+            limit = self.path_body_limits.get(path, self.body_limits).get(media_type)
+            if limit is None:
+                if not media_type:
+                    # Same answer the route gives a body it cannot parse as JSON
+                    return self.reject(environ, start_response, 400, {'error': 'Invalid JSON data'})
+                return self.reject(environ, start_response, 415, {'error': 'Unsupported content type'})
+            raw_length = environ.get('CONTENT_LENGTH')
+            try:
+                # Chunked uploads have no Content-Length and are checked while streaming
+                content_length = int(raw_length) if raw_length else None
+            except ValueError:
+                return self.reject(environ, start_response, 400, {'error': 'Invalid Content-Length'})
+            if content_length == 0 and media_type == 'application/octet-stream':
+                return self.reject(environ, start_response, 400, {'error': 'Missing audio data'})
+            if content_length is not None and content_length > limit:
+                message = 'Audio data too large' if media_type == 'application/octet-stream' \
+                    else 'Request body too large'
+                return self.reject(environ, start_response, 413, {'error': message})
+
+        return self.wsgi_app(environ, start_response)
+
+    def reject(self, environ, start_response, status_code, body):
+        """Answer without touching the request body"""
+        if isinstance(body, dict):
+            reason = body['error']
+            payload = dumps(body)
+            content_type = 'application/json'
+        else:
+            reason = body
+            payload = body.encode('utf-8')
+            content_type = 'text/html; charset=utf-8'
+
+        if METRICS_ENABLED and environ.get('PATH_INFO', '').startswith('/webhook'):
+            registry.ensure_started()
+            webhook_requests.inc('rejected', status_code)
+            if status_code != 401:
+                validation_failures.inc(reason)
+
+        start_response(f'{status_code} {STATUS_REASONS[status_code]}', [
+            ('Content-Type', content_type),
+            ('Content-Length', str(len(payload)))
+        ])
+        return [payload]
+
+
+STATUS_REASONS = {
+    400: 'BAD REQUEST',
+    401: 'UNAUTHORIZED',
+    413: 'REQUEST ENTITY TOO LARGE',
+    415: 'UNSUPPORTED MEDIA TYPE'
+}
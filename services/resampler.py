@@ -0,0 +1,171 @@
+"""
+Omi App Webhook Server - PCM Resampling
+
+NumPy-vectorized polyphase resampler used to normalize 8 kHz and 16 kHz
+device streams to a single sample rate. Each user's stream keeps its filter
+history between chunks, so chunk boundaries produce no artifacts.
+
+Requests resample with a private copy of the user's resampler and hand its
+state back once the upload was accepted, so concurrent requests never
+share mutable filter state and rejected audio never enters the history.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from math import gcd
+
+import numpy as np
+
+from .audio_stream import AudioSink
+
+logger = logging.getLogger('services.resampler')
+
+# Rate all PCM streams are converted to (0 keeps the device rate)
+AUDIO_TARGET_SAMPLE_RATE = int(os.getenv('AUDIO_TARGET_SAMPLE_RATE', 16000))
+
+# Filter taps per polyphase branch; more taps give a sharper anti-aliasing filter
+RESAMPLER_TAPS_PER_PHASE = int(os.getenv('RESAMPLER_TAPS_PER_PHASE', 16))
+
+# Upper bound on users with resampler state (least recently used is evicted)
+AUDIO_MAX_SESSIONS = int(os.getenv('AUDIO_MAX_SESSIONS', 1000))
+
+# Kaiser window shape parameter for the filter design
+KAISER_BETA = 8.0
+
+
+def design_polyphase_filter(up, down, taps_per_phase=RESAMPLER_TAPS_PER_PHASE):
+    """Design a windowed-sinc low-pass filter split into `up` polyphase branches
+
+    Returns an array of shape (up, taps_per_phase) where row p holds the
+    taps applied to the input for output phase p.
+    """
+    length = taps_per_phase * up
+    cutoff = 1.0 / max(up, down)
+    n = np.arange(length) - (length - 1) / 2.0
+    taps = cutoff * np.sinc(cutoff * n) * np.kaiser(length, KAISER_BETA)
+    # Unity DC gain per output sample
+    taps *= up / taps.sum()
+    return taps.reshape(taps_per_phase, up).T.astype(np.float32).copy()
+
+
+class PolyphaseResampler:
+    """Streaming rational-ratio resampler for int16 PCM"""
+
+    def __init__(self, from_rate, to_rate, taps_per_phase=RESAMPLER_TAPS_PER_PHASE):
+        divisor = gcd(from_rate, to_rate)
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self.up = to_rate // divisor
+        self.down = from_rate // divisor
+        self.taps_per_phase = taps_per_phase
+        self.filters = design_polyphase_filter(self.up, self.down, taps_per_phase)
+        self.reset()
+
+    def reset(self):
+        """Forget all stream state, as if no samples had been processed"""
+        self._history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        self._input_count = 0
+        self._output_count = 0
+
+    def copy(self):
+        """A resampler continuing from this one's state (the filters are shared)"""
+        clone = object.__new__(PolyphaseResampler)
+        clone.__dict__.update(self.__dict__)
+        clone._history = self._history.copy()
+        return clone
+
+    def process(self, samples):
+        """Resample a chunk of int16 samples, carrying filter state to the next chunk"""
+        samples = np.asarray(samples)
+        history_length = self.taps_per_phase - 1
+        signal = np.concatenate((self._history, samples.astype(np.float32)))
+        input_total = self._input_count + len(samples)
+
+        # Every output whose newest input sample has arrived can be produced
+        output_end = (input_total * self.up + self.down - 1) // self.down
+        positions = np.arange(self._output_count, output_end, dtype=np.int64) * self.down
+        phases = positions % self.up
+        newest = positions // self.up - (self._input_count - history_length)
+
+        output = np.zeros(len(positions), dtype=np.float32)
+        phase_taps = self.filters[phases]
+        for tap in range(self.taps_per_phase):
+            output += phase_taps[:, tap] * signal[newest - tap]
+
+        self._history = signal[len(signal) - history_length:].copy()
+        self._input_count = input_total
+        self._output_count = output_end
+
+        np.rint(output, out=output)
+        return np.clip(output, -32768, 32767).astype('<i2')
+
+
+class ResamplerStore:
+    """Per-user resamplers, recreated when a stream's source rate changes"""
+
+    def __init__(self, to_rate=AUDIO_TARGET_SAMPLE_RATE, max_sessions=AUDIO_MAX_SESSIONS):
+        self.to_rate = to_rate
+        self.max_sessions = max_sessions
+        self._resamplers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid, from_rate):
+        """A private copy of the user's resampler, to be handed back with `commit`"""
+        with self._lock:
+            resampler = self._resamplers.get(uid)
+            if resampler is None or resampler.from_rate != from_rate:
+                resampler = self._resamplers[uid] = PolyphaseResampler(from_rate, self.to_rate)
+                self._evict()
+            self._resamplers.move_to_end(uid)
+            return resampler.copy()
+
+    def commit(self, uid, resampler):
+        """Make a request's resampler state the user's, for the next upload to continue"""
+        with self._lock:
+            self._resamplers[uid] = resampler
+            self._resamplers.move_to_end(uid)
+            self._evict()
+
+    def _evict(self):
+        # Called with the lock held
+        while len(self._resamplers) > self.max_sessions:
+            self._resamplers.popitem(last=False)
+
+
+class ResampleStage(AudioSink):
+    """Pipeline stage converting PCM chunks to the target sample rate
+
+    The user's filter state is only updated once the rest of the pipeline
+    accepted the upload.
+    """
+
+    def __init__(self, sink, store, uid, from_rate):
+        self.sink = sink
+        self.store = store
+        self.uid = uid
+        self.resampler = store.get(uid, from_rate)
+
+    def write(self, chunk):
+        output = self.resampler.process(np.frombuffer(chunk, dtype='<i2'))
+        if len(output):
+            self.sink.write(memoryview(output).cast('B'))
+
+    def close(self):
+        self.sink.close()
+        self.store.commit(self.uid, self.resampler)
+
+    def abort(self):
+        # The user's stored state never saw the rejected audio
+        self.sink.abort()
+
+
+def output_sample_rate(sample_rate, codec):
+    """Return the rate PCM from a `sample_rate` stream is stored at"""
+    if codec == 'pcm' and AUDIO_TARGET_SAMPLE_RATE:
+        return AUDIO_TARGET_SAMPLE_RATE
+    return sample_rate
+
+
+# Shared per-user resampler state
+resamplers = ResamplerStore()
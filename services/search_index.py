@@ -0,0 +1,186 @@
+"""
+Omi App Webhook Server - Full-Text Search
+
+Incremental full-text index over accepted memories (transcript, title,
+overview and segment text) and streamed transcript segments.
+
+Documents live in a regular table and are indexed by an external-content
+SQLite FTS5 table kept in sync by triggers, in its own database file so
+index maintenance never contends with the main store. Each document also
+carries an `owner` token derived from its uid; queries AND the search
+terms with that token, so FTS5 intersects posting lists instead of
+filtering another user's matches after the fact.
+"""
+import hashlib
+import logging
+import os
+import re
+
+from .storage import SQLiteDatabase
+
+logger = logging.getLogger('services.search_index')
+
+# Enable the search index
+SEARCH_ENABLED = os.getenv('SEARCH_ENABLED', 'true').lower() in ('true', '1', 'yes')
+
+# SQLite database file holding the index
+SEARCH_INDEX_PATH = os.getenv(
+    'SEARCH_INDEX_PATH', os.path.join(os.getenv('DATA_DIR', 'data'), 'search.db')
+)
+
+# Results per page by default and at most
+SEARCH_DEFAULT_LIMIT = int(os.getenv('SEARCH_DEFAULT_LIMIT', 20))
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 100))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    field TEXT NOT NULL,
+    position REAL NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (owner, kind, ref, field, position)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+    owner, text, content='documents', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='3'
+);
+CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+    INSERT INTO search (rowid, owner, text) VALUES (new.id, new.owner, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+    INSERT INTO search (search, rowid, owner, text) VALUES ('delete', old.id, old.owner, old.text);
+END;
+"""
+
+DELETE_MEMORY = "DELETE FROM documents WHERE owner = ? AND kind = 'memory' AND ref = ?"
+UPSERT_DOCUMENT = """
+INSERT OR REPLACE INTO documents (owner, kind, ref, field, position, text) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+DELETE_SEGMENT = """
+DELETE FROM documents WHERE owner = ? AND kind = 'transcript' AND ref = ? AND field = 'segment' AND position = ?
+"""
+
+STATEMENT_ORDER = [DELETE_MEMORY, DELETE_SEGMENT, UPSERT_DOCUMENT]
+
+SEARCH_QUERY = """
+SELECT d.kind, d.ref, d.field, d.position,
+       snippet(search, 1, '[', ']', '...', 16)
+FROM search JOIN documents d ON d.id = search.rowid
+WHERE search MATCH ?
+ORDER BY rank
+LIMIT ? OFFSET ?
+"""
+
+# Words (optionally ending in * for prefix search) taken from the user's query
+TERM_PATTERN = re.compile(r'\w+\*?')
+
+# Shorter prefixes match too many terms to rank quickly and are searched as whole words
+MIN_PREFIX_LENGTH = 3
+
+
+def owner_token(uid):
+    """Single-token, tokenizer-safe stand-in for a uid"""
+    return 'u' + hashlib.blake2b(uid.encode('utf-8'), digest_size=12).hexdigest()
+
+
+def build_match(uid, query):
+    """Build an FTS5 MATCH expression scoped to a uid, or None if the query has no terms"""
+    terms = TERM_PATTERN.findall(query)
+    if not terms:
+        return None
+    phrases = ' '.join(
+        f'"{term[:-1]}"*' if term.endswith('*') and len(term) > MIN_PREFIX_LENGTH
+        else f'"{term.rstrip("*")}"'
+        for term in terms
+    )
+    return f'owner:{owner_token(uid)} AND text:({phrases})'
+
+
+def memory_documents(uid, memory):
+    """Return (statement, rows) pairs that (re)index one validated memory"""
+    owner = owner_token(uid)
+    memory_id = memory['id']
+    structured = memory.get('structured') or {}
+    rows = [
+        (owner, 'memory', memory_id, field, 0, value)
+        for field, value in (
+            ('title', structured.get('title')),
+            ('overview', structured.get('overview')),
+            ('transcript', memory.get('transcript'))
+        )
+        if value
+    ]
+    rows.extend(
+        (owner, 'memory', memory_id, 'segment', position, segment['text'])
+        for position, segment in enumerate(memory.get('transcript_segments') or [])
+        if segment.get('text')
+    )
+    return [(DELETE_MEMORY, [(owner, memory_id)]), (UPSERT_DOCUMENT, rows)]
+
+
+def segment_documents(uid, session_id, segments, removed=()):
+    """Return (statement, rows) pairs that (re)index streamed transcript segments
+
+    Rows in `removed`, and segments whose text is now empty, are dropped
+    from the index.
+    """
+    owner = owner_token(uid)
+    return [
+        (DELETE_SEGMENT, [(owner, session_id, start) for start in removed] + [
+            (owner, session_id, segment['start']) for segment in segments if not segment['text']
+        ]),
+        (UPSERT_DOCUMENT, [
+            (owner, 'transcript', session_id, 'segment', segment['start'], segment['text'])
+            for segment in segments
+            if segment['text']
+        ])
+    ]
+
+
+class SearchIndex(SQLiteDatabase):
+    """FTS5 search index, updated through the batching writer thread"""
+
+    schema = SCHEMA
+    statement_order = STATEMENT_ORDER
+    barrier_statements = (DELETE_SEGMENT,)
+    writer_name = 'search-writer'
+
+    def __init__(self, path=SEARCH_INDEX_PATH, enabled=SEARCH_ENABLED, **kwargs):
+        super().__init__(path, **kwargs)
+        self.enabled = enabled
+
+    def index_memory(self, uid, memory):
+        if self.enabled:
+            self.write(memory_documents(uid, memory), key=(uid, memory['id']))
+
+    def index_segments(self, uid, session_id, segments, removed=()):
+        if self.enabled and (segments or removed):
+            self.write(segment_documents(uid, session_id, segments, removed))
+
+    def search(self, uid, query, limit=SEARCH_DEFAULT_LIMIT, offset=0):
+        """Return up to `limit` of the uid's best matches for `query`, best first"""
+        match = build_match(uid, query)
+        if not self.enabled or match is None:
+            return []
+        with self.reader() as conn:
+            rows = conn.execute(SEARCH_QUERY, (match, limit, offset)).fetchall()
+
+        results = []
+        for kind, ref, field, position, snippet in rows:
+            if kind == 'memory':
+                result = {'type': 'memory', 'memory_id': ref, 'field': field}
+                if field == 'segment':
+                    result['segment'] = int(position)
+            else:
+                result = {'type': 'transcript', 'session_id': ref, 'start': position}
+            result['snippet'] = snippet
+            results.append(result)
+        return results
+
+
+# Shared index used by the event handlers and the search endpoint
+search_index = SearchIndex()
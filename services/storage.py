@@ -0,0 +1,449 @@
+"""
+Omi App Webhook Server - Persistent Storage
+
+Pluggable persistence for memories (with their structured fields, action
+items and transcript segments) and for streamed transcript segments.
+
+The SQLite backend runs in WAL mode. All writes go through a single writer
+thread that groups queued operations into one transaction and inserts rows
+with `executemany` over cached prepared statements, so a burst of events
+(e.g. `memory_backward_synced` backfills) costs one commit per batch
+instead of one per memory. Reads use a small pool of separate connections,
+which WAL lets run concurrently with the writer.
+"""
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .json_codec import dumps, loads
+
+logger = logging.getLogger('services.storage')
+
+# Storage backend: sqlite or none
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite').lower()
+
+# SQLite database file
+STORAGE_PATH = os.getenv('STORAGE_PATH', os.path.join(os.getenv('DATA_DIR', 'data'), 'omi.db'))
+
+# Operations committed together at most
+STORAGE_BATCH_SIZE = int(os.getenv('STORAGE_BATCH_SIZE', 500))
+
+# Longest time a queued write waits for its batch to fill up
+STORAGE_FLUSH_MS = float(os.getenv('STORAGE_FLUSH_MS', 50))
+
+# Queued writes before writers block (back-pressure to the job queue)
+STORAGE_QUEUE_SIZE = int(os.getenv('STORAGE_QUEUE_SIZE', 10000))
+
+# Read-only connections kept in the pool
+STORAGE_READERS = int(os.getenv('STORAGE_READERS', 4))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    uid TEXT NOT NULL,
+    id TEXT NOT NULL,
+    created_at TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    transcript TEXT,
+    title TEXT,
+    overview TEXT,
+    emoji TEXT,
+    category TEXT,
+    events TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (uid, id)
+);
+CREATE TABLE IF NOT EXISTS action_items (
+    uid TEXT NOT NULL,
+    memory_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    description TEXT,
+    completed INTEGER,
+    PRIMARY KEY (uid, memory_id, position)
+);
+CREATE TABLE IF NOT EXISTS memory_segments (
+    uid TEXT NOT NULL,
+    memory_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    text TEXT,
+    speaker TEXT,
+    speaker_id INTEGER,
+    is_user INTEGER,
+    start REAL,
+    end REAL,
+    PRIMARY KEY (uid, memory_id, position)
+);
+CREATE TABLE IF NOT EXISTS transcript_segments (
+    uid TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL,
+    text TEXT,
+    speaker TEXT,
+    speaker_id INTEGER,
+    is_user INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (uid, session_id, start)
+);
+"""
+
+UPSERT_MEMORY = """
+INSERT INTO memories (uid, id, created_at, started_at, finished_at, transcript,
+                      title, overview, emoji, category, events, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (uid, id) DO UPDATE SET
+    created_at = excluded.created_at, started_at = excluded.started_at,
+    finished_at = excluded.finished_at, transcript = excluded.transcript,
+    title = excluded.title, overview = excluded.overview, emoji = excluded.emoji,
+    category = excluded.category, events = excluded.events, updated_at = excluded.updated_at
+"""
+DELETE_ACTION_ITEMS = "DELETE FROM action_items WHERE uid = ? AND memory_id = ?"
+INSERT_ACTION_ITEM = "INSERT INTO action_items VALUES (?, ?, ?, ?, ?)"
+DELETE_MEMORY_SEGMENTS = "DELETE FROM memory_segments WHERE uid = ? AND memory_id = ?"
+INSERT_MEMORY_SEGMENT = "INSERT INTO memory_segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+UPSERT_TRANSCRIPT_SEGMENT = """
+INSERT OR REPLACE INTO transcript_segments
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+DELETE_TRANSCRIPT_SEGMENT = "DELETE FROM transcript_segments WHERE uid = ? AND session_id = ? AND start = ?"
+
+# Order statements run within a batch: deletes of replaced children before inserts
+STATEMENT_ORDER = [
+    UPSERT_MEMORY, DELETE_ACTION_ITEMS, DELETE_MEMORY_SEGMENTS,
+    INSERT_ACTION_ITEM, INSERT_MEMORY_SEGMENT, DELETE_TRANSCRIPT_SEGMENT, UPSERT_TRANSCRIPT_SEGMENT
+]
+
+_STOP = object()
+
+
+class MemoryStore:
+    """Storage interface; the base class stores nothing"""
+
+    depth = 0
+
+    def save_memory(self, uid, memory):
+        pass
+
+    def save_transcript_segments(self, uid, session_id, segments, removed=()):
+        pass
+
+    def get_memory(self, uid, memory_id):
+        return None
+
+    def list_memories(self, uid, limit=20, offset=0):
+        return []
+
+    def close(self):
+        pass
+
+
+def memory_rows(uid, memory, now):
+    """Return (statement, rows) pairs that persist one validated memory"""
+    structured = memory['structured']
+    memory_id = memory['id']
+    return [
+        (UPSERT_MEMORY, [(
+            uid, memory_id, memory.get('created_at'), memory.get('started_at'),
+            memory.get('finished_at'), memory.get('transcript'), structured.get('title'),
+            structured.get('overview'), structured.get('emoji'), structured.get('category'),
+            dumps(structured.get('events', [])).decode('utf-8'), now
+        )]),
+        (DELETE_ACTION_ITEMS, [(uid, memory_id)]),
+        (DELETE_MEMORY_SEGMENTS, [(uid, memory_id)]),
+        (INSERT_ACTION_ITEM, [
+            (uid, memory_id, position, item.get('description'), int(bool(item.get('completed'))))
+            for position, item in enumerate(structured.get('action_items', []))
+        ]),
+        (INSERT_MEMORY_SEGMENT, [
+            (uid, memory_id, position, segment.get('text'), segment.get('speaker'),
+             segment.get('speakerId'), int(bool(segment.get('is_user'))),
+             segment.get('start'), segment.get('end'))
+            for position, segment in enumerate(memory.get('transcript_segments', []))
+        ])
+    ]
+
+
+def transcript_rows(uid, session_id, segments, now, removed=()):
+    """Return (statement, rows) pairs that write merged segments and drop replaced ones"""
+    return [
+        (DELETE_TRANSCRIPT_SEGMENT, [(uid, session_id, start) for start in removed]),
+        (UPSERT_TRANSCRIPT_SEGMENT, [
+            (uid, session_id, segment['start'], segment['end'], segment['text'], segment['speaker'],
+             segment['speakerId'], int(segment['is_user']), now)
+            for segment in segments
+        ])
+    ]
+
+
+class SQLiteDatabase:
+    """SQLite (WAL) database with a single batching writer thread and pooled readers
+
+    Writes are queued as lists of (statement, rows) pairs. The writer merges
+    the rows of everything queued within the flush window and runs each
+    statement once per batch, in `statement_order`, inside one transaction.
+    Operations queued with the same key replace each other within a batch,
+    so a record resent in quick succession is only written once (and does
+    not collide with itself on primary keys). If a batch fails, its
+    operations are retried one at a time so only the bad one is dropped.
+
+    Statements in `barrier_statements` (deletes of rows an earlier operation
+    may have written) must not run ahead of earlier operations' later
+    statements, so an operation carrying them starts a new group of merged
+    rows within the transaction.
+    """
+
+    schema = ''
+    statement_order = []
+    barrier_statements = ()
+    writer_name = 'sqlite-writer'
+
+    def __init__(self, path, batch_size=STORAGE_BATCH_SIZE, flush_ms=STORAGE_FLUSH_MS,
+                 queue_size=STORAGE_QUEUE_SIZE, readers=STORAGE_READERS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000.0
+        self.queue_size = queue_size
+        self.readers = readers
+        self._queue = None
+        self._readers = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.operations = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        """Operations waiting for the writer thread"""
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # Let INSERT OR REPLACE fire delete triggers for the rows it replaces
+        conn.execute('PRAGMA recursive_triggers=ON')
+        return conn
+
+    def _ensure_started(self):
+        # Connections and the writer thread are created per process (after fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            writer = self._connect()
+            writer.executescript(self.schema)
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._readers = queue.Queue()
+            for _ in range(self.readers):
+                self._readers.put(self._connect())
+            self._thread = threading.Thread(
+                target=self._write_loop, args=(writer,), name=self.writer_name, daemon=True
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def write(self, operation, key=None):
+        """Queue (statement, rows) pairs for the writer thread"""
+        self._ensure_started()
+        self._queue.put((key, operation))
+
+    def _write_loop(self, conn):
+        while True:
+            operation = self._queue.get()
+            if operation is _STOP:
+                break
+            batch = [operation]
+            stop = False
+
+            # Collect whatever else arrives within the flush window
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    operation = self._queue.get(timeout=max(0.0, remaining)) if remaining > 0 \
+                        else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if operation is _STOP:
+                    stop = True
+                    break
+                batch.append(operation)
+
+            try:
+                self._write_batch(conn, batch)
+            except Exception:
+                # The writer must outlive any bad batch, or every later write is lost
+                logger.exception(f"Failed to write batch of {len(batch)} operations to {self.path}")
+            if stop:
+                break
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        # Keep only the latest operation per key
+        latest = {key: index for index, (key, _) in enumerate(batch) if key is not None}
+        operations = [
+            operation for index, (key, operation) in enumerate(batch)
+            if key is None or latest[key] == index
+        ]
+        try:
+            self._execute(conn, operations)
+        except Exception as e:
+            if len(operations) == 1:
+                self.failed += 1
+                logger.error(f"Failed to write operation to {self.path}: {e!r}")
+                return
+            # Isolate the operation that broke the batch; the others still land
+            logger.warning(f"Batch of {len(operations)} operations to {self.path} failed ({e!r}), "
+                           f"retrying one at a time")
+            for operation in operations:
+                try:
+                    self._execute(conn, [operation])
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Failed to write operation to {self.path}: {e!r}")
+            self.batches += 1
+            self.operations += len(batch)
+            return
+        self.batches += 1
+        self.operations += len(batch)
+
+    def _execute(self, conn, operations):
+        """Run operations in one transaction, each statement once per group of merged rows"""
+        groups = []
+        rows = None
+        for operation in operations:
+            if rows is None or self._crosses_barrier(rows, operation):
+                rows = {statement: [] for statement in self.statement_order}
+                groups.append(rows)
+            for statement, statement_rows in operation:
+                rows[statement].extend(statement_rows)
+        with conn:
+            for rows in groups:
+                for statement in self.statement_order:
+                    if rows[statement]:
+                        conn.executemany(statement, rows[statement])
+
+    def _crosses_barrier(self, rows, operation):
+        """True if operation deletes rows that statements already merged may write"""
+        for statement, statement_rows in operation:
+            if statement_rows and statement in self.barrier_statements:
+                later = self.statement_order[self.statement_order.index(statement) + 1:]
+                if any(rows[other] for other in later):
+                    return True
+        return False
+
+    @contextmanager
+    def reader(self):
+        """Borrow a pooled read connection"""
+        self._ensure_started()
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self):
+        """Write pending operations and close all connections"""
+        if self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        while not self._readers.empty():
+            self._readers.get().close()
+        self._pid = None
+
+
+class SQLiteStore(SQLiteDatabase, MemoryStore):
+    """Memory store backed by SQLite"""
+
+    schema = SCHEMA
+    statement_order = STATEMENT_ORDER
+    barrier_statements = (DELETE_TRANSCRIPT_SEGMENT,)
+    writer_name = 'storage-writer'
+
+    def __init__(self, path=STORAGE_PATH, **kwargs):
+        super().__init__(path, **kwargs)
+
+    def save_memory(self, uid, memory):
+        self.write(memory_rows(uid, memory, time.time()), key=(uid, memory['id']))
+
+    def save_transcript_segments(self, uid, session_id, segments, removed=()):
+        if segments or removed:
+            self.write(transcript_rows(uid, session_id, segments, time.time(), removed))
+
+    def get_memory(self, uid, memory_id):
+        with self.reader() as conn:
+            row = conn.execute(
+                'SELECT id, created_at, started_at, finished_at, transcript, title, overview, '
+                'emoji, category, events FROM memories WHERE uid = ? AND id = ?',
+                (uid, memory_id)
+            ).fetchone()
+            if row is None:
+                return None
+            action_items = conn.execute(
+                'SELECT description, completed FROM action_items '
+                'WHERE uid = ? AND memory_id = ? ORDER BY position', (uid, memory_id)
+            ).fetchall()
+            segments = conn.execute(
+                'SELECT text, speaker, speaker_id, is_user, start, end FROM memory_segments '
+                'WHERE uid = ? AND memory_id = ? ORDER BY position', (uid, memory_id)
+            ).fetchall()
+        return {
+            'id': row[0],
+            'created_at': row[1],
+            'started_at': row[2],
+            'finished_at': row[3],
+            'transcript': row[4],
+            'transcript_segments': [
+                {'text': s[0], 'speaker': s[1], 'speakerId': s[2], 'is_user': bool(s[3]),
+                 'start': s[4], 'end': s[5]}
+                for s in segments
+            ],
+            'structured': {
+                'title': row[5],
+                'overview': row[6],
+                'emoji': row[7],
+                'category': row[8],
+                'action_items': [
+                    {'description': item[0], 'completed': bool(item[1])} for item in action_items
+                ],
+                'events': loads(row[9]) if row[9] else []
+            }
+        }
+
+    def list_memories(self, uid, limit=20, offset=0):
+        with self.reader() as conn:
+            rows = conn.execute(
+                'SELECT id, created_at, title, overview, category FROM memories WHERE uid = ? '
+                'ORDER BY created_at DESC LIMIT ? OFFSET ?', (uid, limit, offset)
+            ).fetchall()
+        return [
+            {'id': r[0], 'created_at': r[1], 'title': r[2], 'overview': r[3], 'category': r[4]}
+            for r in rows
+        ]
+
+
+BACKENDS = {
+    'sqlite': SQLiteStore,
+    'none': MemoryStore
+}
+
+
+def create_store(backend=STORAGE_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Invalid STORAGE_BACKEND. Must be one of: {', '.join(BACKENDS)}")
+    return BACKENDS[backend]()
+
+
+# Shared store used by the event handlers
+storage = create_store()
@@ -0,0 +1,291 @@
+"""
+Omi App Webhook Server - Transcript Session Store
+
+Accumulates the transcript segments the Omi app sends for each
+conversation (`session_id`). The app resends overlapping segments as a
+conversation grows, so incoming segments are merged by time range: exact
+repeats are dropped and newer versions of a segment replace the old one.
+
+Segments are kept in compact columns (typed arrays for times, speaker ids
+and flags, plus a text pool) sorted by start time. Merging a webhook costs
+O(new segments) when segments arrive in order, with a binary-search
+interval lookup for overlaps. A merge reports the rows it wrote and removed,
+so storage and the search index can persist exactly the merged transcript.
+
+Sessions are kept per process: under gunicorn, deduplication only covers
+the webhooks of a conversation that reached the same worker.
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+logger = logging.getLogger('services.transcript_store')
+
+# Conversations with no new segments for this many seconds are evicted
+TRANSCRIPT_SESSION_IDLE_TIMEOUT = float(os.getenv('TRANSCRIPT_SESSION_IDLE_TIMEOUT', 3600))
+
+# Upper bound on stored conversations (least recently used is evicted)
+TRANSCRIPT_MAX_SESSIONS = int(os.getenv('TRANSCRIPT_MAX_SESSIONS', 1000))
+
+
+class MergeResult:
+    """Outcome of one merge: counts, rows written (by start) and starts removed"""
+    __slots__ = ('inserted', 'updated', 'duplicates', 'changes')
+
+    def __init__(self):
+        self.inserted = self.updated = self.duplicates = 0
+        self.changes = {}  # start -> segment as stored, or None if the row was removed
+
+    @property
+    def segments(self):
+        """Rows inserted or updated by the merge, in the Omi segment format"""
+        return [segment for segment in self.changes.values() if segment is not None]
+
+    @property
+    def removed(self):
+        """Start times of rows the merge deleted without replacing them"""
+        return [start for start, segment in self.changes.items() if segment is None]
+
+
+class TranscriptSession:
+    """Deduplicated, time-ordered transcript of one conversation"""
+
+    def __init__(self, uid, session_id):
+        self.uid = uid
+        self.session_id = session_id
+        self.starts = array('d')
+        self.ends = array('d')
+        self.speaker_ids = array('q')
+        self.is_user = array('b')
+        self.speaker_refs = array('I')  # Index into self.speakers
+        self.texts = []                 # Text pool, one entry per row
+        self.speakers = []
+        self._speaker_index = {}
+        self.longest = 0.0  # Longest segment duration, bounds overlap lookups
+        self.version = 0
+        self.received = 0
+        self.duplicates = 0
+        self.updated = 0
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def merge(self, segments):
+        """Merge validated segments and return a MergeResult
+
+        Every segment is converted to the column types before anything is
+        changed, so a value that does not fit (e.g. a speakerId beyond 64
+        bits) rejects the whole webhook and leaves the session untouched.
+        """
+        rows = [self._row(segment) for segment in segments]
+        result = MergeResult()
+        with self.lock:
+            for row in rows:
+                outcome = self._merge_row(row, result.changes)
+                if outcome == 'inserted':
+                    result.inserted += 1
+                elif outcome == 'updated':
+                    result.updated += 1
+                else:
+                    result.duplicates += 1
+            self.received += len(rows)
+            self.duplicates += result.duplicates
+            self.updated += result.updated
+            if result.inserted or result.updated:
+                self.version += 1
+            self.last_seen = time.monotonic()
+        return result
+
+    @staticmethod
+    def _row(segment):
+        """(start, end, speaker_id, is_user, speaker, text) in the column types
+
+        Raises ValueError, TypeError or OverflowError for values the columns
+        cannot hold.
+        """
+        return (
+            float(segment['start']),
+            float(segment['end']),
+            array('q', [segment['speakerId']])[0],
+            array('b', [segment['is_user']])[0],
+            segment['speaker'],
+            segment['text']
+        )
+
+    def _merge_row(self, values, changes):
+        start, end, speaker_id, is_user, speaker, text = values
+
+        overlapping = self._find_overlapping(start, end, speaker_id)
+        if len(overlapping) == 1:
+            row = overlapping[0]
+            if (self.starts[row] == start and self.ends[row] == end
+                    and self.texts[row] == text
+                    and self.speaker_ids[row] == speaker_id
+                    and self.speakers[self.speaker_refs[row]] == speaker
+                    and self.is_user[row] == is_user):
+                return 'duplicate'
+            if self.starts[row] == start:
+                self._set_row(row, values)
+                changes[start] = self._segment(row)
+                return 'updated'
+
+        # A newer version spanning several rows (or a shifted start) replaces them
+        for row in overlapping:  # Descending, so deletions keep indexes valid
+            changes[self.starts[row]] = None
+            self._delete_row(row)
+        position = bisect_right(self.starts, start)
+        self._insert_row(position, values)
+        changes[start] = self._segment(position)
+        return 'updated' if overlapping else 'inserted'
+
+    def _find_overlapping(self, start, end, speaker_id):
+        """Return rows that are earlier versions of a segment, newest row first
+
+        A row is an earlier version if it has the same start time, or if it
+        belongs to the same speaker and overlaps by more than half of the
+        shorter segment. Rows are sorted by start, so only rows starting
+        before `end` and after `start - longest segment` can overlap.
+        """
+        upper = bisect_left(self.starts, end) if end > start else bisect_right(self.starts, start)
+        earliest = start - self.longest
+        overlapping = []
+        for row in range(upper - 1, -1, -1):
+            row_start = self.starts[row]
+            if row_start < earliest:
+                break
+            if row_start == start:
+                overlapping.append(row)
+            elif self.speaker_ids[row] == speaker_id:
+                row_end = self.ends[row]
+                overlap = min(end, row_end) - max(start, row_start)
+                if overlap > 0 and overlap > 0.5 * min(end - start, row_end - row_start):
+                    overlapping.append(row)
+        return overlapping
+
+    def _speaker_ref(self, speaker):
+        ref = self._speaker_index.get(speaker)
+        if ref is None:
+            ref = self._speaker_index[speaker] = len(self.speakers)
+            self.speakers.append(speaker)
+        return ref
+
+    def _columns(self, values):
+        start, end, speaker_id, is_user, speaker, text = values
+        return (
+            (self.starts, start),
+            (self.ends, end),
+            (self.speaker_ids, speaker_id),
+            (self.is_user, is_user),
+            (self.speaker_refs, self._speaker_ref(speaker)),
+            (self.texts, text)
+        )
+
+    def _set_row(self, row, values):
+        # Values were converted by _row, so no assignment can fail part way
+        start, end = values[0], values[1]
+        self.longest = max(self.longest, end - start)
+        for column, value in self._columns(values):
+            column[row] = value
+
+    def _insert_row(self, row, values):
+        start, end = values[0], values[1]
+        self.longest = max(self.longest, end - start)
+        if row == len(self.starts):
+            # Common case: segments arrive in time order
+            for column, value in self._columns(values):
+                column.append(value)
+        else:
+            for column, value in self._columns(values):
+                column.insert(row, value)
+
+    def _delete_row(self, row):
+        for column in (self.starts, self.ends, self.speaker_ids, self.is_user, self.speaker_refs):
+            del column[row]
+        del self.texts[row]
+
+    def _segment(self, row):
+        return {
+            'text': self.texts[row],
+            'speaker': self.speakers[self.speaker_refs[row]],
+            'speakerId': self.speaker_ids[row],
+            'is_user': bool(self.is_user[row]),
+            'start': self.starts[row],
+            'end': self.ends[row]
+        }
+
+    def segments(self, start=0, stop=None):
+        """Materialize rows [start:stop] in the Omi segment format"""
+        with self.lock:
+            stop = len(self.starts) if stop is None else min(stop, len(self.starts))
+            return [self._segment(row) for row in range(start, stop)]
+
+    def text(self, separator='\n'):
+        """Return the whole conversation as text, one segment per line"""
+        with self.lock:
+            return separator.join(self.texts)
+
+    def stats(self):
+        return {
+            'segments': len(self.starts),
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'updated': self.updated,
+            'version': self.version
+        }
+
+
+class TranscriptStore:
+    """Per-conversation transcript sessions with idle and LRU eviction"""
+
+    def __init__(self, idle_timeout=TRANSCRIPT_SESSION_IDLE_TIMEOUT, max_sessions=TRANSCRIPT_MAX_SESSIONS):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    def get(self, uid, session_id):
+        with self._lock:
+            return self._sessions.get((uid, session_id))
+
+    def merge(self, uid, session_id, segments):
+        """Merge segments into a conversation and return its MergeResult"""
+        key = (uid, session_id)
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = TranscriptSession(uid, session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(key)
+        return session.merge(segments)
+
+    def remove(self, uid, session_id):
+        with self._lock:
+            return self._sessions.pop((uid, session_id), None)
+
+    def _evict_idle(self):
+        """Drop sessions idle for longer than the timeout (called with the lock held)"""
+        now = time.monotonic()
+        if now - self._last_eviction < 1.0:
+            return
+        self._last_eviction = now
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < self.idle_timeout:
+                break
+            del self._sessions[key]
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# Shared store fed by the transcript handler
+transcript_store = TranscriptStore()
@@ -7,6 +7,19 @@ from tests.test_memory import test_memory_events
 from tests.test_audio import test_audio_events
 from tests.test_transcript import test_transcript_events
 from tests.test_system import test_system_events, test_authentication
+from tests.test_search import test_search_endpoint
+from tests.test_forwarder import test_forwarding
+from tests.test_batch import test_batch_endpoint
+from tests.test_audio_export import test_audio_export, test_export_layout
+from tests.test_audio_archive import test_audio_archive
+from tests.test_audio_buffer import test_audio_buffer, test_audio_live
+from tests.test_resampler import test_resampler
+from tests.test_opus_decoder import test_opus_decoder
+from tests.test_event_log import test_event_log
+from tests.test_transcript_store import test_transcript_store
+from tests.test_rate_limit import test_rate_limiting
+from tests.test_idempotency import test_idempotency_after_refusal
+from tests.test_gate import test_request_gate
 
 def run_all_tests():
     """Run all test suites"""
@@ -14,10 +27,25 @@ def run_all_tests():
 
     # Run all test suites
     test_authentication()
+    test_request_gate()
     test_memory_events()
     test_audio_events()
     test_transcript_events()
     test_system_events()
+    test_search_endpoint()
+    test_forwarding()
+    test_batch_endpoint()
+    test_audio_buffer()
+    test_resampler()
+    test_opus_decoder()
+    test_event_log()
+    test_transcript_store()
+    test_audio_live()
+    test_audio_archive()
+    test_audio_export()
+    test_export_layout()
+    test_rate_limiting()
+    test_idempotency_after_refusal()
 
     # Print results and exit with appropriate code
     success = print_test_results()
@@ -0,0 +1,84 @@
+"""
+Omi App Webhook Server - Audio Archive Tests
+
+Runs archives in-process on a temporary directory; no webhook server needed.
+"""
+import tempfile
+import numpy as np
+from . import add_test_result
+from services.audio_archive import AudioArchive, compress_block, decompress_block
+from services.audio_stream import AudioSink
+
+def archive_upload(archive, uid, sample_rate, codec, data, chunk_size=4000):
+    """Stream an accepted upload through the archive stage in chunks"""
+    stage = archive.stage(AudioSink(), uid, sample_rate, codec)
+    for start in range(0, len(data), chunk_size):
+        stage.write(memoryview(data)[start:start + chunk_size])
+    stage.close()
+
+def test_audio_archive():
+    """Test block compression round trips, spooled uploads and sessions shared between archive writers"""
+    # A tone plus noise, with full-scale samples so deltas wrap around int16
+    rng = np.random.default_rng(0)
+    t = np.arange(48000) / 16000
+    samples = (np.sin(2 * np.pi * 440 * t) * 8000 + rng.normal(0, 200, t.size)).astype('<i2')
+    samples[100:104] = [32767, -32768, 32767, -32768]
+    pcm = samples.tobytes()
+    opus = bytes(rng.integers(0, 256, 5000, dtype=np.uint8))
+
+    stored, compression = compress_block(pcm, 'pcm', 'zlib')
+    add_test_result(
+        'audio archive (delta+zlib round trip)',
+        compression == 'delta+zlib' and bytes(decompress_block(stored, compression)) == pcm
+        and len(stored) < len(pcm),
+        f"Expected a smaller delta+zlib block that decodes to the input, got {compression} "
+        f"{len(stored)} of {len(pcm)} bytes"
+    )
+    stored, compression = compress_block(opus, 'opus', 'zlib')
+    add_test_result(
+        'audio archive (zlib round trip)',
+        compression == 'zlib' and bytes(decompress_block(stored, compression)) == opus,
+        f"Expected zlib for Opus that decodes to the input, got {compression}"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Two archives on one directory stand in for two gunicorn workers
+        first = AudioArchive(directory, compression='zlib', block_bytes=4096, flush_ms=1)
+        second = AudioArchive(directory, compression='zlib', block_bytes=4096, flush_ms=1)
+        try:
+            chunks = [pcm[i:i + 10000] for i in range(0, len(pcm), 10000)]
+            for index, chunk in enumerate(chunks):
+                archive = first if index % 2 == 0 else second
+                archive_upload(archive, 'test-archive-user', 16000, 'pcm', chunk)
+                archive.close()  # Writes the queued upload before the other worker's next one
+            archive_upload(first, 'test-archive-user', 8000, 'pcm', pcm[:2000])
+
+            # A rejected upload is spooled while streaming but never archived
+            stage = first.stage(AudioSink(), 'test-archive-user', 8000, 'pcm')
+            stage.write(memoryview(pcm)[:4000])
+            spooled = stage.spool.tell()
+            stage.abort()
+            first.close()
+
+            sessions = first.sessions('test-archive-user')
+            by_rate = {session['sample_rate']: session for session in sessions}
+            add_test_result(
+                'audio archive (shared session)',
+                len(sessions) == 2 and by_rate.get(16000, {}).get('bytes') == len(pcm)
+                and by_rate.get(8000, {}).get('bytes') == 2000 and spooled == 4000 and stage.spool is None,
+                f"Expected one 16 kHz session of {len(pcm)} bytes and one 8 kHz session without the "
+                f"aborted upload, got {sessions}"
+            )
+
+            blocks = first.blocks('test-archive-user', by_rate[16000]['session_id']) if 16000 in by_rate else []
+            audio = b''.join(bytes(chunk) for chunk in second.iter_audio(blocks))
+            sliced = b''.join(bytes(chunk) for chunk in second.iter_audio(blocks, 5001, 20003))
+            add_test_result(
+                'audio archive (compressed read back)',
+                audio == pcm and sliced == pcm[5001:20003]
+                and all(block.compression == 'delta+zlib' for block in blocks),
+                f"Expected the archived stream to read back unchanged from {len(blocks)} blocks"
+            )
+        finally:
+            first.close()
+            second.close()
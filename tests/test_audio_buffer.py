@@ -0,0 +1,126 @@
+"""
+Omi App Webhook Server - Audio Buffer and Analysis Tests
+
+The ring buffer and the analysis stage run in-process; the live endpoint
+is checked on the running server.
+"""
+import time
+import requests
+import numpy as np
+from . import WEBHOOK_URL, WEBHOOK_SECRET, add_test_result
+from services.audio_analysis import AudioStatsStore, PcmAnalysisStage, analyze_pcm
+from services.audio_buffer import AudioRingBuffer
+from services.audio_stream import AudioSink
+
+LIVE_URL = WEBHOOK_URL.replace('/webhook', '/audio/live')
+
+
+class CollectingSink(AudioSink):
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, chunk):
+        self.chunks.append(bytes(chunk))
+
+
+def test_audio_buffer():
+    """Test ring buffer wraparound and rollback, and silence dropping"""
+    ring = AudioRingBuffer(10)
+    ring.append(b'abcdef')
+    ring.append(b'ghijkl')  # Wraps around and overwrites 'ab'
+    add_test_result(
+        'audio buffer (wraparound)',
+        bytes(ring.read_last(10)) == b'cdefghijkl' and bytes(ring.read_last(3)) == b'jkl'
+        and ring.size == 10 and ring.total_bytes == 12,
+        f"Expected the newest 10 bytes, got {bytes(ring.read_last(10))!r}"
+    )
+
+    ring.append(b'0123456789abc')  # Longer than the buffer: only the tail survives
+    add_test_result(
+        'audio buffer (oversized append)',
+        bytes(ring.read_last(10)) == b'3456789abc',
+        f"Expected the last 10 bytes of the append, got {bytes(ring.read_last(10))!r}"
+    )
+
+    ring = AudioRingBuffer(10)
+    ring.append(b'abcdef')
+    mark = ring.mark()
+    ring.append(b'xyz')
+    ring.rollback(mark)
+    rolled_back = bytes(ring.read_last(10))
+    ring.append(b'uvwxyz')
+    mark = ring.mark()
+    ring.append(b'1234')  # Overwrites 'cdef', which the rollback cannot bring back
+    ring.rollback(mark)
+    add_test_result(
+        'audio buffer (rollback)',
+        rolled_back == b'abcdef' and bytes(ring.read_last(10)) == b'uvwxyz'
+        and ring.total_bytes == 12,
+        f"Expected rollbacks to leave b'abcdef' then b'uvwxyz', got {rolled_back!r}, "
+        f"{bytes(ring.read_last(10))!r}"
+    )
+
+    # 20 ms frames at 16 kHz: a silent chunk and a loud, partly clipped one
+    silence = np.zeros(3200, dtype='<i2').tobytes()
+    t = np.arange(3200) / 16000
+    tone = np.clip(np.sin(2 * np.pi * 440 * t) * 40000, -32768, 32767).astype('<i2').tobytes()
+    analysis = analyze_pcm(tone, 16000)
+    add_test_result(
+        'audio analysis (frames)',
+        analysis.frames == 10 and analysis.voiced_frames == 10 and analysis.clipped_samples > 0
+        and analysis.peak == 32768 and analyze_pcm(silence, 16000).is_silent,
+        f"Expected 10 voiced frames with clipping, got {analysis.voiced_frames} of {analysis.frames}"
+    )
+
+    sink = CollectingSink()
+    stats = AudioStatsStore()
+    stage = PcmAnalysisStage(sink, 'test-buffer-user', 16000, stats, drop_silence=True)
+    for chunk in (silence, tone, silence):
+        stage.write(chunk)
+    snapshot = stats.snapshot('test-buffer-user')
+    add_test_result(
+        'audio analysis (silence dropping)',
+        sink.chunks == [tone] and snapshot['chunks'] == 3 and snapshot['dropped_chunks'] == 2
+        and snapshot['silent_frames'] == 20,
+        f"Expected only the tone to pass and two dropped chunks, got {len(sink.chunks)} chunks, {snapshot}"
+    )
+
+
+def test_audio_live():
+    """Test the live session endpoint on the running server"""
+    uid = f"test-live-user-{int(time.time())}"
+    t = np.arange(16000) / 16000
+    audio_data = (np.sin(2 * np.pi * 440 * t) * 8000).astype('<i2').tobytes()
+    try:
+        requests.post(
+            f"{WEBHOOK_URL}?uid={uid}&key={WEBHOOK_SECRET}&sample_rate=16000",
+            data=audio_data,
+            headers={'Content-Type': 'application/octet-stream'}
+        )
+        response = requests.get(f"{LIVE_URL}?uid={uid}&key={WEBHOOK_SECRET}")
+        body = response.json() if response.status_code == 200 else {}
+        session = body.get('session') or {}
+        stats = body.get('stats') or {}
+        add_test_result(
+            'audio live (session)',
+            session.get('total_bytes') == len(audio_data) and session.get('buffered_seconds') == 1.0
+            and stats.get('frames') == 50 and stats.get('voiced_frames') == 50,
+            f"Expected one second buffered and 50 voiced frames, got {response.status_code} {body}"
+        )
+
+        response = requests.get(f"{LIVE_URL}?uid={uid}&key={WEBHOOK_SECRET}&seconds=0.5")
+        add_test_result(
+            'audio live (last seconds)',
+            response.status_code == 200 and response.content[:4] == b'RIFF'
+            and response.content[44:] == audio_data[-16000:],
+            f"Expected the last half second as WAV, got {response.status_code} ({len(response.content)} bytes)"
+        )
+
+        response = requests.get(f"{LIVE_URL}?uid={uid}-unknown&key={WEBHOOK_SECRET}&seconds=1")
+        add_test_result(
+            'audio live (unknown user)',
+            response.status_code == 404,
+            f"Expected 404, got {response.status_code}"
+        )
+    except Exception as e:
+        add_test_result('audio live', False, f"Request failed: {str(e)}")
@@ -0,0 +1,177 @@
+"""
+Omi App Webhook Server - Audio Export Tests
+"""
+import struct
+import tempfile
+import time
+import requests
+import numpy as np
+from . import WEBHOOK_URL, WEBHOOK_SECRET, add_test_result
+from .test_audio_archive import archive_upload
+from services.audio_archive import AudioArchive
+from services.audio_export import ExportError, export_length, export_parts, iter_range, ogg_crc
+
+AUDIO_URL = WEBHOOK_URL.replace('/webhook', '/audio')
+
+def test_audio_export():
+    """Test the audio export endpoints - session listing, WAV download and ranges"""
+    uid = f"test-export-user-{int(time.time())}"
+    t = np.arange(16000) / 16000
+    audio_data = (np.sin(2 * np.pi * 440 * t) * 8000).astype('<i2').tobytes()
+
+    try:
+        requests.post(
+            f"{WEBHOOK_URL}?uid={uid}&key={WEBHOOK_SECRET}&sample_rate=16000",
+            data=audio_data,
+            headers={'Content-Type': 'application/octet-stream'}
+        )
+
+        # Archiving happens in the background, so poll briefly
+        sessions = []
+        for _ in range(20):
+            response = requests.get(f"{AUDIO_URL}?uid={uid}&key={WEBHOOK_SECRET}")
+            sessions = response.json().get('sessions', []) if response.status_code == 200 else []
+            if sessions:
+                break
+            time.sleep(0.1)
+        add_test_result(
+            'audio export (sessions)',
+            len(sessions) == 1 and sessions[0].get('bytes') == len(audio_data),
+            f"Expected one session of {len(audio_data)} bytes, got {sessions}"
+        )
+        if not sessions:
+            return
+        export_url = f"{AUDIO_URL}/{sessions[0]['session_id']}?uid={uid}&key={WEBHOOK_SECRET}"
+
+        response = requests.get(export_url)
+        add_test_result(
+            'audio export (wav)',
+            response.status_code == 200 and response.content[:4] == b'RIFF'
+            and response.content[44:] == audio_data,
+            f"Expected a WAV file of the uploaded audio, got {response.status_code} "
+            f"({len(response.content)} bytes)"
+        )
+
+        response = requests.get(export_url, headers={'Range': 'bytes=44-1043'})
+        add_test_result(
+            'audio export (range)',
+            response.status_code == 206 and response.content == audio_data[:1000],
+            f"Expected 206 with the first 1000 audio bytes, got {response.status_code}"
+        )
+
+        # Failure cases
+        response = requests.get(f"{AUDIO_URL}/unknown-session?uid={uid}&key={WEBHOOK_SECRET}")
+        add_test_result(
+            'audio export (unknown session)',
+            response.status_code == 404,
+            f"Expected 404, got {response.status_code}"
+        )
+
+        response = requests.get(export_url + '&format=ogg')
+        add_test_result(
+            'audio export (ogg of pcm)',
+            response.status_code == 400,
+            f"Expected 400, got {response.status_code}"
+        )
+    except Exception as e:
+        add_test_result(
+            'audio export',
+            False,
+            f"Request failed: {str(e)}"
+        )
+
+
+def read_ogg_pages(data):
+    """(granule, packet) of every page of an Ogg file with one packet per page"""
+    pages = []
+    offset = 0
+    while offset < len(data) and data[offset:offset + 4] == b'OggS':
+        (granule,) = struct.unpack_from('<q', data, offset + 6)
+        segments = data[offset + 26]
+        start = offset + 27 + segments
+        end = start + sum(data[offset + 27:start])
+        pages.append((granule, data[start:end]))
+        offset = end
+    return pages
+
+
+def test_export_layout():
+    """Test Ogg pages laid out from the archive index and WAV gaps filled with silence"""
+    # CELT 20 ms packets (TOC 0x78, one frame, 960 samples each)
+    packets = [bytes([0x78]) + bytes([index]) * (40 + index * 9) for index in range(30)]
+    framed = b''.join(struct.pack('>H', len(packet)) + packet for packet in packets)
+    pcm = bytes(range(256)) * 40
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = AudioArchive(directory, compression='zlib', block_bytes=1024, flush_ms=1)
+        try:
+            archive_upload(archive, 'test-layout-opus', 16000, 'opus', framed)
+            archive_upload(archive, 'test-layout-pcm', 16000, 'pcm', pcm)
+            archive_upload(archive, 'test-layout-raw', 16000, 'opus', b'\x00\x09opus')
+            archive.close()
+
+            def session_blocks(uid):
+                return archive.blocks(uid, archive.sessions(uid)[0]['session_id'])
+
+            # The layout comes from the index; producing the export reads each block once
+            reads = []
+            read_block = archive.read_block
+            archive.read_block = lambda block: reads.append(block.position) or read_block(block)
+            opus_blocks = session_blocks('test-layout-opus')
+            parts = export_parts(archive, opus_blocks, 'ogg')
+            layout_reads = len(reads)
+            data = b''.join(iter_range(parts, 0, export_length(parts)))
+            pages = read_ogg_pages(data)
+            add_test_result(
+                'audio export (ogg layout from index)',
+                layout_reads == 0 and len(opus_blocks) > 1
+                and sorted(reads) == [block.position for block in opus_blocks],
+                f"Expected no block read before producing and one read per block after, got "
+                f"{layout_reads} and {reads}"
+            )
+            # The checksum covers the page with its own CRC field zeroed
+            first_page = data[:27 + data[26] + sum(data[27:27 + data[26]])]
+            add_test_result(
+                'audio export (ogg crc)',
+                ogg_crc(b'123456789') == 0x89A1897F
+                and ogg_crc(first_page[:22] + bytes(4) + first_page[26:]) == struct.unpack_from('<I', first_page, 22)[0],
+                "Expected the Ogg CRC check value and a matching first page checksum"
+            )
+            add_test_result(
+                'audio export (ogg pages)',
+                len(data) == export_length(parts)
+                and [packet for _, packet in pages[2:]] == packets
+                and [granule for granule, _ in pages[2:]] == [960 * (index + 1) for index in range(30)],
+                f"Expected one page per uploaded packet, got {len(pages)} pages in {len(data)} bytes"
+            )
+            add_test_result(
+                'audio export (ogg range)',
+                b''.join(iter_range(parts, 100, 2000)) == data[100:2000],
+                "Expected a byte range to match the full export"
+            )
+
+            # Drop the second block, as if that upload had not been archived
+            blocks = session_blocks('test-layout-pcm')
+            parts = export_parts(archive, blocks[:1] + blocks[2:], 'wav')
+            data = b''.join(iter_range(parts, 0, export_length(parts)))
+            add_test_result(
+                'audio export (wav gap)',
+                len(data) == 44 + len(pcm) and data[44:1068] == pcm[:1024]
+                and data[1068:2092] == bytes(1024) and data[2092:] == pcm[2048:],
+                f"Expected the missing block as silence in a {44 + len(pcm)} byte file, got {len(data)} bytes"
+            )
+
+            try:
+                export_parts(archive, session_blocks('test-layout-raw'), 'ogg')
+                refused = False
+            except ExportError:
+                refused = True
+            add_test_result(
+                'audio export (unframed opus)',
+                refused,
+                "Expected Ogg export of unframed Opus to be refused"
+            )
+        except Exception as e:
+            add_test_result('audio export layout', False, f"Error: {str(e)}")
+        finally:
+            archive.close()
@@ -0,0 +1,102 @@
+"""
+Omi App Webhook Server - Batch Endpoint Tests
+"""
+import json
+import requests
+from . import WEBHOOK_URL, WEBHOOK_SECRET, add_test_result
+
+BATCH_URL = f"{WEBHOOK_URL}/batch"
+
+def test_batch_endpoint():
+    """Test the batch endpoint - mixed events, per-item results and failure cases"""
+    segments = [{
+        "text": "Batched segment",
+        "speaker": "SPEAKER_00",
+        "speakerId": 0,
+        "is_user": False,
+        "start": 0.0,
+        "end": 1.5
+    }]
+    lines = [
+        json.dumps({
+            "type": "new_processing_memory_created",
+            "memory": {"id": "test-batch-memory", "status": "processing"}
+        }),
+        json.dumps({"session_id": "test-batch-session", "segments": segments}),
+        "{not json",
+        json.dumps({"type": "unknown_event"})
+    ]
+
+    try:
+        response = requests.post(
+            f"{BATCH_URL}?uid=test-batch-user&key={WEBHOOK_SECRET}",
+            data='\n'.join(lines),
+            headers={'Content-Type': 'application/x-ndjson'}
+        )
+        body = response.json() if response.status_code == 200 else {}
+        statuses = [result.get('status') for result in body.get('results', [])]
+        add_test_result(
+            'batch (per-item results)',
+            statuses == [200, 200, 400, 400] and body.get('accepted') == 2,
+            f"Expected [200, 200, 400, 400], got {response.status_code} {response.text}"
+        )
+
+        # Transcript lines without their own session_id need one in the query string
+        response = requests.post(
+            f"{BATCH_URL}?uid=test-batch-user&key={WEBHOOK_SECRET}",
+            data=json.dumps(segments),
+            headers={'Content-Type': 'application/x-ndjson'}
+        )
+        results = response.json().get('results', []) if response.status_code == 200 else []
+        add_test_result(
+            'batch (missing session_id)',
+            [result.get('status') for result in results] == [400],
+            f"Expected one 400 result, got {response.status_code} {response.text}"
+        )
+
+        # A line with a non-string uid fails on its own; the others are processed
+        response = requests.post(
+            f"{BATCH_URL}?uid=test-batch-user&key={WEBHOOK_SECRET}",
+            data='\n'.join([
+                json.dumps({"type": "ping", "uid": 123}),
+                json.dumps({"type": "ping", "uid": ["test-batch-user"]}),
+                json.dumps({"type": "ping", "uid": "test-batch-user-2"})
+            ]),
+            headers={'Content-Type': 'application/x-ndjson'}
+        )
+        results = response.json().get('results', []) if response.status_code == 200 else []
+        add_test_result(
+            'batch (invalid item uid)',
+            [result.get('status') for result in results] == [400, 400, 200]
+            and results[0].get('error') == 'Invalid uid',
+            f"Expected [400, 400, 200], got {response.status_code} {response.text}"
+        )
+
+        # Failure cases
+        response = requests.post(
+            f"{BATCH_URL}?uid=test-batch-user&key={WEBHOOK_SECRET}",
+            data='',
+            headers={'Content-Type': 'application/x-ndjson'}
+        )
+        add_test_result(
+            'batch (empty)',
+            response.status_code == 400,
+            f"Expected 400, got {response.status_code}"
+        )
+
+        response = requests.post(
+            f"{BATCH_URL}?uid=test-batch-user&key=invalid",
+            data=lines[0],
+            headers={'Content-Type': 'application/x-ndjson'}
+        )
+        add_test_result(
+            'batch (invalid key)',
+            response.status_code == 401,
+            f"Expected 401, got {response.status_code}"
+        )
+    except Exception as e:
+        add_test_result(
+            'batch',
+            False,
+            f"Request failed: {str(e)}"
+        )
@@ -0,0 +1,123 @@
+"""
+Omi App Webhook Server - Event Log Tests
+
+Runs event logs in-process on a temporary directory; no webhook server
+needed. Write failures are forced by tearing writes to the open segment.
+"""
+import os
+import tempfile
+import threading
+import time
+from . import add_test_result
+from services.event_log import EventLog, EventLogError, iter_events, list_segments, read_segment
+
+
+class TornFile:
+    """Segment file that writes half of every batch, then fails"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data):
+        self.file.write(data[:len(data) // 2])
+        self.file.flush()
+        raise OSError('disk full')
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def raises_event_log_error(call):
+    try:
+        call()
+    except EventLogError:
+        return True
+    return False
+
+
+def test_event_log():
+    """Test group commit, failed writes, corrupt tails and replay"""
+    with tempfile.TemporaryDirectory() as directory:
+        log = EventLog(directory, flush_ms=50)
+        batches = []
+        write_batch = log._write_batch
+
+        def counting_write_batch(batch):
+            batches.append(len(batch))
+            write_batch(batch)
+        log._write_batch = counting_write_batch
+
+        try:
+            # Concurrent waiting appends share fsyncs
+            threads = [
+                threading.Thread(target=log.append, args=('memory', 'test-log-user'), kwargs={'data': {'n': n}})
+                for n in range(10)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            add_test_result(
+                'event log (group commit)',
+                sum(batches) == 10 and len(batches) < 10,
+                f"Expected 10 events in fewer than 10 fsynced batches, got {batches}"
+            )
+
+            # A torn write fails every event of its batch and only those
+            log._file = TornFile(log._file)
+            second = log.append('memory', 'test-log-user', wait=False, data={'n': 10})
+            third = log.append('memory', 'test-log-user', wait=False, data={'n': 11})
+            add_test_result(
+                'event log (failed write)',
+                raises_event_log_error(lambda: log.wait(third, second))
+                and raises_event_log_error(lambda: log.wait(second))
+                and not raises_event_log_error(lambda: log.wait(second - 1)),
+                "Expected EventLogError for the failed batch only"
+            )
+
+            log.append('memory', 'test-log-user', data={'n': 12})
+            events = [event['data']['n'] for event in iter_events(directory)]
+            add_test_result(
+                'event log (committed records)',
+                sorted(events) == list(range(10)) + [12] and len(list_segments(directory)) == 2,
+                f"Expected the torn batch cut off and a new segment started, got {events}"
+            )
+        except Exception as e:
+            add_test_result('event log', False, f"Error: {str(e)}")
+        finally:
+            log.close()
+
+        # A record cut short or with a bad checksum ends the segment
+        path = list_segments(directory)[-1]
+        size = os.path.getsize(path)
+        with open(path, 'ab') as f:
+            f.write(b'\x40\x00\x00\x00\x00\x00\x00\x00{"ts": 1')
+        torn = [event['data']['n'] for event in read_segment(path)]
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+            f.seek(size - 2)
+            f.write(b'!}')
+        corrupt = [event['data']['n'] for event in read_segment(path)]
+        add_test_result(
+            'event log (corrupt tail)',
+            torn == [12] and corrupt == [],
+            f"Expected reads to stop at the torn and corrupt records, got {torn} and {corrupt}"
+        )
+
+    try:
+        import replay
+    except Exception as e:
+        add_test_result('event log (replay)', False, f"Could not import replay: {e}")
+        return
+    event = {
+        'ts': time.time(), 'kind': 'memory', 'uid': 'test-log-user',
+        'event_type': 'new_memory_create_failed',
+        'data': {'type': 'new_memory_create_failed', 'error': f'replay test {time.time()}'}
+    }
+    invalid = dict(event, event_type='memory_created', data={'type': 'memory_created', 'memory': {'id': 1}})
+    statuses = [replay.replay_event(event), replay.replay_event(invalid)]
+    add_test_result(
+        'event log (replay)',
+        statuses == [200, 400],
+        f"Expected a logged event to replay with 200 and an invalid one with 400, got {statuses}"
+    )
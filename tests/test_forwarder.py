@@ -0,0 +1,105 @@
+"""
+Omi App Webhook Server - Forwarder Tests
+
+Runs the forwarder against a local stub HTTP server; no webhook server needed.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from . import add_test_result
+from services.forwarder import Forwarder
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Records posted event batches; answers with the status queued for its path"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        statuses = self.server.statuses.get(self.path, [])
+        status = statuses.pop(0) if statuses else 200
+        if status == 200:
+            self.server.received.setdefault(self.path, []).append(json.loads(body)['events'])
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def test_forwarding():
+    """Test batching, retries and dead-lettering against a stub server"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.received = {}
+    server.statuses = {'/flaky': [503, 503], '/rejecting': [400]}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        dead_letter = os.path.join(directory, 'dead-letter.jsonl')
+        forwarder = Forwarder(
+            urls=[f"{base}/ok", f"{base}/flaky", f"{base}/rejecting"],
+            backoff_base=0.01, batch_ms=50, dead_letter_path=dead_letter
+        )
+        for i in range(3):
+            forwarder.forward('transcript', 'test-user-1', data=[{'text': f'segment {i}'}])
+        forwarder.forward('memory', 'test-user-1', data={'type': 'memory_created'})
+        forwarder.drain(timeout=10)
+        server.shutdown()
+
+        batches = server.received.get('/ok', [])
+        add_test_result(
+            'forwarder (batching)',
+            sorted(len(batch) for batch in batches) == [1, 3],
+            f"Expected a memory event and one batch of 3 transcripts, got {batches}"
+        )
+        add_test_result(
+            'forwarder (retries)',
+            len(server.received.get('/flaky', [])) == 2 and forwarder.retried == 2,
+            f"Expected 2 deliveries after 2 retries, got {server.received.get('/flaky')}"
+        )
+
+        dead = []
+        if os.path.exists(dead_letter):
+            with open(dead_letter) as f:
+                dead = [json.loads(line) for line in f]
+        add_test_result(
+            'forwarder (dead letter)',
+            len(dead) == 1 and dead[0]['error'] == 'HTTP 400' and dead[0]['attempts'] == 1,
+            f"Expected one dead-lettered 400 delivery, got {dead}"
+        )
+
+    # Retries wait on the timer heap, not in pool threads: with a long backoff
+    # and one in-flight slot, drain still returns promptly and dead-letters
+    # everything that was waiting
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.received = {}
+    server.statuses = {'/down': [503] * 10}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        dead_letter = os.path.join(directory, 'dead-letter.jsonl')
+        forwarder = Forwarder(
+            urls=[f"http://127.0.0.1:{server.server_port}/down"], backoff_base=60,
+            max_in_flight=1, queue_size=10, dead_letter_path=dead_letter
+        )
+        for i in range(3):
+            forwarder.forward('memory', 'test-user-1', data={'type': 'memory_created', 'n': i})
+        time.sleep(0.5)
+        in_flight = forwarder._pending
+        start = time.monotonic()
+        forwarder.drain(timeout=1)
+        elapsed = time.monotonic() - start
+        server.shutdown()
+
+        dead = []
+        if os.path.exists(dead_letter):
+            with open(dead_letter) as f:
+                dead = [json.loads(line) for line in f]
+        add_test_result(
+            'forwarder (bounded retries)',
+            in_flight == 1 and elapsed < 5 and any(d['error'] == 'shutdown before retry' for d in dead),
+            f"Expected 1 delivery in flight and a prompt drain, got {in_flight} in flight, "
+            f"{elapsed:.1f}s, dead letters {[d['error'] for d in dead]}"
+        )
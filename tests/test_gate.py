@@ -0,0 +1,100 @@
+"""
+Omi App Webhook Server - Request Gate Tests
+
+Checks the WSGI gate in front of the routes: keys, content types and body
+sizes are rejected from the headers alone. Secret rotation is tested on a
+gate built in-process, since the running server's secrets are fixed.
+"""
+import http.client
+from urllib.parse import urlsplit
+import requests
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from . import WEBHOOK_URL, WEBHOOK_SECRET, add_test_result
+from services.request_gate import RequestGate
+
+SERVER = urlsplit(WEBHOOK_URL)
+BASE_URL = f"{SERVER.scheme}://{SERVER.netloc}"
+
+def post_headers_only(path, content_type, content_length):
+    """POST only headers declaring a body, and return the status the gate answers with"""
+    conn = http.client.HTTPConnection(SERVER.hostname, SERVER.port, timeout=10)
+    try:
+        conn.putrequest('POST', path)
+        conn.putheader('Content-Type', content_type)
+        conn.putheader('Content-Length', str(content_length))
+        conn.endheaders()
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+def test_request_gate():
+    """Test gate rejections on the running server and secret rotation in-process"""
+    query = f"uid=test-gate-user&key={WEBHOOK_SECRET}"
+    try:
+        # Every protected route needs the key
+        protected = [
+            ('/webhook', lambda params: requests.post(f"{WEBHOOK_URL}?{params}", json={'type': 'ping'})),
+            ('/search', lambda params: requests.get(f"{BASE_URL}/search?q=test&{params}")),
+            ('/audio', lambda params: requests.get(f"{BASE_URL}/audio?{params}"))
+        ]
+        for path, send in protected:
+            for name, params in (('missing key', 'uid=test-gate-user'),
+                                 ('bad key', 'uid=test-gate-user&key=invalid')):
+                response = send(params)
+                add_test_result(
+                    f'gate ({path} {name})',
+                    response.status_code == 401,
+                    f"Expected 401, got {response.status_code}"
+                )
+
+        response = requests.post(
+            f"{WEBHOOK_URL}?{query}", data=b'<xml/>', headers={'Content-Type': 'application/xml'}
+        )
+        add_test_result(
+            'gate (unsupported content type)',
+            response.status_code == 415,
+            f"Expected 415, got {response.status_code} {response.text}"
+        )
+
+        # Only headers are sent: the gate must answer without waiting for the body
+        status, body = post_headers_only(f"/webhook?{query}&sample_rate=16000", 'application/octet-stream', 1 << 40)
+        add_test_result(
+            'gate (audio over limit)',
+            status == 413 and b'Audio data too large' in body,
+            f"Expected 413, got {status} {body!r}"
+        )
+        status, body = post_headers_only(f"/webhook?{query}", 'application/json', 1 << 40)
+        add_test_result(
+            'gate (JSON over limit)',
+            status == 413,
+            f"Expected 413, got {status} {body!r}"
+        )
+
+        response = requests.post(
+            f"{WEBHOOK_URL}?{query}&sample_rate=16000", data=b'',
+            headers={'Content-Type': 'application/octet-stream'}
+        )
+        add_test_result(
+            'gate (empty audio)',
+            response.status_code == 400 and response.json().get('error') == 'Missing audio data',
+            f"Expected 400 Missing audio data, got {response.status_code} {response.text}"
+        )
+    except Exception as e:
+        add_test_result('gate', False, f"Error: {str(e)}")
+
+    # Rotation: the old and the new secret are both accepted
+    def app(environ, start_response):
+        return Response('ok')(environ, start_response)
+
+    client = Client(RequestGate(app, secrets=['new-secret', 'old-secret']))
+    statuses = [
+        client.get(f"/webhook?uid=test-gate-user&key={key}").status_code
+        for key in ('new-secret', 'old-secret', 'other-secret')
+    ]
+    add_test_result(
+        'gate (rotated secrets)',
+        statuses == [200, 200, 401],
+        f"Expected [200, 200, 401], got {statuses}"
+    )
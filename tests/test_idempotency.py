@@ -0,0 +1,78 @@
+"""
+Omi App Webhook Server - Idempotency Tests
+
+Runs the server app in-process with an event log that refuses writes on
+demand, so the 503-then-retry path can be exercised without breaking the
+running server's disk.
+"""
+import json
+import time
+from . import WEBHOOK_SECRET, add_test_result
+from services.event_log import EventLogError
+
+
+class RefusingEventLog:
+    """Event log stand-in failing the operations named in `refusing`"""
+
+    def __init__(self, log):
+        self.log = log
+        self.refusing = ()
+
+    def append(self, *args, **kwargs):
+        if 'append' in self.refusing:
+            raise EventLogError('forced failure')
+        return self.log.append(*args, **kwargs)
+
+    def wait(self, *args, **kwargs):
+        if 'wait' in self.refusing:
+            raise EventLogError('forced failure')
+        return self.log.wait(*args, **kwargs)
+
+
+def test_idempotency_after_refusal():
+    """Test that deliveries refused with 503 are processed again when retried"""
+    try:
+        import server
+    except Exception as e:
+        add_test_result('idempotency', False, f"Could not import server: {e}")
+        return
+
+    log = server.event_log
+    server.event_log = RefusingEventLog(log)
+    client = server.app.test_client()
+    try:
+        url = f"/webhook?uid=test-idempotency-user&key={WEBHOOK_SECRET}"
+        event = {'type': 'new_memory_create_failed', 'error': f'refused {time.time()}'}
+        server.event_log.refusing = ('append',)
+        refused = client.post(url, json=event)
+        server.event_log.refusing = ()
+        retried = client.post(url, json=event)
+        replayed = client.post(url, json=event)
+        add_test_result(
+            'idempotency (webhook retry after 503)',
+            refused.status_code == 503 and retried.status_code == 200
+            and 'Idempotent-Replayed' not in retried.headers
+            and replayed.headers.get('Idempotent-Replayed') == 'true',
+            f"Expected 503, then a processed 200, then a replay; got {refused.status_code}, "
+            f"{retried.status_code} {dict(retried.headers)}, {replayed.status_code} {dict(replayed.headers)}"
+        )
+
+        # The batch's final fsync wait fails after its items were handled
+        batch_url = f"/webhook/batch?uid=test-idempotency-user&key={WEBHOOK_SECRET}"
+        line = json.dumps({'type': 'new_memory_create_failed', 'error': f'refused batch {time.time()}'})
+        server.event_log.refusing = ('wait',)
+        refused = client.post(batch_url, data=line, headers={'Content-Type': 'application/x-ndjson'})
+        server.event_log.refusing = ()
+        retried = client.post(batch_url, data=line, headers={'Content-Type': 'application/x-ndjson'})
+        results = retried.get_json().get('results', []) if retried.status_code == 200 else []
+        add_test_result(
+            'idempotency (batch retry after 503)',
+            refused.status_code == 503 and len(results) == 1 and results[0]['status'] == 200
+            and not results[0].get('replayed'),
+            f"Expected 503, then the item processed again; got {refused.status_code}, "
+            f"{retried.status_code} {results}"
+        )
+    except Exception as e:
+        add_test_result('idempotency', False, f"Error: {str(e)}")
+    finally:
+        server.event_log = log
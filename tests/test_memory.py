@@ -114,6 +114,32 @@ def test_memory_events():
         {"message": "Memory synced"}
     )
 
+    # Test redelivered memory is answered from the idempotency cache
+    try:
+        response = requests.post(
+            f"{WEBHOOK_URL}?uid=test-user-1&key={WEBHOOK_SECRET}",
+            json={
+                "type": "memory_backward_synced",
+                "memory": {
+                    "id": "test-memory-1",
+                    "sync_status": "completed"
+                }
+            }
+        )
+        add_test_result(
+            'memory_backward_synced (redelivery)',
+            response.status_code == 200 and
+            response.json() == {"message": "Memory synced"} and
+            response.headers.get('Idempotent-Replayed') == 'true',
+            f"Expected replayed 200 response, got {response.status_code} {response.headers}"
+        )
+    except Exception as e:
+        add_test_result(
+            'memory_backward_synced (redelivery)',
+            False,
+            f"Request failed: {str(e)}"
+        )
+
     # Test missing memory data
     send_test_webhook(
         'memory_created (missing data)',
@@ -124,6 +150,44 @@ def test_memory_events():
         {"error": "Missing memory data"}
     )
 
+    # Test list elements that are not objects
+    send_test_webhook(
+        'memory_created (invalid action item)',
+        {
+            "type": "memory_created",
+            "memory": {
+                "id": "test-memory-invalid-items",
+                "created_at": "2024-03-19T12:00:00Z",
+                "transcript": "",
+                "transcript_segments": [],
+                "structured": {
+                    "title": "", "overview": "", "emoji": "", "category": "",
+                    "action_items": ["x"], "events": []
+                }
+            }
+        },
+        400,
+        {"error": "Invalid type for structured.action_items item"}
+    )
+    send_test_webhook(
+        'memory_created (invalid transcript segment)',
+        {
+            "type": "memory_created",
+            "memory": {
+                "id": "test-memory-invalid-items",
+                "created_at": "2024-03-19T12:00:00Z",
+                "transcript": "",
+                "transcript_segments": [{"text": "ok"}, 3],
+                "structured": {
+                    "title": "", "overview": "", "emoji": "", "category": "",
+                    "action_items": [], "events": []
+                }
+            }
+        },
+        400,
+        {"error": "Invalid type for transcript_segments item"}
+    )
+
     # Test invalid memory format
     send_test_webhook(
         'memory_created (invalid memory)',
@@ -0,0 +1,101 @@
+"""
+Omi App Webhook Server - Opus Decode Tests
+
+Drives the decode stage in-process with the stub decoder (one 20 ms frame
+of silence per packet), so neither libopus nor the webhook server is needed.
+"""
+import io
+from . import add_test_result
+from services.audio_stream import AudioSink, AudioStreamError, read_audio_body
+from services.opus_decoder import DecoderBusy, OpusDecodePool, OpusDecodeStage
+
+# One 20 ms frame of 16 kHz PCM
+FRAME_BYTES = 640
+
+
+class CollectingSink(AudioSink):
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+        self.aborted = False
+
+    def write(self, chunk):
+        self.data += chunk
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def decode(pool, body, chunk_size=7):
+    """Stream `body` through a decode stage; returns (sink, error message)"""
+    sink = CollectingSink()
+    try:
+        read_audio_body(io.BytesIO(body), len(body), OpusDecodeStage(sink, pool, 'test-opus-user', 16000),
+                        'opus', chunk_size=chunk_size)
+    except AudioStreamError as e:
+        return sink, e.message
+    return sink, None
+
+
+def test_opus_decoder():
+    """Test both Opus framings, batching, broken framing and slot release"""
+    framed = b''.join(len(packet).to_bytes(2, 'big') + packet for packet in (b'abc', b'defgh', b'ij'))
+    # One backlog slot: every stage below fails with DecoderBusy unless the previous one released it
+    length_pool = OpusDecodePool('stub', workers=1, max_pending=1, framing='length')
+    packet_pool = OpusDecodePool('stub', workers=1, max_pending=1, framing='packet')
+    try:
+        sink, error = decode(length_pool, framed)
+        add_test_result(
+            'opus decode (length framing)',
+            error is None and len(sink.data) == 3 * FRAME_BYTES and sink.closed,
+            f"Expected three frames of PCM, got {len(sink.data)} bytes, error {error}"
+        )
+
+        batched_pool = OpusDecodePool('stub', workers=1, max_pending=1, framing='length')
+        try:
+            sink = CollectingSink()
+            stage = OpusDecodeStage(sink, batched_pool, 'test-opus-user', 16000, batch_packets=2)
+            stage.write(framed)
+            decoded_early = len(sink.data)
+            stage.close()
+        finally:
+            batched_pool.shutdown()
+        add_test_result(
+            'opus decode (batches)',
+            decoded_early == 3 * FRAME_BYTES and len(sink.data) == 3 * FRAME_BYTES,
+            f"Expected full batches to decode while streaming, got {decoded_early} bytes before close"
+        )
+
+        sink, error = decode(length_pool, framed[:-1])
+        add_test_result(
+            'opus decode (broken framing)',
+            error == 'Invalid Opus audio data' and sink.aborted,
+            f"Expected 400 Invalid Opus audio data, got {error}"
+        )
+
+        sink, error = decode(packet_pool, b'opus_data')
+        add_test_result(
+            'opus decode (packet framing)',
+            error is None and len(sink.data) == FRAME_BYTES,
+            f"Expected the body decoded as one packet, got {len(sink.data)} bytes, error {error}"
+        )
+
+        try:
+            OpusDecodeStage(CollectingSink(), packet_pool, 'test-opus-user', 16000).abort()
+            OpusDecodeStage(CollectingSink(), length_pool, 'test-opus-user', 16000).abort()
+            released = True
+        except DecoderBusy:
+            released = False
+        add_test_result(
+            'opus decode (slot release)',
+            released,
+            "Expected every request to release its backlog slot"
+        )
+    except Exception as e:
+        add_test_result('opus decode', False, f"Error: {str(e)}")
+    finally:
+        length_pool.shutdown()
+        packet_pool.shutdown()
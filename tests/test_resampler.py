@@ -0,0 +1,59 @@
+"""
+Omi App Webhook Server - Resampler Tests
+
+Runs resampling stages in-process; no webhook server needed.
+"""
+import numpy as np
+from . import add_test_result
+from services.audio_stream import AudioSink
+from services.resampler import PolyphaseResampler, ResamplerStore, ResampleStage
+
+
+class CollectingSink(AudioSink):
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, chunk):
+        self.data += chunk
+
+
+def upload(store, uid, samples, accept=True):
+    """Run one upload through a resampling stage and return its output"""
+    sink = CollectingSink()
+    stage = ResampleStage(sink, store, uid, 8000)
+    for start in range(0, len(samples), 1000):
+        stage.write(samples[start:start + 1000].tobytes())
+    if accept:
+        stage.close()
+    else:
+        stage.abort()
+    return bytes(sink.data)
+
+
+def test_resampler():
+    """Test filter state carried across uploads and left untouched by rejected ones"""
+    t = np.arange(8000) / 8000
+    samples = (np.sin(2 * np.pi * 300 * t) * 8000).astype('<i2')
+    expected = PolyphaseResampler(8000, 16000).process(samples).tobytes()
+
+    store = ResamplerStore(to_rate=16000)
+    first = upload(store, 'test-resampler-user', samples[:4000])
+    rejected = upload(store, 'test-resampler-user', samples[4000:6000], accept=False)
+    second = upload(store, 'test-resampler-user', samples[4000:])
+    add_test_result(
+        'resampler (state across uploads)',
+        first + second == expected and len(rejected) > 0,
+        f"Expected two uploads to match one-shot resampling, got {len(first + second)} of {len(expected)} bytes"
+    )
+
+    # Two requests in flight for one user each start from the stored state
+    store = ResamplerStore(to_rate=16000)
+    left = ResampleStage(CollectingSink(), store, 'test-resampler-user', 8000)
+    right = ResampleStage(CollectingSink(), store, 'test-resampler-user', 8000)
+    left.write(samples[:4000].tobytes())
+    right.write(samples[:4000].tobytes())
+    add_test_result(
+        'resampler (concurrent requests)',
+        left.resampler is not right.resampler and left.sink.data == right.sink.data,
+        "Expected concurrent requests to resample with separate state"
+    )
@@ -0,0 +1,69 @@
+"""
+Omi App Webhook Server - Search Endpoint Tests
+"""
+import time
+import requests
+from . import WEBHOOK_URL, WEBHOOK_SECRET, add_test_result
+
+SEARCH_URL = WEBHOOK_URL.replace('/webhook', '/search')
+
+def test_search_endpoint():
+    """Test the search endpoint - indexing, scoping and failure cases"""
+    try:
+        # Index a transcript segment with a distinctive word
+        requests.post(
+            f"{WEBHOOK_URL}?uid=test-search-user&key={WEBHOOK_SECRET}&session_id=test-search-session",
+            json=[{
+                "text": "The zebrafish tank needs cleaning",
+                "speaker": "SPEAKER_00",
+                "speakerId": 0,
+                "is_user": True,
+                "start": 0.0,
+                "end": 3.0
+            }]
+        )
+
+        # Indexing happens in the background, so poll briefly
+        results = []
+        for _ in range(20):
+            response = requests.get(
+                f"{SEARCH_URL}?uid=test-search-user&key={WEBHOOK_SECRET}&q=zebrafish"
+            )
+            results = response.json().get('results', []) if response.status_code == 200 else []
+            if results:
+                break
+            time.sleep(0.1)
+        add_test_result(
+            'search (indexed segment)',
+            len(results) == 1 and results[0].get('session_id') == 'test-search-session',
+            f"Expected 1 result for test-search-session, got {results}"
+        )
+
+        # Other users do not see the segment
+        response = requests.get(f"{SEARCH_URL}?uid=test-user-1&key={WEBHOOK_SECRET}&q=zebrafish")
+        add_test_result(
+            'search (uid scoping)',
+            response.status_code == 200 and response.json().get('results') == [],
+            f"Expected no results, got {response.status_code} {response.text}"
+        )
+
+        # Failure cases
+        response = requests.get(f"{SEARCH_URL}?uid=test-search-user&key=invalid&q=zebrafish")
+        add_test_result(
+            'search (invalid key)',
+            response.status_code == 401,
+            f"Expected 401, got {response.status_code}"
+        )
+
+        response = requests.get(f"{SEARCH_URL}?uid=test-search-user&key={WEBHOOK_SECRET}")
+        add_test_result(
+            'search (missing query)',
+            response.status_code == 400,
+            f"Expected 400, got {response.status_code}"
+        )
+    except Exception as e:
+        add_test_result(
+            'search',
+            False,
+            f"Request failed: {str(e)}"
+        )
@@ -17,6 +17,20 @@ def test_system_events():
         {"error": "Unknown event type"}
     )
 
+    # Non-string types are unknown, not server errors
+    send_test_webhook(
+        'list_event_type',
+        {"type": ["ping"]},
+        400,
+        {"error": "Unknown event type"}
+    )
+    send_test_webhook(
+        'object_event_type',
+        {"type": {"name": "ping"}},
+        400,
+        {"error": "Unknown event type"}
+    )
+
 def test_authentication():
     """Test authentication cases"""
     headers = {'Content-Type': 'application/json'}
@@ -0,0 +1,77 @@
+"""
+Omi App Webhook Server - Transcript Merge Tests
+
+Merges segments into in-process sessions; no webhook server needed.
+"""
+from . import add_test_result
+from services.transcript_store import TranscriptStore
+
+
+def segment(start, end, text, speaker_id=0):
+    return {
+        'text': text, 'speaker': f'SPEAKER_{speaker_id:02d}', 'speakerId': speaker_id,
+        'is_user': speaker_id == 0, 'start': start, 'end': end
+    }
+
+
+def test_transcript_store():
+    """Test repeats, updates, replacements across shifted starts and removed rows"""
+    store = TranscriptStore()
+    uid, session_id = 'test-merge-user', 'test-merge-session'
+    session = lambda: store.get(uid, session_id)
+
+    first = store.merge(uid, session_id, [segment(0.0, 5.0, 'Hello'), segment(5.0, 10.0, 'there')])
+    repeat = store.merge(uid, session_id, [segment(0.0, 5.0, 'Hello')])
+    add_test_result(
+        'transcript merge (exact repeat)',
+        first.inserted == 2 and repeat.duplicates == 1 and not repeat.segments and not repeat.removed
+        and len(session()) == 2,
+        f"Expected the repeat dropped, got {repeat.inserted} inserted, {repeat.duplicates} duplicates"
+    )
+
+    update = store.merge(uid, session_id, [segment(5.0, 10.0, 'there, friend')])
+    add_test_result(
+        'transcript merge (same start)',
+        update.updated == 1 and update.segments == [segment(5.0, 10.0, 'there, friend')]
+        and not update.removed and len(session()) == 2,
+        f"Expected the row updated in place, got {update.segments}, removed {update.removed}"
+    )
+
+    shifted = store.merge(uid, session_id, [segment(5.5, 10.0, 'there, my friend')])
+    add_test_result(
+        'transcript merge (shifted start)',
+        shifted.updated == 1 and shifted.removed == [5.0]
+        and shifted.segments == [segment(5.5, 10.0, 'there, my friend')]
+        and [row['start'] for row in session().segments()] == [0.0, 5.5],
+        f"Expected the row at 5.0 replaced by 5.5, got {shifted.segments}, removed {shifted.removed}"
+    )
+
+    # One longer version replaces both earlier rows of the same speaker
+    spanning = store.merge(uid, session_id, [segment(0.0, 10.0, 'Hello there, my friend')])
+    add_test_result(
+        'transcript merge (spanning version)',
+        spanning.removed == [5.5] and spanning.segments == [segment(0.0, 10.0, 'Hello there, my friend')]
+        and session().text() == 'Hello there, my friend',
+        f"Expected both rows replaced, got {spanning.segments}, removed {spanning.removed}"
+    )
+
+    # Another speaker talking over the same time keeps its own row; late segments are sorted in
+    other = store.merge(uid, session_id, [segment(2.0, 8.0, 'Hi', speaker_id=1), segment(-3.0, -1.0, 'Before')])
+    add_test_result(
+        'transcript merge (other speaker)',
+        other.inserted == 2 and not other.removed
+        and [row['start'] for row in session().segments()] == [-3.0, 0.0, 2.0],
+        f"Expected two inserted rows in start order, got {session().segments()}"
+    )
+
+    try:
+        too_big = dict(segment(21.0, 22.0, 'Too big'), speakerId=2 ** 64)
+        store.merge(uid, session_id, [segment(20.0, 21.0, 'Fits'), too_big])
+        rejected = False
+    except OverflowError:
+        rejected = True
+    add_test_result(
+        'transcript merge (rejected webhook)',
+        rejected and len(session()) == 3 and session().stats()['received'] == 8,
+        f"Expected a speakerId beyond 64 bits to leave the session untouched, got {session().stats()}"
+    )